@@ -1,49 +1,169 @@
 from email.policy import default
 from genericpath import isdir, isfile
 import click
+import itertools
 import os
 import datetime
+import pathlib
+import time
 
 from aacini import __version__ as version
 
 # File information extraction functions
-from aacini.utils.functions import list_file_path
-from aacini.utils.functions import list_files
-from aacini.utils.functions import get_file_name
-from aacini.utils.functions import get_extension
-from aacini.utils.functions import get_absolute_path
 from aacini.utils.functions import get_patient_id
-from aacini.utils.functions import get_file_size
 from aacini.utils.functions import create_sha256
-from aacini.utils.functions import get_hts
+from aacini.utils.functions import make_file_entry
+from aacini.utils.functions import scan_directory
+from aacini.utils.functions import find_linked_entries
+from aacini.utils.functions import share_linked_hashes
 
 # Database infrastructure functions
 from aacini.utils.functions import create_file_information_table
 from aacini.utils.functions import create_essential_files_missing_table
 from aacini.utils.functions import create_unmatching_hash_table
+from aacini.utils.functions import create_run_tables
+from aacini.utils.functions import create_file_integrity_table
+from aacini.utils.functions import create_file_content_table
+from aacini.utils.functions import create_observation_tables
+from aacini.utils.functions import create_aggregate_table
 
 # Database interaction functions
-from aacini.utils.functions import record_file_info
 from aacini.utils.functions import count_records
+from aacini.utils.functions import process_entry
+from aacini.utils.functions import record_integrity
 from aacini.utils.functions import check_essential_files
 
+# Run tracking functions
+from aacini.utils.functions import start_run
+from aacini.utils.functions import find_resumable_run
+from aacini.utils.functions import finish_run
+from aacini.utils.functions import record_checkpoint
+from aacini.utils.functions import list_checkpoints
+from aacini.utils.functions import list_run_hashes
+from aacini.utils.functions import get_run_patient
+from aacini.utils.functions import start_run_patient
+from aacini.utils.functions import complete_run_patient
+
+# Integrity functions
+from aacini.utils.functions import is_compressed_hts
+from aacini.utils.functions import check_gzip_eof
+from aacini.utils.functions import check_files_integrity
+
 # Quality control & Stats functions
 from aacini.utils.functions import list_patients_missing_files
 from aacini.utils.functions import list_unmatching_hashes
 from aacini.utils.functions import list_empty_files
 from aacini.utils.functions import list_missing_files
+from aacini.utils.functions import list_truncated_files
+from aacini.utils.functions import list_aggregates
 from aacini.utils.functions import define_status
-from aacini.utils.functions import compare_hash
+
+# Query functions
+from aacini.utils.functions import epoch_to_iso
+from aacini.utils.functions import format_size
+from aacini.utils.functions import query_file_information
+from aacini.utils.functions import list_changed_files
+from aacini.utils.functions import format_changed_files
+from aacini.utils.functions import format_query_page
 
 # Report creation functions
 from aacini.utils.functions import create_patient_summary
 from aacini.utils.functions import create_report_summary
 from aacini.utils.functions import export_to_txt
 
+# I/O scheduling functions
+from aacini.utils.scheduler import hash_files
+
+# Throttling functions
+from aacini.utils.throttle import IOThrottle
+from aacini.utils.throttle import lower_priority
+
+# Progress functions
+from aacini.utils.progress import ProgressTracker
+from aacini.utils.progress import ProgressEvents
+
+# Work queue functions
+from aacini.utils.workqueue import create_queue_tables
+from aacini.utils.workqueue import enqueue_files
+from aacini.utils.workqueue import distributed_hash_files
+from aacini.utils.workqueue import run_worker
+
+# FASTQ functions
+from aacini.utils.fastq import analyze_fastq_files
+from aacini.utils.fastq import record_fastq_stats
+from aacini.utils.fastq import list_fastq_mismatches
+
+# Copy number and gene metrics functions
+from aacini.utils.metrics import create_copy_number_table
+from aacini.utils.metrics import create_gene_metrics_table
+from aacini.utils.metrics import parse_output_files
+from aacini.utils.metrics import record_output_summaries
+
+# Header metadata functions
+from aacini.utils.headers import create_header_tables
+from aacini.utils.headers import read_header_metadata
+from aacini.utils.headers import list_expected_names
+from aacini.utils.headers import compare_samples
+from aacini.utils.headers import record_sample_check
+from aacini.utils.headers import list_sample_mismatches
+
+# Catalog connection functions
+from aacini.utils.catalog import ticket_lock
+from aacini.utils.catalog import DatabaseBusyError
+
+# Analyzer functions
+from aacini.utils.analyzers import registered_analyzers
+from aacini.utils.analyzers import create_analysis_cache_table
+from aacini.utils.analyzers import evict_cache
+from aacini.utils.analyzers import invalidate_cache
+
+# Digest index functions
+from aacini.utils.digest_index import export_index
+
+# Bundle functions
+from aacini.utils.bundles import MemberEntry
+from aacini.utils.bundles import split_bundles
+from aacini.utils.bundles import split_member_location
+from aacini.utils.bundles import stream_bundles
+
+# Export functions
+from aacini.utils.export import export_catalog
+
+# Merkle tree functions
+from aacini.utils.merkle import create_merkle_tables
+from aacini.utils.merkle import build_merkle_tree
+from aacini.utils.merkle import verify_merkle_tree
+
+# Copy verification functions
+from aacini.utils.mirror import verify_copy
+
+# Archive functions
+from aacini.utils.archive import list_old_tickets
+from aacini.utils.archive import get_period
+from aacini.utils.archive import archive_tickets
+from aacini.utils.archive import compact_database
+from aacini.utils.archive import list_archives
+
+# Watcher functions
+from aacini.utils.watch import create_watcher
+from aacini.utils.watch import StabilityTracker
+
 # Updating functions
 from aacini.utils.functions import update_record_status
 
-@click.group()
+class CatalogGroup(click.Group):
+    """
+    Group of commands that reports a database left locked by another
+    process as an error of the command instead of a traceback.
+    """
+
+    def invoke(self, ctx):
+        try:
+            return super().invoke(ctx)
+        except DatabaseBusyError as error:
+            raise click.ClickException(str(error))
+
+@click.group(cls=CatalogGroup)
 @click.version_option(version=version, prog_name="aacini")
 def cli():
     """
@@ -56,7 +176,73 @@ def cli():
 @click.command("extract")
 @click.option("--input_path", "-i", help="Specify path.")
 @click.option("--db", "-db", help="Specify database name.", default="aacini.db")
-def extract_file_info(input_path, db):
+@click.option("--resume", "-r", is_flag=True, 
+    help="Resume the last interrupted run of the ticket.")
+@click.option("--small_workers", default=4, show_default=True,
+    help="Workers hashing small files (e.g. indexes).")
+@click.option("--large_workers", default=1, show_default=True,
+    help="Workers hashing large files.")
+@click.option("--large_file_size", default=64, show_default=True,
+    help="Size in MB from which a file is hashed by the large workers.")
+@click.option("--fiemap", is_flag=True,
+    help="Order files by physical offset on disk where available.")
+@click.option("--xattr_cache", "-x", is_flag=True,
+    help="Reuse and store hashes in extended attributes of the files.")
+@click.option("--rehash", is_flag=True,
+    help="Do not trust hashes in extended attributes, read the files again.")
+@click.option("--deep_check", is_flag=True,
+    help="Scan whole compressed files instead of only their EOF block.")
+@click.option("--check_workers", default=4, show_default=True,
+    help="Workers checking the integrity of compressed files.")
+@click.option("--max_rate", default=0.0, show_default=True,
+    help="Total MB/s read by the hashing workers (0: unlimited).")
+@click.option("--max_open_files", default=0, show_default=True,
+    help="Files open at the same time by the hashing workers (0: unlimited).")
+@click.option("--nice", default=0, show_default=True, type=click.IntRange(0, 19),
+    help="Increment of the CPU nice value of the workers.")
+@click.option("--ionice", type=click.Choice(["best-effort", "idle"]),
+    help="I/O scheduling class of the workers (Linux).")
+@click.option("--progress_fd", type=int,
+    help="File descriptor to write progress events as JSON lines.")
+@click.option("--progress_file", 
+    help="File to append progress events as JSON lines.")
+@click.option("--queue", "-q",
+    help="Queue database on a shared mount, files are hashed by workers.")
+@click.option("--queue_poll", default=2.0, show_default=True,
+    help="Seconds between reads of the queue for results.")
+@click.option("--queue_timeout", default=60.0, show_default=True,
+    help="Seconds without results before the files no worker took are hashed locally.")
+@click.option("--bundles", is_flag=True,
+    help="Hash the members of .tar, .tar.gz and .zip files without unpacking them.")
+@click.option("--fastq_stats", is_flag=True,
+    help="Count the reads and bases of FASTQ files and compare R1 with R2.")
+@click.option("--fastq_workers", default=2, show_default=True,
+    help="Processes reading FASTQ files.")
+@click.option("--fastq_threads", default=2, show_default=True,
+    help="Threads decompressing each FASTQ file (with pigz).")
+@click.option("--parse_outputs", is_flag=True,
+    help="Summarize .cns, .cgh and .gene_metrics files into tables.")
+@click.option("--check_samples", is_flag=True,
+    help="Compare the samples in VCF, CRAM, BAM and MultiQC headers with the patient.")
+@click.option("--cache_max_entries", default=1000000, show_default=True,
+    help="Analysis results kept in the cache, least recently used evicted first.")
+@click.option("--cache_max_mb", default=512, show_default=True,
+    help="Size in MB of the analysis results kept in the cache.")
+@click.option("--lock_wait", default=0.0, show_default=True,
+    help="Seconds to wait for another extract of the same ticket (0: fail at once).")
+@click.option("--follow_links", is_flag=True,
+    help="Walk directories behind symbolic links (loops are walked once).")
+@click.option("--one_file_system", is_flag=True,
+    help="Skip files and directories on another device than the patient directory.")
+@click.option("--index",
+    help="Digest index file to update after the run (see export-index).")
+def extract_file_info(input_path, db, resume, small_workers, 
+    large_workers, large_file_size, fiemap, xattr_cache, rehash,
+    deep_check, check_workers, max_rate, max_open_files, nice, ionice,
+    progress_fd, progress_file, queue, queue_poll, queue_timeout, bundles,
+    fastq_stats, fastq_workers, fastq_threads, parse_outputs, check_samples,
+    cache_max_entries, cache_max_mb, lock_wait, follow_links,
+    one_file_system, index):
     """
     Extract information of file and directory structure.
 
@@ -66,87 +252,385 @@ def extract_file_info(input_path, db):
     # Get ticket name
     ticket = os.path.basename(input_path)
     print("\nTicket:", ticket)
+
+    # Only one process extracts a ticket into a database at a time, the
+    # lock is released when the command ends
+    lock_file, lock_owner = click.get_current_context().with_resource(
+        ticket_lock(database=db, ticket=ticket, wait=lock_wait))
+    if lock_file is None:
+        raise click.ClickException(
+            f"Ticket {ticket} is being extracted by another process ({lock_owner}).")
     
     # List directories
     directory_list = os.listdir(input_path)
     print("\nPatients to process:", len(directory_list),"\n")
-    
-    # Establish transaction datetime
-    today_readable = datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")
-    today_string = datetime.datetime.today().strftime("%d%m%Y_%H%M%S") 
+
+    # Create run tables if they do not exist
+    create_run_tables(database=db)
+
+    # Look for an interrupted run of the ticket to resume
+    resumable_run = None
+    if resume:
+        resumable_run = find_resumable_run(database=db, ticket=ticket)
+        if resumable_run is None:
+            click.secho("No interrupted run to resume, starting a new run.", 
+                fg="blue")
+
+    # Establish transaction datetime and run ID. A resumed run keeps the
+    # datetime of the interrupted run so the report is the same.
+    if resumable_run is not None:
+        run_id, today_readable, today_string = resumable_run
+        print("Resuming run:", run_id, "\n")
+    else:
+        today_readable = datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")
+        today_string = datetime.datetime.today().strftime("%d%m%Y_%H%M%S") 
+        run_id = start_run(
+            database=db,
+            ticket=ticket,
+            input_path=input_path,
+            start_date=today_readable,
+            start_string=today_string)
 
     # Return message if directory is empty
     if len(directory_list) == 0:
         click.secho("Found nothing to sort! Bye!", fg="blue")
 
+    # Lower the priorities before the workers are started so they 
+    # inherit them, and share the I/O limits between all the workers
+    priorities = lower_priority(nice=nice, io_class=ionice)
+    throttle = None
+    if max_rate > 0 or max_open_files > 0 or priorities:
+        throttle = IOThrottle(
+            rate= max_rate*1024*1024 if max_rate > 0 else None,
+            max_open_files= max_open_files if max_open_files > 0 else None)
+
+    # List the files of every patient directory as compact file entries
+    # first, so the progress of the ticket is weighted by bytes
+    ticket_entries = {}
+    ticket_bytes = 0
+    done_bytes = 0
+    queued_entries = []
+    for directory in directory_list:
+        directory_path = os.path.join(input_path, directory)
+        patient_id = get_patient_id(directory_path)
+        ticket_entries[directory] = scan_directory(
+            directory_path= directory_path, 
+            patient_id= patient_id,
+            follow_links= follow_links,
+            one_file_system= one_file_system)
+        ticket_bytes += sum(entry.size for entry in ticket_entries[directory])
+
+        # Files completed before the run was interrupted are already done
+        completed_files = list_checkpoints(
+            database=db, 
+            run_id=run_id, 
+            patient_id=patient_id)
+        done_bytes += sum(entry.size for entry in ticket_entries[directory] 
+            if entry.path in completed_files)
+        queued_entries += [entry for entry in ticket_entries[directory]
+            if entry.path not in completed_files]
+
+    # Bundles are streamed by the coordinator, not by the workers
+    if bundles:
+        queued_entries = split_bundles(queued_entries)[0]
+
+    # Files linked to a file listed before them (same device and inode)
+    # are not read again, they take the hash of that file
+    linked_paths = find_linked_entries(queued_entries)
+    queued_entries = [entry for entry in queued_entries 
+        if entry.path not in linked_paths]
+    linked_hashes = {}
+
+    # Enqueue the files of the whole ticket so the workers can hash 
+    # ahead of the patient being recorded
+    run_key = f"{os.path.abspath(db)}:{run_id}"
+    if queue is not None:
+        create_queue_tables(queue=queue)
+        enqueued = enqueue_files(
+            queue= queue, 
+            run_key= run_key, 
+            file_entries= queued_entries)
+        print(f"Files enqueued for the workers: {enqueued}\n")
+
+    # Report the progress next to the progress bar and as events
+    progress = ProgressTracker(
+        ticket= ticket,
+        total_bytes= ticket_bytes,
+        total_files= sum(len(entries) for entries in ticket_entries.values()),
+        done_bytes= done_bytes,
+        events= ProgressEvents(fd=progress_fd, path=progress_file),
+        run_id= run_id)
+
     # Instantiate missing files list
     missing_files_list = []
 
     # List paths of directories to process
     for directory in directory_list:
         directory_path = os.path.join(input_path, directory)
+        patient_id = get_patient_id(directory_path)
 
-        # List files and paths in the directory
-        file_list = list_files(directory_path= directory_path)
-        file_path_list = list_file_path(directory_path= directory_path)
+        # Take the files listed for the directory
+        file_entries = ticket_entries[directory]
+        file_list = {entry.name for entry in file_entries}
 
         # Count files found in the directory
-        found_files = len(file_list)
+        found_files = len(file_entries)
 
         # Create tables if they do not exist
         create_file_information_table(database=db)
         create_unmatching_hash_table(database=db)
+        create_file_integrity_table(database=db)
+        create_observation_tables(database=db)
+        create_aggregate_table(database=db)
 
-        # Count past records of the patient
-        past_records = count_records(
-            database=db,
-            table="file_information", 
-            column="patient_id",
-            value=directory)
+        # Count past records of the patient. If the patient was already
+        # started in the run, keep the count from before the interruption.
+        run_patient = get_run_patient(
+            database=db, 
+            run_id=run_id, 
+            patient_id=patient_id)
+
+        if run_patient is None:
+            past_records = count_records(
+                database=db,
+                table="file_information", 
+                column="patient_id",
+                value=directory)
+            start_run_patient(
+                database=db,
+                run_id=run_id,
+                patient_id=patient_id,
+                past_records=past_records)
+        else:
+            past_records = run_patient[0]
+
+        # List files completed before the run was interrupted
+        completed_files = list_checkpoints(
+            database=db, 
+            run_id=run_id, 
+            patient_id=patient_id)
+
+        # Separate the bundles whose members are hashed, their members
+        # are only known once the bundles are read
+        bundle_entries = []
+        if bundles:
+            bundle_entries = split_bundles(file_entries)[1]
+
+        # Members of bundles completed before the run was interrupted
+        file_list |= {os.path.basename(file_location) 
+            for file_location in completed_files 
+            if split_member_location(file_location) is not None}
 
         # Look if files are missing from previously recorded
-        missing_files_list.append(list_missing_files(
-            database= db, 
-            directory= directory,
-            file_list= file_list))
+        if bundle_entries == [] or (run_patient is not None and run_patient[2] == 1):
+            missing_files_list.append(list_missing_files(
+                database= db, 
+                directory= directory,
+                file_list= file_list))
+
+        # Skip patients completed before the run was interrupted
+        if run_patient is not None and run_patient[2] == 1:
+            print("\tPatient:", patient_id, "(completed)")
+            continue
+
+        # Skip files already completed in this run
+        files_to_hash = [entry for entry in file_entries 
+            if entry.path not in completed_files]
+        bytes_to_hash = sum(entry.size for entry in files_to_hash)
+        bundles_to_stream = [entry for entry in bundle_entries
+            if entry.path not in completed_files]
+        if bundles:
+            files_to_hash = split_bundles(files_to_hash)[0]
+        linked_entries = [entry for entry in files_to_hash 
+            if entry.path in linked_paths]
+        files_to_hash = [entry for entry in files_to_hash 
+            if entry.path not in linked_paths]
+
+        progress.start_patient(
+            patient_id= patient_id,
+            total_bytes= sum(entry.size for entry in file_entries),
+            total_files= found_files,
+            done_bytes= sum(entry.size for entry in file_entries) - bytes_to_hash)
 
-        # Insert a progress bar per patient directory to process
-        with click.progressbar(file_path_list, fill_char="|", 
-                                empty_char="") as files_to_process:
+        # Hash the files in physical order in the small and large lanes,
+        # or collect the hashes posted by the workers
+        if queue is not None:
+            hashed_files = distributed_hash_files(
+                queue= queue,
+                run_key= run_key,
+                file_entries= files_to_hash,
+                poll_interval= queue_poll,
+                idle_timeout= queue_timeout,
+                xattr_cache= xattr_cache,
+                trust_cache= not rehash,
+                throttle= throttle)
+        else:
+            hashed_files = hash_files(
+                file_entries= files_to_hash,
+                small_workers= small_workers,
+                large_workers= large_workers,
+                large_file_size= large_file_size*1024*1024,
+                use_fiemap= fiemap,
+                xattr_cache= xattr_cache,
+                trust_cache= not rehash,
+                throttle= throttle)
+
+        # Add the linked files with the hash of the file they link to,
+        # and keep the hashes of the files linked from other patients
+        if linked_paths:
+            hashed_files = share_linked_hashes(
+                hashed_files= hashed_files,
+                linked_entries= linked_entries,
+                linked_paths= linked_paths,
+                shared_hashes= linked_hashes,
+                xattr_cache= xattr_cache,
+                trust_cache= not rehash,
+                throttle= throttle)
+
+        # Names the samples of the patient may have in the file headers
+        if check_samples:
+            create_header_tables(database=db)
+            expected_names = list_expected_names(
+                patient_id= patient_id,
+                patient_directory= directory_path,
+                file_entries= file_entries)
+
+        # Hash the members of the bundles in a single read of each bundle
+        if bundles_to_stream:
+            hashed_files = itertools.chain(hashed_files, 
+                stream_bundles(bundles_to_stream, throttle=throttle))
+        streamed_bytes = {}
+
+        # Insert a progress bar per patient directory to process, it
+        # advances by the bytes of each file and shows the ticket progress
+        with click.progressbar(length=bytes_to_hash, fill_char="|", 
+                                empty_char="", show_eta=True,
+                                item_show_func=progress.describe) as progress_bar:
             
-            # Iterate through the files in the file list
-            for file in files_to_process:
-                
-                # Extract information from the file list
-                patient_id = get_patient_id(directory_path)
-                filename = get_file_name(file)
-                extension = get_extension(file)
-                size = get_file_size(file)
-                hash256 = create_sha256(file)
-                abs_path = get_absolute_path(file)
-                hts = get_hts(file)                                    
-
-                # Compare hashes
-                compare_hash(
+            # Iterate through the files as they are hashed
+            for entry, hash256 in hashed_files:
+
+                # Members of bundles advance the progress by the bytes of
+                # the bundle read for them, the bundle by the bytes left
+                progress_bytes = entry.size
+                if isinstance(entry, MemberEntry):
+                    progress_bytes = entry.read_bytes
+                    streamed_bytes[entry.bundle] = streamed_bytes.get(
+                        entry.bundle, 0) + progress_bytes
+                    file_list.add(entry.name)
+                    found_files += 1
+                elif entry.path in streamed_bytes:
+                    progress_bytes -= streamed_bytes.pop(entry.path)
+
+                # Members completed before the run was interrupted
+                if entry.path in completed_files:
+                    progress.file_done(file_location= entry.path, size= progress_bytes)
+                    progress_bar.update(progress_bytes, entry)
+                    continue
+
+                # Compare and record the file information
+                abs_path, hash256, size = process_entry(
                     database= db,
-                    patient_id= patient_id,
-                    file_name= filename,
+                    ticket= ticket,
+                    entry= entry,
                     current_date= today_readable,
-                    current_hash= hash256,
-                    current_size= size,
-                    current_location= abs_path)
+                    hash256= hash256,
+                    run_id= run_id)
 
-                # Record information into database
-                record_file_info(
+                # Record that the file is complete for this run
+                record_checkpoint(
+                    database= db,
+                    run_id= run_id,
+                    patient_id= patient_id,
+                    file_location= abs_path,
+                    file_hash= hash256,
+                    file_size= size)
+
+                # Compare the samples in the header with the patient, the
+                # header of a file already read is taken from the cache
+                if check_samples and not isinstance(entry, MemberEntry):
+                    metadata = read_header_metadata(
+                        database= db,
+                        entry= entry,
+                        sha256= hash256)
+                    if metadata is not None:
+                        record_sample_check(
+                            database= db,
+                            patient_id= patient_id,
+                            file_name= entry.name,
+                            file_location= entry.path,
+                            metadata= metadata,
+                            result= compare_samples(
+                                samples= metadata["samples"], 
+                                expected_names= expected_names))
+
+                # Advance the progress by the bytes of the file
+                progress.file_done(file_location= abs_path, size= progress_bytes)
+                progress_bar.update(progress_bytes, entry)
+
+            # Check the integrity of the compressed vcf and fastq files
+            for entry, result in check_files_integrity(
+                    file_entries= file_entries,
+                    deep_scan= deep_check,
+                    workers= check_workers):
+                record_integrity(
                     database= db,
-                    ticket= ticket,
                     patient_id= patient_id,
-                    file_name= filename,
-                    extension= extension,
-                    file_size= size,
-                    first_hash= hash256,
-                    abs_path= abs_path,
-                    file_type= hts)        
+                    file_name= entry.name,
+                    file_location= entry.path,
+                    check_type= "scan" if deep_check else "eof",
+                    result= result)
+
+            # Digests of the files, the analyses of a digest already
+            # analyzed are taken from the cache
+            if fastq_stats or parse_outputs:
+                file_digests = list_run_hashes(database=db, run_id=run_id)
+
+            # Count the reads and bases of the FASTQ files in their own
+            # pool of processes
+            if fastq_stats:
+                create_file_content_table(database=db)
+                for entry, statistics in analyze_fastq_files(
+                        file_entries= file_entries,
+                        workers= fastq_workers,
+                        threads= fastq_threads,
+                        database= db,
+                        digests= file_digests):
+                    record_fastq_stats(
+                        database= db,
+                        patient_id= patient_id,
+                        file_name= entry.name,
+                        statistics= statistics)
+
+                    # Files with an incomplete last record are truncated
+                    if statistics["result"] != "ok":
+                        record_integrity(
+                            database= db,
+                            patient_id= patient_id,
+                            file_name= entry.name,
+                            file_location= entry.path,
+                            check_type= "records",
+                            result= statistics["result"])
+
+            # Summarize the copy number segments and the gene coverage
+            if parse_outputs:
+                create_copy_number_table(database=db)
+                create_gene_metrics_table(database=db)
+                record_output_summaries(
+                    database= db,
+                    patient_id= patient_id,
+                    summaries= list(parse_output_files(
+                        file_entries= file_entries,
+                        database= db,
+                        digests= file_digests)))
+
+            # Look if files are missing once the members of the bundles 
+            # are known
+            if bundle_entries:
+                missing_files_list.append(list_missing_files(
+                    database= db, 
+                    directory= directory,
+                    file_list= file_list))
 
             # Create table in database to register missing essential files
             create_essential_files_missing_table(database=db)
@@ -168,12 +652,14 @@ def extract_file_info(input_path, db):
             
             # Print patient_id to show on progress bar
             print("\tPatient:", patient_id)
+            progress.finish_patient()
 
-            # Append patient summary to txt file
-            export_to_txt(
-                txt_file_name= "content.txt", 
-                mode="a", 
-                content= create_patient_summary(
+            # Store patient summary and mark the patient as completed
+            complete_run_patient(
+                database= db,
+                run_id= run_id,
+                patient_id= patient_id,
+                summary= create_patient_summary(
                     patient_id= patient_id,
                     found_files= found_files,
                     past_records= past_records,
@@ -183,21 +669,58 @@ def extract_file_info(input_path, db):
                     SV_somatic_count= essential_files_count[2],
                     SNV_somatic_count= essential_files_count[3]))
 
+    # Collect the patient summaries stored for the run
+    patient_summaries = []
+    for directory in directory_list:
+        run_patient = get_run_patient(
+            database=db, 
+            run_id=run_id, 
+            patient_id=directory)
+        if run_patient is not None:
+            patient_summaries.append(run_patient[1])
+
+    # Parts of the report, named after the ticket so extracts of other
+    # tickets in the same directory do not overwrite them
+    summary_file = f"summary_{ticket}.txt"
+    content_file = f"content_{ticket}.txt"
+
+    # Write patient summaries to txt file
+    export_to_txt(
+        txt_file_name= content_file, 
+        mode="w", 
+        content= "\n".join(patient_summaries))
+
     # List patients_missing_essential_files, empty_files, files_unmatching_hashes
     # and missing_files
 
     patients_missing_essential_files_list = list_patients_missing_files(database=db)
     empty_files_list = list_empty_files(database=db)
     unmatching_hash_list = list_unmatching_hashes(database=db)
+    truncated_files_list = list_truncated_files(database=db)
+    sample_mismatch_list = list_sample_mismatches(database=db)
+    fastq_mismatch_list = None
+    if fastq_stats:
+        fastq_mismatch_list = list_fastq_mismatches(database=db)
 
     define_status(database= db,
         unmatch_hash_list= unmatching_hash_list,
         empty_files_list= empty_files_list,
-        missing_files_list= missing_files_list)
+        missing_files_list= missing_files_list,
+        truncated_files_list= truncated_files_list,
+        sample_mismatch_list= sample_mismatch_list)
+
+    # Describe the limits of the run and their effect
+    throttle_summary = None
+    if throttle is not None:
+        throttle_summary = throttle.summary()
+        for priority in priorities:
+            throttle_summary += f"\n   - Priority: {priority}"
+        print("\nThrottling:")
+        print(throttle_summary)
 
     # Write report summary to txt file
     export_to_txt(
-        txt_file_name= "summary.txt", 
+        txt_file_name= summary_file, 
         mode="w", 
         content= create_report_summary(
             ticket= ticket,
@@ -206,12 +729,16 @@ def extract_file_info(input_path, db):
             essential_files_missing_list= patients_missing_essential_files_list,
             empty_files_list= empty_files_list,
             unmatching_hash_list= unmatching_hash_list,
-            missing_files_list= missing_files_list))
+            missing_files_list= missing_files_list,
+            truncated_files_list= truncated_files_list,
+            throttle_summary= throttle_summary,
+            fastq_mismatch_list= fastq_mismatch_list,
+            sample_mismatch_list= sample_mismatch_list if check_samples else None))
 
     # Print and export the report
     report_name = f"aacini_report_{ticket}_{today_string}.txt"
 
-    files = ["summary.txt", "content.txt"]
+    files = [summary_file, content_file]
 
     with open(report_name, "w") as report:
         # Iterate through list
@@ -226,12 +753,637 @@ def extract_file_info(input_path, db):
 
             os.remove(file)
 
+    # Keep the analysis cache within its limits
+    if fastq_stats or parse_outputs or check_samples:
+        evict_cache(
+            database= db,
+            max_entries= cache_max_entries,
+            max_bytes= cache_max_mb*1024*1024)
+
+    # Store the Merkle tree of the ticket for fast verification
+    create_merkle_tables(database=db)
+    build_merkle_tree(
+        database=db,
+        ticket=ticket,
+        input_path=input_path,
+        hashes=list_run_hashes(database=db, run_id=run_id))
+
+    # Add the new records to the digest index
+    if index is not None:
+        record_count, new_records = export_index(database=db, index_path=index)
+        print(f"Digest index: {record_count} records ({new_records} new) in {index}")
+
+    # Mark the run as completed
+    finish_run(
+        database=db, 
+        run_id=run_id, 
+        end_date=datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S"))
+    progress.finish(report=report_name)
+
+@click.command("watch")
+@click.option("--input_path", "-i", help="Specify ticket path to watch.")
+@click.option("--db", "-db", help="Specify database name.", default="aacini.db")
+@click.option("--settle", "-s", default=30.0, show_default=True,
+    help="Seconds a file must stay unchanged before it is hashed.")
+@click.option("--poll", "-p", is_flag=True, 
+    help="Use polling instead of inotify.")
+@click.option("--interval", default=5.0, show_default=True,
+    help="Seconds between scans when polling.")
+@click.option("--idle_exit", default=0.0, show_default=True,
+    help="Stop after this many seconds without new files (0: never).")
+@click.option("--xattr_cache", "-x", is_flag=True,
+    help="Reuse and store hashes in extended attributes of the files.")
+def watch_ticket(input_path, db, settle, poll, interval, idle_exit, 
+    xattr_cache):
+    """
+    Watch a ticket directory and record files as they land.
+
+    eg. aacini watch -i ./files -db database.db -s 60
+    """
+
+    # Get ticket name
+    ticket = os.path.basename(os.path.normpath(input_path))
+    print("\nWatching ticket:", ticket)
+
+    # The watched ticket is not extracted by another process meanwhile
+    lock_file, lock_owner = click.get_current_context().with_resource(
+        ticket_lock(database=db, ticket=ticket))
+    if lock_file is None:
+        raise click.ClickException(
+            f"Ticket {ticket} is being extracted by another process ({lock_owner}).")
+
+    # Create tables if they do not exist
+    create_file_information_table(database=db)
+    create_unmatching_hash_table(database=db)
+    create_essential_files_missing_table(database=db)
+    create_file_integrity_table(database=db)
+    create_observation_tables(database=db)
+    create_aggregate_table(database=db)
+    create_run_tables(database=db)
+
+    # Register the watch as a run
+    today_readable = datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")
+    today_string = datetime.datetime.today().strftime("%d%m%Y_%H%M%S")
+    run_id = start_run(
+        database=db,
+        ticket=ticket,
+        input_path=input_path,
+        start_date=today_readable,
+        start_string=today_string)
+
+    # Start watching and register the files already in the ticket
+    watcher, found_files = create_watcher(
+        directory_path=input_path, 
+        polling=poll, 
+        interval=interval)
+    tracker = StabilityTracker(settle=settle)
+    tracker.touch(found_files)
+    print("Watcher:", type(watcher).__name__, "\n")
+
+    patients_seen = set()
+    last_activity = time.monotonic()
+
+    try:
+        while True:
+            # Wait for changes and debounce them until stable
+            tracker.touch(watcher.wait(timeout=1.0))
+
+            for file in tracker.pop_stable():
+                last_activity = time.monotonic()
+
+                # The patient is the first directory below the ticket
+                relative_parts = pathlib.Path(
+                    os.path.relpath(file, input_path)).parts
+                if len(relative_parts) < 2:
+                    continue
+                patient_id = relative_parts[0]
+                patients_seen.add(patient_id)
+
+                # Read the file before recording anything
+                current_date = datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")
+                try:
+                    entry = make_file_entry(file, patient_id)
+                    hash256 = create_sha256(file, xattr_cache=xattr_cache)
+                    if is_compressed_hts(entry):
+                        eof_result = check_gzip_eof(file)
+
+                # The file was removed or renamed since it settled, a new
+                # name is seen as another change
+                except OSError as error:
+                    print(f"\t{current_date} {patient_id}: skipped "
+                        f"{os.path.basename(file)} ({error.strerror})")
+                    continue
+
+                # Extract, compare and record the file information
+                abs_path, hash256, size = process_entry(
+                    database= db,
+                    ticket= ticket,
+                    entry= entry,
+                    current_date= current_date,
+                    hash256= hash256,
+                    run_id= run_id)
+
+                record_checkpoint(
+                    database= db,
+                    run_id= run_id,
+                    patient_id= patient_id,
+                    file_location= abs_path,
+                    file_hash= hash256,
+                    file_size= size)
+
+                # Check that compressed files are not truncated
+                if is_compressed_hts(entry):
+                    record_integrity(
+                        database= db,
+                        patient_id= patient_id,
+                        file_name= entry.name,
+                        file_location= abs_path,
+                        check_type= "eof",
+                        result= eof_result)
+
+                print(f"\t{current_date} {patient_id}: {os.path.basename(file)}")
+
+            # Stop when nothing landed for idle_exit seconds
+            if (idle_exit > 0 and not tracker.pending 
+                    and time.monotonic() - last_activity > idle_exit):
+                break
+
+    except KeyboardInterrupt:
+        print("\nStopping watch.")
+
+    finally:
+        watcher.close()
+
+    # Count and record the missing essential files per patient
+    missing_files_list = []
+    for patient_id in sorted(patients_seen):
+        check_essential_files(database=db, patient_id=patient_id)
+        missing_files_list.append(list_missing_files(
+            database= db,
+            directory= patient_id,
+            file_list= {entry.name for entry in scan_directory(
+                os.path.join(input_path, patient_id))}))
+
+    # Update the status of the records
+    define_status(database= db,
+        unmatch_hash_list= list_unmatching_hashes(database=db),
+        empty_files_list= list_empty_files(database=db),
+        missing_files_list= missing_files_list,
+        truncated_files_list= list_truncated_files(database=db),
+        sample_mismatch_list= list_sample_mismatches(database=db))
+
+    finish_run(
+        database=db, 
+        run_id=run_id, 
+        end_date=datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S"))
+
+    click.secho(f"Recorded files of {len(patients_seen)} patients. "
+        "Run 'aacini extract' for the full report.", fg="blue")
+
+@click.command("query")
+@click.option("--db", "-db", help="Specify database name.", default="aacini.db")
+@click.option("--ticket", "-t", help="Filter by ticket.")
+@click.option("--patient_id", "-pid", help="Filter by patient ID.")
+@click.option("--status", "-st", help="Filter by status.")
+@click.option("--hts", help="Filter by file category (e.g. vcf, cram).")
+@click.option("--min_size", type=int, help="Minimum file size in bytes.")
+@click.option("--max_size", type=int, help="Maximum file size in bytes.")
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="First seen on or after date (YYYY-MM-DD).")
+@click.option("--until", type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="First seen before date (YYYY-MM-DD).")
+@click.option("--name", "-n", help="Filter by file name glob (e.g. '*.cram').")
+@click.option("--under", "-u", 
+    help="Only files below this directory (e.g. a ticket or sample path).")
+@click.option("--after", default=0, show_default=True,
+    help="Return records after this file_id (pagination).")
+@click.option("--limit", type=int, help="Maximum number of records.")
+@click.option("--format", "output_format", default="table", show_default=True,
+    type=click.Choice(["table", "tsv", "jsonl"]), help="Output format.")
+@click.option("--page_size", default=1000, show_default=True,
+    help="Records read per database query.")
+@click.option("--archives", is_flag=True, 
+    help="Also read the archives of old tickets.")
+@click.option("--changes", is_flag=True,
+    help="List the files of the ticket new or changed between --since and --until.")
+def query(db, ticket, patient_id, status, hts, min_size, max_size, since,
+    until, name, under, after, limit, output_format, page_size, archives,
+    changes):
+    """
+    Query the file_information table.
+
+    eg. aacini query -db database.db -t ticket -st hash_unmatch --format tsv
+    """
+
+    # A date given without time includes the whole day
+    since_epoch = int(since.timestamp()) if since else None
+    until_epoch = int(until.timestamp()) - 1 if until else None
+
+    # Files first seen with a new content in the ticket between the dates
+    if changes:
+        if ticket is None:
+            raise click.UsageError("--changes needs --ticket.")
+        changed_files = list_changed_files(
+            database= db,
+            ticket= ticket,
+            start_epoch= since_epoch or 0,
+            end_epoch= until_epoch if until_epoch is not None else 2**62)
+        click.echo(format_changed_files(
+            changed_files= changed_files,
+            output_format= output_format))
+        return
+
+    # File IDs are only unique within a database
+    archive_paths = None
+    if archives:
+        if after:
+            raise click.UsageError("--after can not be used with --archives.")
+        archive_paths = list_archives(db, ticket)
+
+    last_file_id = None
+    for page_number, page in enumerate(query_file_information(
+            database= db,
+            ticket= ticket,
+            patient_id= patient_id,
+            status= status,
+            hts= hts,
+            min_size= min_size,
+            max_size= max_size,
+            since= since_epoch,
+            until= until_epoch,
+            name_glob= name,
+            under= under,
+            after_id= after,
+            limit= limit,
+            page_size= page_size,
+            archives= archive_paths)):
+
+        click.echo(format_query_page(
+            page= page, 
+            output_format= output_format, 
+            header= page_number == 0))
+        last_file_id = page[-1]["file_id"]
+
+    # Tell how to continue a limited query
+    if limit is not None and last_file_id is not None and not archives:
+        click.echo(f"Next page: --after {last_file_id}", err=True)
+
+@click.command("export")
+@click.option("--db", "-db", help="Specify database name.", default="aacini.db")
+@click.option("--output_dir", "-o", help="Specify output directory.", 
+    default="aacini_export", show_default=True)
+@click.option("--ticket", "-t", help="Export only this ticket.")
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Records on or after date (YYYY-MM-DD).")
+@click.option("--until", type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Records before date (YYYY-MM-DD).")
+@click.option("--format", "output_format", default="parquet", show_default=True,
+    type=click.Choice(["parquet", "feather"]), help="Output format.")
+@click.option("--chunk_size", default=100000, show_default=True,
+    help="Records read and written per file.")
+def export(db, output_dir, ticket, since, until, output_format, chunk_size):
+    """
+    Export the catalog to Parquet or Arrow files.
+
+    eg. aacini export -db database.db -o export_dir -t ticket
+    """
+
+    # Do not mix the parts of a previous export
+    if os.path.isdir(output_dir) and os.listdir(output_dir):
+        raise click.ClickException(f"Output directory {output_dir} is not empty.")
+
+    try:
+        exported_records = export_catalog(
+            database= db,
+            output_dir= output_dir,
+            ticket= ticket,
+            since= int(since.timestamp()) if since else None,
+            until= int(until.timestamp()) - 1 if until else None,
+            output_format= output_format,
+            chunk_size= chunk_size)
+    except ImportError as error:
+        raise click.ClickException(str(error))
+
+    feedback = f"""\nExported to {output_dir}:"""
+    for table, records in exported_records.items():
+        feedback += f"""\n    - {table}: {records} records"""
+
+    print(feedback)
+
+@click.command("stats")
+@click.option("--db", "-db", help="Specify database name.", default="aacini.db")
+@click.option("--ticket", "-t", help="Only this ticket.")
+@click.option("--by", "-b", "group_by", multiple=True, 
+    type=click.Choice(["ticket", "patient_id", "hts", "status"]),
+    help="Group by column (repeat for several). Default: all of them.")
+@click.option("--format", "output_format", default="table", show_default=True,
+    type=click.Choice(["table", "tsv"]), help="Output format.")
+def stats(db, ticket, group_by, output_format):
+    """
+    Summarize file counts and sizes from the aggregate tables.
+
+    eg. aacini stats -db database.db -t ticket -b patient_id -b status
+    """
+
+    # Create the aggregates of databases of previous versions
+    create_file_information_table(database=db)
+    create_aggregate_table(database=db)
+
+    group_by = list(group_by) or ["ticket", "patient_id", "hts", "status"]
+    aggregates_list = list_aggregates(
+        database= db, 
+        ticket= ticket, 
+        group_by= group_by)
+
+    header = group_by + ["file_count", "total_bytes", "total_size", "last_update"]
+    rows = [header]
+    for record in aggregates_list:
+        rows.append([str(value) for value in record[:len(group_by)]] + [
+            str(record[-3]), 
+            str(record[-2]), 
+            format_size(record[-2]), 
+            epoch_to_iso(record[-1])])
+
+    if output_format == "tsv":
+        for row in rows:
+            click.echo("\t".join(row))
+        return
+
+    # Align the table columns
+    widths = [max(len(row[index]) for row in rows) for index in range(len(header))]
+    for row in rows:
+        click.echo("  ".join(value.ljust(width) 
+            for value, width in zip(row, widths)).rstrip())
+
+@click.command("verify")
+@click.option("--input_path", "-i", help="Specify ticket path to verify.")
+@click.option("--db", "-db", help="Specify database name.", default="aacini.db")
+@click.option("--full", is_flag=True,
+    help="Hash every file instead of trusting sizes and modification times.")
+@click.option("--update", is_flag=True,
+    help="Store the verified tree as the new tree of the ticket.")
+def verify(input_path, db, full, update):
+    """
+    Verify a ticket against the Merkle tree recorded by extract.
+
+    eg. aacini verify -i ./files -db database.db
+    """
+
+    # Get ticket name
+    ticket = os.path.basename(os.path.normpath(input_path))
+
+    create_merkle_tables(database=db)
+    result = verify_merkle_tree(
+        database= db,
+        ticket= ticket,
+        input_path= input_path,
+        full= full,
+        update= update)
+
+    if result["intact"]:
+        click.secho(f"Ticket {ticket} intact (root {result['root']}).", fg="green")
+        if result["touched"]:
+            print(f"Files with new modification time but same content: "
+                f"{len(result['touched'])}")
+        return
+
+    feedback = f"\nTicket {ticket} changed:"
+    for label, key in [("Changed", "changed"), ("Missing", "missing"), 
+            ("Extra", "extra"), ("Touched (same content)", "touched")]:
+        feedback += f"\n{label}:"
+        if result[key] == []:
+            feedback += "\n   - None"
+        for file_path in result[key]:
+            feedback += f"\n   - {file_path}"
+    feedback += f"\nDirectories inspected: {len(result['visited'])}"
+
+    print(feedback)
+
+@click.command("verify-copy")
+@click.option("--source", "-s", help="Specify source directory.")
+@click.option("--mirror", "-m", help="Specify directory of the copy.")
+@click.option("--db", "-db", help="Specify database name.", default="aacini.db")
+@click.option("--rehash", is_flag=True, 
+    help="Hash the source files instead of reusing the recorded hashes.")
+@click.option("--source_workers", type=int, default=2, show_default=True,
+    help="Number of workers hashing source files.")
+@click.option("--mirror_workers", type=int, default=2, show_default=True,
+    help="Number of workers hashing files of the copy.")
+def verify_mirror(source, mirror, db, rehash, source_workers, mirror_workers):
+    """
+    Verify that a copy of a directory is identical to the source.
+
+    eg. aacini verify-copy -s ./inbox/ticket -m /archive/ticket -db database.db
+    """
+
+    # Reuse the recorded hashes only if the database exists
+    database = db if os.path.isfile(db) and not rehash else None
+
+    result = verify_copy(
+        source= source,
+        mirror= mirror,
+        database= database,
+        source_workers= source_workers,
+        mirror_workers= mirror_workers)
+
+    print(f"Identical files: {result['identical']} "
+        f"(source hashes reused: {result['reused']})")
+
+    if not (result["missing"] or result["extra"] or result["different"]):
+        click.secho(f"Copy {mirror} is identical to {source}.", fg="green")
+        return
+
+    feedback = f"\nCopy {mirror} differs from {source}:"
+    feedback += "\nMissing in copy:"
+    for file_path in result["missing"] or ["None"]:
+        feedback += f"\n   - {file_path}"
+    feedback += "\nExtra in copy:"
+    for file_path in result["extra"] or ["None"]:
+        feedback += f"\n   - {file_path}"
+    feedback += "\nDifferent:"
+    if result["different"] == []:
+        feedback += "\n   - None"
+    for file_path, reason in result["different"]:
+        feedback += f"\n   - {file_path} ({reason})"
+    print(feedback)
+
+    raise click.ClickException("Copy verification failed.")
+
+@click.command("worker")
+@click.option("--queue", "-q", help="Queue database on a shared mount.")
+@click.option("--threads", "-t", default=1, show_default=True,
+    help="Files hashed at the same time.")
+@click.option("--lease", default=300.0, show_default=True,
+    help="Seconds an item is held without extending the lease.")
+@click.option("--poll", default=2.0, show_default=True,
+    help="Seconds between reads of an empty queue.")
+@click.option("--idle_exit", default=0.0, show_default=True,
+    help="Stop after this many seconds without items (0: never).")
+@click.option("--worker_id", help="Name of the worker (default: host:pid).")
+@click.option("--xattr_cache", "-x", is_flag=True,
+    help="Reuse and store hashes in extended attributes of the files.")
+@click.option("--rehash", is_flag=True,
+    help="Do not trust hashes in extended attributes, read the files again.")
+@click.option("--max_rate", default=0.0, show_default=True,
+    help="Total MB/s read by the threads of the worker (0: unlimited).")
+@click.option("--max_open_files", default=0, show_default=True,
+    help="Files open at the same time by the worker (0: unlimited).")
+def worker(queue, threads, lease, poll, idle_exit, worker_id, xattr_cache,
+    rehash, max_rate, max_open_files):
+    """
+    Hash files enqueued by extract runs with --queue.
+
+    eg. aacini worker -q /shared/aacini_queue.db -t 2
+    """
+
+    # The limits apply to the reads of this worker, each node has its own
+    throttle = None
+    if max_rate > 0 or max_open_files > 0:
+        throttle = IOThrottle(
+            rate= max_rate*1024*1024 if max_rate > 0 else None,
+            max_open_files= max_open_files if max_open_files > 0 else None)
+
+    print("\nWorking on queue:", queue)
+    hashed_items = run_worker(
+        queue= queue,
+        worker= worker_id,
+        threads= threads,
+        lease= lease,
+        poll_interval= poll,
+        idle_exit= idle_exit,
+        xattr_cache= xattr_cache,
+        trust_cache= not rehash,
+        throttle= throttle)
+    print("Files hashed:", hashed_items)
+    if throttle is not None:
+        print("\nThrottling:")
+        print(throttle.summary())
+
+@click.command("archive")
+@click.option("--db", "-db", help="Specify database name.", default="aacini.db")
+@click.option("--before", required=True, type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Archive tickets whose files were last seen before date (YYYY-MM-DD).")
+@click.option("--period", default="quarter", show_default=True,
+    type=click.Choice(["quarter", "year"]), help="Period of each archive database.")
+@click.option("--archive_dir", 
+    help="Directory of the archive databases (default: that of the database).")
+@click.option("--dry_run", is_flag=True, help="List the tickets without moving them.")
+def archive(db, before, period, archive_dir, dry_run):
+    """
+    Move old tickets into per-period archive databases.
+
+    eg. aacini archive -db database.db --before 2023-01-01 --period year
+    """
+
+    if not os.path.isfile(db):
+        raise click.ClickException(f"Database {db} does not exist.")
+
+    # Group the tickets by the period they were last seen in
+    periods = {}
+    for ticket in list_old_tickets(db, int(before.timestamp())):
+        periods.setdefault(get_period(ticket[2], period), []).append(ticket)
+
+    if periods == {}:
+        print("No tickets to archive.")
+        return
+
+    if archive_dir is None:
+        archive_dir = os.path.dirname(os.path.abspath(db))
+    os.makedirs(archive_dir, exist_ok=True)
+    database_name = os.path.splitext(os.path.basename(db))[0]
+
+    for period_name, tickets in sorted(periods.items()):
+        archive_path = os.path.join(archive_dir, 
+            f"{database_name}_{period_name}.db")
+        print(f"\n{period_name}: {len(tickets)} tickets into {archive_path}")
+        for ticket, _, _, file_count, total_bytes in tickets:
+            print(f" - {ticket}: {file_count} files, {format_size(total_bytes)}")
+
+        if dry_run:
+            continue
+
+        moved_records = archive_tickets(
+            database= db,
+            tickets= tickets,
+            archive_path= archive_path,
+            period= period_name)
+        if moved_records == {}:
+            raise click.ClickException(f"Failed to archive {period_name}.")
+        print(" Records moved:", ", ".join(f"{table} {count}" 
+            for table, count in moved_records.items() if count))
+
+        compact_database(archive_path)
+
+    # Reclaim the space of the moved records
+    if not dry_run:
+        compact_database(db, in_place=True)
+
+@click.command("invalidate-cache")
+@click.option("--db", "-db", help="Specify database name.", default="aacini.db")
+@click.option("--analyzer", type=click.Choice(sorted(registered_analyzers)),
+    help="Only the results of this analyzer (default: every analyzer).")
+@click.option("--all", "all_versions", is_flag=True,
+    help="Delete the results of the current versions too.")
+@click.option("--max_entries", type=int,
+    help="Evict the least recently used results beyond this number.")
+@click.option("--max_mb", type=int,
+    help="Evict the least recently used results beyond this size in MB.")
+def invalidate(db, analyzer, all_versions, max_entries, max_mb):
+    """
+    Delete cached analysis results of outdated analyzer versions.
+
+    eg. aacini invalidate-cache -db database.db --analyzer fastq_stats
+    """
+
+    if not os.path.isfile(db):
+        raise click.ClickException(f"Database {db} does not exist.")
+
+    create_analysis_cache_table(database=db)
+    deleted_results = invalidate_cache(
+        database= db,
+        analyzer_name= analyzer,
+        keep_current= not all_versions)
+    print("Results deleted:", deleted_results)
+
+    if max_entries is not None or max_mb is not None:
+        evicted_results = evict_cache(
+            database= db,
+            max_entries= max_entries,
+            max_bytes= None if max_mb is None else max_mb*1024*1024)
+        print("Results evicted:", evicted_results)
+
+@click.command("export-index")
+@click.option("--db", "-db", help="Specify database name.", default="aacini.db")
+@click.option("--output", "-o", default="aacini.idx", show_default=True,
+    help="Index file to write or update.")
+@click.option("--full", is_flag=True,
+    help="Rebuild the index from all the records instead of adding the new ones.")
+def export_digest_index(db, output, full):
+    """
+    Write a sorted digest index of the verified files.
+
+    eg. aacini export-index -db database.db -o aacini.idx
+    """
+
+    if not os.path.isfile(db):
+        raise click.ClickException(f"Database {db} does not exist.")
+
+    # Databases of previous versions get their file IDs
+    create_file_information_table(database=db)
+
+    record_count, new_records = export_index(
+        database= db,
+        index_path= output,
+        full= full)
+    print(f"Digest index: {record_count} records ({new_records} new) in {output}")
+
 @click.command("update_status")
 @click.option("--db", "-db", help="Specify database name.", default="aacini.db")
 @click.option("--file_name", "-fn", help="Specify file name.")
 @click.option("--patient_id", "-pid", help="Specify patient ID.")
 @click.option("--status", "-st", 
-    type= click.Choice(["pass", "hash_unmatch", "empty_file", "missing_file", "other"]), 
+    type= click.Choice(["pass", "hash_unmatch", "empty_file", "truncated", 
+        "sample_mismatch", "missing_file", "other"]), 
     help="Specify status to change to.")
 def update_status(db, file_name, patient_id, status):
     """
@@ -257,6 +1409,16 @@ def update_status(db, file_name, patient_id, status):
 
 cli.add_command(extract_file_info)
 cli.add_command(update_status)
+cli.add_command(watch_ticket)
+cli.add_command(query)
+cli.add_command(export)
+cli.add_command(stats)
+cli.add_command(verify)
+cli.add_command(verify_mirror)
+cli.add_command(worker)
+cli.add_command(archive)
+cli.add_command(invalidate)
+cli.add_command(export_digest_index)
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
@@ -0,0 +1,389 @@
+import concurrent.futures
+import datetime
+import functools
+import json
+import sqlite3
+
+from aacini.utils.catalog import connect_database
+
+######################################################################
+### Analyzer functions
+######################################################################
+
+class Analyzer:
+    """
+    Step that reads the content of the files of some categories (see
+    get_hts) and returns a result that can be stored as JSON. Results
+    are cached by the digest of the file, the name of the analyzer and
+    its version, so the version must be increased whenever the result
+    of the analyzer changes.
+
+    Attributes:
+        name (str): unique name of the analyzer.
+        version (str): version of the analyzer.
+        categories (tuple): file categories the analyzer reads.
+        function (callable): function of a FileEntry returning the
+            result, defined at module level so it can run in a pool of
+            processes.
+    """
+
+    def __init__(self, name: str, version: str, categories: tuple,
+        function):
+        self.name = name
+        self.version = version
+        self.categories = tuple(categories)
+        self.function = function
+
+    def __repr__(self):
+        return f"Analyzer({self.name!r}, {self.version!r})"
+
+# Registered analyzers by name and by file category
+registered_analyzers = {}
+analyzers_by_hts = {}
+
+def register_analyzer(analyzer: Analyzer) -> Analyzer:
+    """
+    This function registers an analyzer for its file categories.
+
+    Args:
+        analyzer (Analyzer): analyzer to register.
+
+    Returns:
+        The analyzer registered.
+    """
+
+    registered_analyzers[analyzer.name] = analyzer
+    for category in analyzer.categories:
+        analyzers_by_hts.setdefault(category, []).append(analyzer)
+
+    return analyzer
+
+def get_analyzers(hts: str) -> list:
+    """
+    This function lists the analyzers of a file category.
+
+    Args:
+        hts (str): file category (see get_hts).
+
+    Returns:
+        List of Analyzer records.
+    """
+
+    return analyzers_by_hts.get(hts, [])
+
+def create_analysis_cache_table(database: str):
+    """
+    Creates table to store the results of the analyzers by digest if
+    it does not exist already. The size of each result and the last
+    time it was used are kept to evict the least recently used results.
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        Commited 'Analysis cache' table into the database.
+    """
+
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Create analysis_cache table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists analysis_cache (
+            sha256 text,
+            analyzer text,
+            analyzer_version text,
+            result text,
+            result_size integer,
+            created_at integer,
+            last_used integer,
+            hit_count integer DEFAULT 0,
+
+            PRIMARY KEY(sha256, analyzer, analyzer_version)
+            )""")
+    cursor.execute("""CREATE INDEX if not exists idx_analysis_cache_last_used
+            ON analysis_cache (last_used)""")
+
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def load_cached_results(database: str, analyzer: Analyzer,
+    digests: set) -> dict:
+    """
+    This function loads the results of an analyzer cached for some
+    digests and marks them as used.
+
+    Args:
+        database (str): name of the database to connect to.
+        analyzer (Analyzer): analyzer whose results are loaded.
+        digests (set): digests of the files.
+
+    Returns:
+        Dictionary of digests and results.
+    """
+
+    cached_results = {}
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        for digest in digests:
+            cursor.execute("""SELECT result FROM analysis_cache
+                WHERE sha256 = :sha256
+                    AND analyzer = :analyzer
+                    AND analyzer_version = :analyzer_version""",
+                {"sha256": digest,
+                "analyzer": analyzer.name,
+                "analyzer_version": analyzer.version})
+            record = cursor.fetchone()
+            if record is not None:
+                cached_results[digest] = json.loads(record[0])
+
+        # Mark the results as used for the eviction
+        cursor.executemany("""UPDATE analysis_cache
+            SET last_used = :last_used, hit_count = hit_count + 1
+            WHERE sha256 = :sha256
+                AND analyzer = :analyzer
+                AND analyzer_version = :analyzer_version""",
+            [{"last_used": int(datetime.datetime.today().timestamp()),
+                "sha256": digest,
+                "analyzer": analyzer.name,
+                "analyzer_version": analyzer.version}
+                for digest in cached_results])
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return cached_results
+
+def store_results(database: str, analyzer: Analyzer, results: dict):
+    """
+    Records the results of an analyzer in the analysis_cache table.
+
+    Args:
+        database (str): name of the database to connect to.
+        analyzer (Analyzer): analyzer of the results.
+        results (dict): digests and results.
+
+    Returns:
+        Information recorded into the "Analysis cache" table in the
+        database.
+    """
+
+    now = int(datetime.datetime.today().timestamp())
+    records = []
+    for digest, result in results.items():
+        result_text = json.dumps(result)
+        records.append({"sha256": digest,
+            "analyzer": analyzer.name,
+            "analyzer_version": analyzer.version,
+            "result": result_text,
+            "result_size": len(result_text),
+            "created_at": now,
+            "last_used": now})
+
+    try:
+        # Connect to database and create a cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Record information into database table
+        cursor.executemany("""INSERT OR REPLACE INTO analysis_cache VALUES(
+                        :sha256,
+                        :analyzer,
+                        :analyzer_version,
+                        :result,
+                        :result_size,
+                        :created_at,
+                        :last_used,
+                        0)""", records)
+
+        # Commit cursor to database
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+def analyze_files(database: str, analyzer: Analyzer, file_entries: list,
+    digests: dict = None, workers: int = 0, **options):
+    """
+    This function runs an analyzer on a list of files. Files whose
+    digest was analyzed before by the same version of the analyzer
+    (e.g. re-delivered or duplicated files) reuse the cached result,
+    the others are analyzed and their results cached.
+
+    Args:
+        database (str): name of the database with the cache, None to
+            analyze every file without cache.
+        analyzer (Analyzer): analyzer to run.
+        file_entries (list): list of FileEntry records.
+        digests (dict): absolute file paths and their digests, files
+            without digest are analyzed without cache.
+        workers (int): number of processes analyzing files, 0 to
+            analyze them in the calling process.
+        **options: keyword arguments of the analyzer function.
+
+    Returns:
+        Generator of tuples (as FileEntry, result) in the order of the
+        list.
+    """
+
+    digests = digests or {}
+
+    cached_results = {}
+    if database is not None:
+        create_analysis_cache_table(database)
+        cached_results = load_cached_results(database, analyzer,
+            {digests[entry.path] for entry in file_entries
+                if entry.path in digests})
+
+    # Analyze the files whose digest is not in the cache
+    entries_to_analyze = [entry for entry in file_entries
+        if digests.get(entry.path) not in cached_results]
+    function = functools.partial(analyzer.function, **options)
+    if workers > 0 and entries_to_analyze:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            new_results = list(pool.map(function, entries_to_analyze))
+    else:
+        new_results = [function(entry) for entry in entries_to_analyze]
+    results = dict(zip([entry.path for entry in entries_to_analyze], new_results))
+
+    if database is not None:
+        store_results(database, analyzer, {digests[path]: result
+            for path, result in results.items() if path in digests})
+
+    for entry in file_entries:
+        if entry.path in results:
+            yield entry, results[entry.path]
+        else:
+            yield entry, cached_results[digests[entry.path]]
+
+def evict_cache(database: str, max_entries: int = None,
+    max_bytes: int = None) -> int:
+    """
+    This function evicts the least recently used results of the
+    analysis cache until it holds at most max_entries results and
+    max_bytes bytes of results.
+
+    Args:
+        database (str): name of the database to connect to.
+        max_entries (int): maximum number of results, None for no limit.
+        max_bytes (int): maximum size of the results in bytes, None for
+            no limit.
+
+    Returns:
+        Number of results evicted.
+    """
+
+    evicted_results = 0
+
+    try:
+        # Connect to database and create a cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        if max_entries is not None:
+            cursor.execute("""DELETE FROM analysis_cache WHERE rowid IN (
+                SELECT rowid FROM analysis_cache
+                ORDER BY last_used DESC, rowid DESC
+                LIMIT -1 OFFSET :max_entries)""", {"max_entries": max_entries})
+            evicted_results += cursor.rowcount
+
+        # Keep the most recently used results that fit in the size
+        if max_bytes is not None:
+            cursor.execute("""DELETE FROM analysis_cache WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, SUM(result_size) OVER (
+                        ORDER BY last_used DESC, rowid DESC) AS cache_size
+                    FROM analysis_cache)
+                WHERE cache_size > :max_bytes)""", {"max_bytes": max_bytes})
+            evicted_results += cursor.rowcount
+
+        # Commit cursor to database
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to delete data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return evicted_results
+
+def invalidate_cache(database: str, analyzer_name: str = None,
+    keep_current: bool = True) -> int:
+    """
+    This function deletes cached results. By default only the results
+    of versions of the analyzers other than the registered ones are
+    deleted, i.e. those that can no longer be reused.
+
+    Args:
+        database (str): name of the database to connect to.
+        analyzer_name (str): only the results of this analyzer, None
+            for every analyzer.
+        keep_current (bool): keep the results of the registered version
+            of the analyzers.
+
+    Returns:
+        Number of results deleted.
+    """
+
+    deleted_results = 0
+
+    try:
+        # Connect to database and create a cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""SELECT DISTINCT analyzer, analyzer_version
+            FROM analysis_cache""")
+        for name, version in cursor.fetchall():
+            if analyzer_name is not None and name != analyzer_name:
+                continue
+            if keep_current and name in registered_analyzers \
+                    and registered_analyzers[name].version == version:
+                continue
+            cursor.execute("""DELETE FROM analysis_cache
+                WHERE analyzer = :analyzer AND analyzer_version = :analyzer_version""",
+                {"analyzer": name, "analyzer_version": version})
+            deleted_results += cursor.rowcount
+
+        # Commit cursor to database
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to delete data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return deleted_results
@@ -0,0 +1,484 @@
+import datetime
+import os
+import sqlite3
+
+from aacini.utils.functions import create_file_information_table
+from aacini.utils.functions import create_file_content_table
+from aacini.utils.functions import create_essential_files_missing_table
+from aacini.utils.functions import create_unmatching_hash_table
+from aacini.utils.functions import create_file_integrity_table
+from aacini.utils.functions import create_observation_tables
+from aacini.utils.functions import create_aggregate_table
+from aacini.utils.functions import create_run_tables
+from aacini.utils.merkle import create_merkle_tables
+from aacini.utils.metrics import create_copy_number_table
+from aacini.utils.metrics import create_gene_metrics_table
+from aacini.utils.headers import create_header_tables
+from aacini.utils.catalog import connect_database
+
+######################################################################
+### Archive functions
+######################################################################
+
+# Tables with the records of a patient, moved once no file of the
+# patient is left in the hot database
+patient_tables = ["missing_files", "unmatching_hash", "file_integrity",
+    "file_content", "copy_number_summary", "gene_metrics_summary",
+    "sample_checks"]
+
+def create_ticket_archive_table(database: str):
+    """
+    Creates the directory of archived tickets in the hot database if
+    it does not exist already: one row per ticket with the archive
+    file that holds its records and a summary of them.
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        Commited 'Ticket archive' table into the database.
+    """
+
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Create ticket_archive table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists ticket_archive (
+            ticket text PRIMARY KEY,
+            archive_path text,
+            period text,
+            first_seen integer,
+            last_seen integer,
+            file_count integer,
+            total_bytes integer,
+            archived_at integer
+            )""")
+
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def create_archive_database(archive_path: str):
+    """
+    This function creates the tables of the catalog in an archive
+    database, with the same columns, indexes and triggers as the hot
+    database.
+
+    Args:
+        archive_path (str): path of the archive database.
+    """
+
+    create_file_information_table(database=archive_path)
+    create_file_content_table(database=archive_path)
+    create_essential_files_missing_table(database=archive_path)
+    create_unmatching_hash_table(database=archive_path)
+    create_file_integrity_table(database=archive_path)
+    create_observation_tables(database=archive_path)
+    create_aggregate_table(database=archive_path)
+    create_run_tables(database=archive_path)
+    create_merkle_tables(database=archive_path)
+    create_copy_number_table(database=archive_path)
+    create_gene_metrics_table(database=archive_path)
+    create_header_tables(database=archive_path)
+
+def get_period(epoch: int, period: str) -> str:
+    """
+    This function gets the period a date belongs to.
+
+    Args:
+        epoch (int): date in seconds since epoch.
+        period (str): "quarter" or "year".
+
+    Returns:
+        Period as "2022Q3" or "2022".
+    """
+
+    date = datetime.datetime.fromtimestamp(epoch)
+    if period == "year":
+        return f"{date.year}"
+    return f"{date.year}Q{(date.month - 1) // 3 + 1}"
+
+def list_old_tickets(database: str, cutoff: int) -> list:
+    """
+    This function lists the tickets whose files were all last seen
+    before a date.
+
+    Args:
+        database (str): name of the database to connect to.
+        cutoff (int): date in seconds since epoch.
+
+    Returns:
+        List of tuples (as ticket, first_seen, last_seen, file_count,
+        total_bytes).
+    """
+
+    old_tickets = []
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""SELECT ticket, MIN(first_seen), MAX(last_seen),
+                COUNT(*), COALESCE(SUM(size_bytes), 0)
+            FROM file_information
+            GROUP BY ticket
+            HAVING MAX(last_seen) < :cutoff
+            ORDER BY ticket""", {"cutoff": cutoff})
+
+        old_tickets = cursor.fetchall()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return old_tickets
+
+def table_columns(cursor: sqlite3.Cursor, schema: str, table: str) -> list:
+    """
+    This function lists the columns of a table, which may be in a
+    different order in databases migrated from previous versions.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor of the database connection.
+        schema (str): name of the database ("main" or attached).
+        table (str): name of the table.
+
+    Returns:
+        List of column names, empty if the table does not exist.
+    """
+
+    cursor.execute(f"PRAGMA {schema}.table_info({table})")
+    return [record[1] for record in cursor.fetchall()]
+
+def move_records(cursor: sqlite3.Cursor, table: str, condition: str,
+    delete: bool = True, replace: bool = False) -> int:
+    """
+    This function copies the records of a table that match a condition
+    from the hot database to the attached archive in a single
+    INSERT ... SELECT and deletes them from the hot database. Records
+    that conflict with a record of the archive raise an error, so the
+    transaction is rolled back instead of deleting records that were
+    not copied, unless they replace it or are only copied.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor of the hot database with the
+            archive attached as "archive".
+        table (str): name of the table.
+        condition (str): SQL condition selecting the records.
+        delete (bool): delete the records from the hot database, when
+            False records already in the archive are skipped.
+        replace (bool): replace the records of the archive that
+            conflict (e.g. the last state of a patient).
+
+    Returns:
+        Number of records moved.
+    """
+
+    columns = table_columns(cursor, "main", table)
+    if columns == []:
+        return 0
+    column_list = ", ".join(columns)
+
+    if not delete:
+        conflict = "OR IGNORE "
+    elif replace:
+        conflict = "OR REPLACE "
+    else:
+        conflict = ""
+
+    cursor.execute(f"SELECT COUNT(*) FROM main.{table} WHERE {condition}")
+    selected_records = cursor.fetchone()[0]
+
+    cursor.execute(f"""INSERT {conflict}INTO archive.{table} ({column_list})
+        SELECT {column_list} FROM main.{table} WHERE {condition}""")
+    moved_records = cursor.rowcount
+
+    if delete:
+        # Never delete records that are not in the archive
+        if moved_records != selected_records:
+            raise sqlite3.IntegrityError(f"{moved_records} of "
+                f"{selected_records} records of {table} copied to the archive")
+        cursor.execute(f"DELETE FROM main.{table} WHERE {condition}")
+
+    return moved_records
+
+def move_files(cursor: sqlite3.Cursor) -> tuple:
+    """
+    This function moves the records of file_information listed in the
+    moving_files table, and their observations, from the hot database
+    to the attached archive. The archive gives the files its own file
+    IDs, and a file already archived (same patient, name and hash, e.g.
+    a re-delivered file) keeps its record in the archive, extended to
+    the last time the file was seen. Observations reference the file
+    IDs of the archive.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor of the hot database with the
+            archive attached as "archive" and the temporary table
+            moving_files.
+
+    Returns:
+        Tuple (as files moved, observations moved).
+    """
+
+    columns = [column for column in table_columns(cursor, "main",
+        "file_information") if column != "file_id"]
+    column_list = ", ".join(columns)
+    same_file = """archived.patient_id IS moving.patient_id
+        AND archived.file_name IS moving.file_name
+        AND archived.first_hash IS moving.first_hash"""
+
+    # Files already archived are seen until the last date
+    cursor.execute(f"""UPDATE archive.file_information AS archived
+        SET last_seen = MAX(COALESCE(archived.last_seen, 0),
+                COALESCE(moving.last_seen, 0)),
+            date = CASE WHEN moving.last_seen > archived.last_seen
+                THEN moving.date ELSE archived.date END
+        FROM main.file_information AS moving
+        WHERE moving.file_id IN (SELECT file_id FROM moving_files)
+            AND {same_file}""")
+
+    # Other files get a new file ID in the archive
+    cursor.execute(f"""INSERT INTO archive.file_information ({column_list})
+        SELECT {column_list} FROM main.file_information AS moving
+        WHERE moving.file_id IN (SELECT file_id FROM moving_files)
+            AND NOT EXISTS (SELECT 1 FROM archive.file_information AS archived
+                WHERE {same_file})""")
+
+    # File IDs of the hot database and of the archive
+    cursor.execute(f"""CREATE TEMP TABLE archived_files AS
+        SELECT moving.file_id, archived.file_id AS archive_id
+        FROM main.file_information AS moving
+        JOIN archive.file_information AS archived ON {same_file}
+        WHERE moving.file_id IN (SELECT file_id FROM moving_files)""")
+    cursor.execute("CREATE INDEX temp.idx_archived_files ON archived_files (file_id)")
+
+    # Never delete files that are not in the archive
+    cursor.execute("""SELECT (SELECT COUNT(*) FROM moving_files),
+        (SELECT COUNT(DISTINCT file_id) FROM archived_files),
+        (SELECT COUNT(*) FROM archived_files)""")
+    selected_files, archived_files, mapped_files = cursor.fetchone()
+    if archived_files != selected_files or mapped_files != selected_files:
+        raise sqlite3.IntegrityError(f"{archived_files} of {selected_files} "
+            "records of file_information copied to the archive")
+
+    # Observations reference the file IDs of the archive
+    columns = table_columns(cursor, "main", "observations")
+    column_list = ", ".join(columns)
+    select_list = ", ".join("archived_files.archive_id" if column == "file_id"
+        else f"observations.{column}" for column in columns)
+    cursor.execute(f"""INSERT INTO archive.observations ({column_list})
+        SELECT {select_list} FROM main.observations
+        JOIN archived_files ON observations.file_id = archived_files.file_id""")
+    moved_observations = cursor.rowcount
+    cursor.execute("""DELETE FROM main.observations
+        WHERE file_id IN (SELECT file_id FROM moving_files)""")
+    if cursor.rowcount != moved_observations:
+        raise sqlite3.IntegrityError(f"{moved_observations} of "
+            f"{cursor.rowcount} records of observations copied to the archive")
+
+    cursor.execute("""DELETE FROM main.file_information
+        WHERE file_id IN (SELECT file_id FROM moving_files)""")
+    cursor.execute("DROP TABLE temp.archived_files")
+
+    return selected_files, moved_observations
+
+def archive_tickets(database: str, tickets: list, archive_path: str,
+    period: str) -> dict:
+    """
+    This function moves the records of tickets from the hot database
+    to an archive database in one transaction, and records the tickets
+    in the ticket_archive table of the hot database. Records of
+    patients (missing files, unmatching hashes, integrity checks) are
+    moved once the patient has no files left in the hot database.
+
+    Args:
+        database (str): name of the hot database.
+        tickets (list): list of tuples (as ticket, first_seen,
+            last_seen, file_count, total_bytes) from list_old_tickets.
+        archive_path (str): path of the archive database.
+        period (str): period of the archive (e.g. "2022Q3").
+
+    Returns:
+        Dictionary of table names and number of records moved.
+    """
+
+    create_archive_database(archive_path)
+    create_ticket_archive_table(database)
+    moved_records = {}
+
+    connection = connect_database(database, isolation_level=None)
+    cursor = connection.cursor()
+
+    try:
+        cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        cursor.execute("BEGIN IMMEDIATE")
+
+        # Tickets and files moved
+        cursor.execute("CREATE TEMP TABLE moving_tickets (ticket text PRIMARY KEY)")
+        cursor.executemany("INSERT INTO moving_tickets VALUES(?)",
+            [(ticket[0],) for ticket in tickets])
+        cursor.execute("""CREATE TEMP TABLE moving_files AS
+            SELECT file_id, patient_id FROM main.file_information
+            WHERE ticket IN (SELECT ticket FROM moving_tickets)""")
+        cursor.execute("CREATE INDEX temp.idx_moving_files ON moving_files (file_id)")
+
+        # Directories and digests are shared by tickets, they are copied
+        # and kept in the hot database
+        moved_records["directories"] = move_records(cursor, "directories",
+            "1", delete=False)
+        moved_records["digests"] = move_records(cursor, "digests",
+            """digest_id IN (SELECT digest_id FROM main.observations
+                WHERE file_id IN (SELECT file_id FROM moving_files))""",
+            delete=False)
+
+        # The aggregates of the archive are filled by its triggers and
+        # those of the hot database emptied by its own
+        moved_records["file_information"], moved_records["observations"] = \
+            move_files(cursor)
+
+        # Runs, checkpoints and Merkle trees of the tickets
+        ticket_condition = "ticket IN (SELECT ticket FROM moving_tickets)"
+        run_condition = """run_id IN (SELECT run_id FROM main.runs
+            WHERE ticket IN (SELECT ticket FROM moving_tickets))"""
+        moved_records["run_patients"] = move_records(cursor, "run_patients",
+            run_condition)
+        moved_records["run_checkpoints"] = move_records(cursor,
+            "run_checkpoints", run_condition)
+        moved_records["runs"] = move_records(cursor, "runs", ticket_condition)
+
+        # The tree of a ticket archived again replaces the previous one
+        for table in ["merkle_leaves", "merkle_nodes"]:
+            moved_records[table] = move_records(cursor, table, ticket_condition,
+                replace=True)
+
+        # Patients without files left in the hot database
+        patient_condition = """patient_id IN (SELECT patient_id FROM moving_files
+            WHERE patient_id NOT IN (SELECT patient_id FROM main.file_information))"""
+        for table in patient_tables:
+            moved_records[table] = move_records(cursor, table, patient_condition,
+                replace=True)
+
+        # Keep the tickets in the directory of the hot database
+        archived_at = int(datetime.datetime.today().timestamp())
+        cursor.executemany("""INSERT OR REPLACE INTO main.ticket_archive
+            VALUES(:ticket, :archive_path, :period, :first_seen, :last_seen,
+                :file_count, :total_bytes, :archived_at)""",
+            [{"ticket": ticket,
+                "archive_path": os.path.abspath(archive_path),
+                "period": period,
+                "first_seen": first_seen,
+                "last_seen": last_seen,
+                "file_count": file_count,
+                "total_bytes": total_bytes,
+                "archived_at": archived_at}
+                for ticket, first_seen, last_seen, file_count, total_bytes
+                in tickets])
+
+        cursor.execute("COMMIT")
+
+    # Print error if encountered, nothing is moved
+    except sqlite3.Error as error:
+        print("Failed to archive tickets,", error)
+        if connection.in_transaction:
+            cursor.execute("ROLLBACK")
+        moved_records = {}
+
+    # Finalize function
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.archived_files")
+        cursor.execute("DROP TABLE IF EXISTS temp.moving_files")
+        cursor.execute("DROP TABLE IF EXISTS temp.moving_tickets")
+        cursor.execute("DETACH DATABASE archive")
+        cursor.close()
+        connection.close()
+
+    return moved_records
+
+def compact_database(database: str, in_place: bool = False):
+    """
+    This function updates the statistics of the query planner
+    (ANALYZE) and compacts a database. Databases not in use by other
+    processes (archives) are written compacted with VACUUM INTO and
+    replace the original file, the hot database is vacuumed in place.
+
+    Args:
+        database (str): name of the database to compact.
+        in_place (bool): use VACUUM instead of VACUUM INTO.
+    """
+
+    connection = connect_database(database, isolation_level=None)
+    compacted_path = f"{database}.compact"
+
+    try:
+        connection.execute("ANALYZE")
+        if in_place:
+            connection.execute("VACUUM")
+        else:
+            if os.path.exists(compacted_path):
+                os.remove(compacted_path)
+            connection.execute("VACUUM INTO ?", (compacted_path,))
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to compact database,", error)
+        compacted_path = None
+
+    # Finalize function
+    finally:
+        connection.close()
+
+    if not in_place and compacted_path is not None:
+        os.replace(compacted_path, database)
+
+def list_archives(database: str, ticket: str = None) -> list:
+    """
+    This function lists the archive databases recorded in the ticket
+    directory of the hot database.
+
+    Args:
+        database (str): name of the hot database.
+        ticket (str): only the archive of this ticket.
+
+    Returns:
+        List of paths of archive databases.
+    """
+
+    archives = []
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # The directory does not exist if nothing was archived
+        cursor.execute("""SELECT COUNT(name) FROM sqlite_master
+            WHERE type = "table" AND name = "ticket_archive" """)
+        if cursor.fetchone()[0] == 1:
+            cursor.execute("""SELECT DISTINCT archive_path FROM ticket_archive
+                WHERE :ticket IS NULL OR ticket = :ticket
+                ORDER BY period""", {"ticket": ticket})
+            archives = [record[0] for record in cursor.fetchall()]
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return archives
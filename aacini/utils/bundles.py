@@ -0,0 +1,280 @@
+import contextlib
+import fnmatch
+import hashlib
+import os
+import posixpath
+import tarfile
+import zipfile
+import zlib
+
+from aacini.utils.constants import bundle_extensions
+from aacini.utils.constants import member_separator
+from aacini.utils.functions import FileEntry
+from aacini.utils.functions import classify_suffix
+
+######################################################################
+### Bundle functions
+######################################################################
+
+# Size in bytes of the reads of a bundle member (8 MB)
+member_block_size = 8*1024*1024
+
+# Largest gap in bytes hashed again when a bundle is read with a
+# forward seek (e.g. the data descriptors between zip members)
+max_gap_size = 1024*1024
+
+class MemberEntry(FileEntry):
+    """
+    FileEntry of a member of a bundle (.tar, .tar.gz or .zip file).
+    Its path is the member location (bundle path, "!/" and member
+    name), its size the uncompressed size of the member and its device
+    and inode those of the bundle.
+
+    Attributes:
+        bundle (str): absolute path of the bundle.
+        read_bytes (int): bytes of the bundle read for the member, to
+            weight the progress by the bytes read from disk.
+    """
+
+    __slots__ = ("bundle", "read_bytes")
+
+    def __init__(self, bundle: FileEntry, member_name: str, size: int,
+        read_bytes: int):
+        name = posixpath.basename(member_name)
+        extension, hts = classify_suffix(".".join(name.split(".")[-3:]))
+        super().__init__(
+            path= f"{bundle.path}{member_separator}{member_name}",
+            name= name,
+            patient_id= bundle.patient_id,
+            extension= extension,
+            hts= hts,
+            size= size,
+            device= bundle.device,
+            inode= bundle.inode)
+        self.bundle = bundle.path
+        self.read_bytes = read_bytes
+
+class BundleReader:
+    """
+    Reads a bundle for tarfile or zipfile and hashes the bytes of the
+    bundle as they are read, so the digest of the bundle and those of
+    its members are created in the same pass. Bytes read out of order
+    (e.g. the zip central directory, read first) are hashed when the
+    pass reaches them, and the bytes not read by the end are read by
+    finish.
+    """
+
+    def __init__(self, opened_file, throttle = None):
+        self.opened_file = opened_file
+        self.throttle = throttle
+        self.sha256 = hashlib.sha256()
+        self.hashed_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        position = self.opened_file.tell()
+
+        # Hash the bytes skipped by a short forward seek
+        if 0 < position - self.hashed_bytes <= max_gap_size:
+            self.opened_file.seek(self.hashed_bytes)
+            self.update(self.opened_file.read(position - self.hashed_bytes))
+
+        data = self.opened_file.read(size)
+
+        # Hash only the bytes that follow the ones already hashed
+        if position <= self.hashed_bytes < position + len(data):
+            self.update(data[self.hashed_bytes - position:])
+
+        return data
+
+    def update(self, data: bytes):
+        self.sha256.update(data)
+        self.hashed_bytes += len(data)
+
+        # Wait until the bandwidth allows the next read
+        if self.throttle is not None:
+            self.throttle.consume(len(data))
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self.opened_file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.opened_file.tell()
+
+    def seekable(self) -> bool:
+        return True
+
+    def finish(self) -> str:
+        """
+        Hashes the bytes of the bundle not read yet and returns the
+        digest of the bundle.
+        """
+
+        self.opened_file.seek(self.hashed_bytes)
+        for byte_block in iter(lambda: self.opened_file.read(member_block_size), b""):
+            self.update(byte_block)
+
+        return self.sha256.hexdigest()
+
+def is_bundle(file: str) -> bool:
+    """
+    This function tells if a file is a bundle whose members can be
+    hashed without unpacking it (see bundle_extensions).
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        True if the file is a bundle.
+    """
+
+    return any(fnmatch.fnmatch(file, "*." + extension)
+        for extension in bundle_extensions)
+
+def split_bundles(file_entries: list) -> tuple:
+    """
+    This function separates the bundles from the other files of a
+    patient directory.
+
+    Args:
+        file_entries (list): list of FileEntry records.
+
+    Returns:
+        Tuple (as files, bundles) of lists of FileEntry records.
+    """
+
+    files = []
+    bundles = []
+    for entry in file_entries:
+        if is_bundle(entry.name):
+            bundles.append(entry)
+        else:
+            files.append(entry)
+
+    return files, bundles
+
+def split_member_location(file_location: str) -> tuple:
+    """
+    This function splits the location of a bundle member into the path
+    of the bundle and the name of the member.
+
+    Args:
+        file_location (str): absolute path or member location.
+
+    Returns:
+        Tuple (as bundle path, member name) or None if the location is
+        not that of a bundle member.
+    """
+
+    if member_separator not in file_location:
+        return None
+
+    return tuple(file_location.split(member_separator, 1))
+
+def list_tar_members(reader: BundleReader):
+    """
+    This function reads the members of a tar file (compressed or not)
+    as a stream, in the order they are stored.
+
+    Args:
+        reader (BundleReader): reader of the bundle.
+
+    Returns:
+        Generator of tuples (as member name, size, file object).
+    """
+
+    with tarfile.open(fileobj=reader, mode="r|*") as bundle:
+        for member in bundle:
+            if member.isfile():
+                yield member.name, member.size, bundle.extractfile(member)
+
+def list_zip_members(reader: BundleReader):
+    """
+    This function reads the members of a zip file in the order they are
+    stored, so the file is read from the beginning to the end.
+
+    Args:
+        reader (BundleReader): reader of the bundle.
+
+    Returns:
+        Generator of tuples (as member name, size, file object).
+    """
+
+    with zipfile.ZipFile(reader) as bundle:
+        for info in sorted(bundle.infolist(), key=lambda info: info.header_offset):
+            if not info.is_dir():
+                with bundle.open(info) as member_file:
+                    yield info.filename, info.file_size, member_file
+
+def stream_bundle(entry: FileEntry, throttle = None):
+    """
+    This function hashes the members of a bundle and the bundle itself
+    in a single sequential read, without unpacking it. Members that
+    start with "." are skipped, like in scan_directory. If the bundle
+    can not be read to the end (e.g. it is truncated), the members read
+    until then are kept.
+
+    Args:
+        entry (FileEntry): bundle to read.
+        throttle (IOThrottle): limits of bandwidth and open files shared
+            with the hashing workers, None to read without limits.
+
+    Returns:
+        Generator of tuples (as MemberEntry, hash) of the members and
+        lastly the tuple (as FileEntry, hash) of the bundle.
+    """
+
+    # Wait for a free slot if the number of open files is limited
+    open_slot = contextlib.nullcontext()
+    if throttle is not None:
+        open_slot = throttle.open_slot()
+
+    with open_slot, open(entry.path, "rb") as opened_file:
+        reader = BundleReader(opened_file, throttle)
+        if fnmatch.fnmatch(entry.name, "*.zip"):
+            members = list_zip_members(reader)
+        else:
+            members = list_tar_members(reader)
+
+        read_bytes = 0
+        try:
+            for member_name, size, member_file in members:
+                sha256 = hashlib.sha256()
+                for byte_block in iter(lambda: member_file.read(member_block_size), b""):
+                    sha256.update(byte_block)
+
+                # Names are kept relative to the root of the bundle
+                member_name = posixpath.normpath(member_name).lstrip("/")
+                if posixpath.basename(member_name).startswith("."):
+                    continue
+
+                yield MemberEntry(
+                    bundle= entry,
+                    member_name= member_name,
+                    size= size,
+                    read_bytes= reader.hashed_bytes - read_bytes), sha256.hexdigest()
+                read_bytes = reader.hashed_bytes
+
+        # Print error if encountered
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error) as error:
+            print("Failed to read bundle,", entry.path, error)
+
+        bundle_hash = reader.finish()
+
+    yield entry, bundle_hash
+
+def stream_bundles(bundle_entries: list, throttle = None):
+    """
+    This function streams the bundles of a patient one after the other.
+
+    Args:
+        bundle_entries (list): list of FileEntry records of bundles.
+        throttle (IOThrottle): limits of bandwidth and open files, None
+            to read without limits.
+
+    Returns:
+        Generator of tuples (as FileEntry, hash) of the members and the
+        bundles.
+    """
+
+    for entry in bundle_entries:
+        yield from stream_bundle(entry, throttle=throttle)
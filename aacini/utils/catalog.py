@@ -0,0 +1,316 @@
+import contextlib
+import fcntl
+import os
+import random
+import re
+import socket
+import sqlite3
+import threading
+import time
+
+######################################################################
+### Catalog connection functions
+######################################################################
+
+# Seconds a statement waits for the lock of the database (busy timeout)
+BUSY_TIMEOUT = 30
+
+# Times a statement is tried again once the busy timeout expired, with
+# an exponential backoff between the tries
+MAX_RETRIES = 6
+INITIAL_BACKOFF = 0.1
+MAX_BACKOFF = 5.0
+
+# Journal of the catalog databases, WAL lets the readers run while a
+# writer commits
+JOURNAL_MODE = "WAL"
+
+# Statements that open a write transaction
+write_pattern = re.compile(
+    r"^\s*(?:INSERT|UPDATE|DELETE|REPLACE|BEGIN|CREATE|DROP|ALTER)\b",
+    re.IGNORECASE)
+
+# Databases whose journal mode was set by this process, and the lock of
+# the writers of each database in this process
+journal_databases = set()
+writer_locks = {}
+writer_locks_lock = threading.Lock()
+
+# Values read from each database cached by this process (e.g. directory
+# IDs, see CatalogConnection.cache_value)
+database_caches = {}
+
+class DatabaseBusyError(Exception):
+    """
+    Raised when a statement still finds the database locked by another
+    process once the busy timeout and the retries ran out. It is not a
+    sqlite3.Error, so the functions that print and skip database errors
+    do not lose the write silently: the command stops with this error.
+    """
+
+def get_writer_lock(database: str) -> threading.RLock:
+    """
+    This function returns the lock of the writers of a database in this
+    process. Threads writing to the same database queue on this lock
+    instead of competing for the lock of the database file.
+
+    Args:
+        database (str): name of the database.
+
+    Returns:
+        Reentrant lock shared by the connections to the database.
+    """
+
+    with writer_locks_lock:
+        return writer_locks.setdefault(os.path.abspath(database), threading.RLock())
+
+def is_locked_error(error: sqlite3.OperationalError) -> bool:
+    """
+    This function tells if an error is raised because another
+    connection holds the lock of the database.
+
+    Args:
+        error (sqlite3.OperationalError): error raised by a statement.
+
+    Returns:
+        True if the statement can be tried again.
+    """
+
+    message = str(error).lower()
+    return "database is locked" in message or "database is busy" in message
+
+class CatalogCursor(sqlite3.Cursor):
+    """
+    Cursor whose statements are run by the connection (see
+    CatalogConnection.run_statement).
+    """
+
+    def execute(self, sql: str, parameters = ()):
+        return self.connection.run_statement(super().execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        # Parameters are kept in a list so the statement can be tried again
+        return self.connection.run_statement(super().executemany, sql,
+            list(seq_of_parameters))
+
+class CatalogConnection(sqlite3.Connection):
+    """
+    Connection to a catalog database where a statement that finds the
+    database locked after the busy timeout is tried again with an
+    exponential backoff, as long as no transaction was opened, so the
+    write is not lost. Write transactions hold the writer lock of the
+    database in this process from their first statement to their commit
+    or rollback, so the writers of a process run one at a time. Values
+    read from the database can be cached for the process, those read in
+    a transaction are kept once it commits.
+    """
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.writer_lock = get_writer_lock(str(database))
+        self.holds_writer_lock = False
+        self.cache = database_caches.setdefault(os.path.abspath(str(database)), {})
+        self.transaction_cache = {}
+
+    def cursor(self, factory = CatalogCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters = ()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def run_statement(self, method, sql: str, parameters):
+        # Wait for the writers of this process before opening a write
+        if not self.in_transaction and not self.holds_writer_lock \
+                and write_pattern.match(sql):
+            self.writer_lock.acquire()
+            self.holds_writer_lock = True
+
+        try:
+            backoff = INITIAL_BACKOFF
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    return method(sql, parameters)
+
+                # Statements of an open transaction can not be tried
+                # again alone
+                except sqlite3.OperationalError as error:
+                    if not is_locked_error(error):
+                        raise
+                    if self.in_transaction or attempt == MAX_RETRIES:
+                        raise DatabaseBusyError(f"Database is locked by "
+                            f"another process after {attempt + 1} tries: "
+                            f"{error}") from error
+                    time.sleep(backoff*random.uniform(0.5, 1.5))
+                    backoff = min(backoff*2, MAX_BACKOFF)
+
+        finally:
+            if not self.in_transaction:
+                self.release_writer_lock()
+
+    def release_writer_lock(self):
+        if self.holds_writer_lock:
+            self.holds_writer_lock = False
+            self.writer_lock.release()
+
+    def cached_value(self, key):
+        if key in self.transaction_cache:
+            return self.transaction_cache[key]
+        return self.cache.get(key)
+
+    def cache_value(self, key, value):
+        # A value read in a transaction may not be committed yet
+        if self.in_transaction:
+            self.transaction_cache[key] = value
+        else:
+            self.cache[key] = value
+
+    def commit(self):
+        try:
+            super().commit()
+            self.cache.update(self.transaction_cache)
+            self.transaction_cache.clear()
+
+        # The transaction is kept, the caller decides to roll it back
+        except sqlite3.OperationalError as error:
+            if not is_locked_error(error):
+                raise
+            raise DatabaseBusyError(
+                f"Database is locked by another process at commit: {error}"
+                ) from error
+        finally:
+            if not self.in_transaction:
+                self.release_writer_lock()
+
+    def rollback(self):
+        try:
+            self.transaction_cache.clear()
+            super().rollback()
+        finally:
+            self.release_writer_lock()
+
+    def close(self):
+        try:
+            self.transaction_cache.clear()
+            super().close()
+        finally:
+            self.release_writer_lock()
+
+def connect_database(database: str, isolation_level: str = "IMMEDIATE"
+    ) -> CatalogConnection:
+    """
+    This function connects to a catalog database shared by several
+    processes (e.g. extract and update_status run at the same time).
+    The database is switched to the WAL journal the first time, so
+    readers do not block the writer, and write transactions start with
+    BEGIN IMMEDIATE, so a transaction gets the lock of the database
+    before its first write or waits for it with the busy timeout.
+
+    Args:
+        database (str): name of the database to connect to.
+        isolation_level (str): isolation level of the connection, None
+            for autocommit mode with explicit transactions.
+
+    Returns:
+        Connection to the database.
+    """
+
+    connection = sqlite3.connect(database, timeout=BUSY_TIMEOUT,
+        isolation_level=isolation_level, factory=CatalogConnection)
+
+    # The journal mode is stored in the database, set it once
+    if database not in journal_databases:
+        try:
+            connection.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+            journal_databases.add(database)
+
+        # The database is read only, on a filesystem without WAL or
+        # locked by another process, which switches it
+        except (sqlite3.Error, DatabaseBusyError) as error:
+            print("Failed to set journal mode,", error)
+
+    # WAL is durable at each checkpoint with synchronous NORMAL
+    connection.execute("PRAGMA synchronous=NORMAL")
+
+    return connection
+
+def lock_ticket(database: str, ticket: str, wait: float = 0.0):
+    """
+    This function takes an advisory lock on a ticket of a database, so
+    two processes do not extract the same ticket at the same time. The
+    lock is a file next to the database locked with flock, released by
+    unlock_ticket or when the process ends, and holds the host and
+    process ID of its owner.
+
+    Args:
+        database (str): name of the database.
+        ticket (str): ticket to lock.
+        wait (float): seconds to wait for the lock if another process
+            holds it.
+
+    Returns:
+        Tuple (as lock file, owner) where lock file is None if another
+        process holds the lock and owner describes that process.
+    """
+
+    lock_name = re.sub(r"[^\w.-]", "_", ticket)
+    lock_path = f"{os.path.abspath(database)}.{lock_name}.lock"
+    lock_file = open(lock_path, "a+")
+
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                lock_file.seek(0)
+                owner = lock_file.read().strip()
+                lock_file.close()
+                return None, owner
+            time.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+
+    # Describe the owner of the lock
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{socket.gethostname()}:{os.getpid()}")
+    lock_file.flush()
+
+    return lock_file, None
+
+def unlock_ticket(lock_file):
+    """
+    This function releases the lock of a ticket taken by lock_ticket.
+
+    Args:
+        lock_file (file object): lock file of the ticket.
+    """
+
+    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    lock_file.close()
+
+@contextlib.contextmanager
+def ticket_lock(database: str, ticket: str, wait: float = 0.0):
+    """
+    This function takes the lock of a ticket like lock_ticket for a
+    with block (or the context of a command) and releases it when the
+    block ends, also on an error.
+
+    Args:
+        database (str): name of the database.
+        ticket (str): ticket to lock.
+        wait (float): seconds to wait for the lock if another process
+            holds it.
+
+    Yields:
+        Tuple (as lock file, owner) returned by lock_ticket.
+    """
+
+    lock_file, owner = lock_ticket(database=database, ticket=ticket, wait=wait)
+    try:
+        yield lock_file, owner
+    finally:
+        if lock_file is not None:
+            unlock_ticket(lock_file)
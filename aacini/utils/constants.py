@@ -40,4 +40,27 @@ essential_files_patterns = [
     'SV.germline', 
     'SNV.germline', 
     'SV.somatic', 
-    'SNV.somatic']
\ No newline at end of file
+    'SNV.somatic']
+
+# Extended attributes used to cache the sha256 hash of a file
+xattr_sha256 = 'user.aacini.sha256'
+xattr_stamp = 'user.aacini.stamp'
+
+# Empty BGZF block that marks the end of a BGZF file (SAM/BAM specification)
+bgzf_eof = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# Plain gzip files up to this size in bytes are decompressed by the EOF check
+# to verify the CRC and size in their trailer
+plain_gzip_check_size = 64*1024*1024
+
+# Extensions of delivery bundles whose members are hashed without unpacking
+bundle_extensions = [
+    'tar',
+    'tar.gz',
+    'tgz',
+    'zip'
+]
+
+# Separator between the path of a bundle and the name of a member
+member_separator = '!/'
@@ -0,0 +1,394 @@
+import heapq
+import mmap
+import os
+import sqlite3
+import struct
+
+from aacini.utils.catalog import connect_database
+
+######################################################################
+### Digest index functions
+######################################################################
+
+# The index file is a header followed by fixed-size records sorted by
+# digest and size, all big-endian so the records sort as bytes:
+#   header: magic (8 bytes), version (uint32), record size (uint32),
+#       record count (uint64), last file ID indexed (uint64), records
+#       left out because their size was not known (uint64)
+#   record: sha256 digest (32 bytes), size in bytes (uint64), file ID
+#       (uint64, file_id of file_information)
+# File IDs are never reused, so the records added since an update are
+# those with a greater file ID. Version 1 indexes used the rowid, which
+# was reused once the last files were archived. Version 2 indexes did
+# not count the records left out, whose size is filled later without a
+# new file ID.
+INDEX_MAGIC = b"AACIDX\x00\x01"
+INDEX_VERSION = 3
+header_struct = struct.Struct(">8sIIQQQ")
+record_struct = struct.Struct(">32sQQ")
+
+# Bytes of a record compared by the lookups (digest and size)
+key_size = 40
+
+# Records read from the database per fetch
+fetch_size = 10000
+
+class DigestIndex:
+    """
+    Read only view of an index file, memory-mapped so a lookup is a
+    binary search over the records without reading the whole file. The
+    index can be opened while it is rebuilt, the rebuild replaces the
+    file and an open index keeps the previous version.
+
+    Attributes:
+        path (str): path of the index file.
+        record_count (int): number of records.
+        last_file_id (int): last file ID of the database indexed.
+        unsized_count (int): number of records up to the last file ID
+            left out because their size in bytes was not known.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.opened_file = open(path, "rb")
+        self.mapped_file = None
+        self.record_count = 0
+        self.last_file_id = 0
+        self.unsized_count = 0
+
+        # Check the fields common to every version before the version
+        header = self.opened_file.read(header_struct.size)
+        if len(header) < 16:
+            self.opened_file.close()
+            raise ValueError(f"{path} is not an aacini digest index")
+        magic, version, record_size = struct.unpack_from(">8sII", header)
+        if magic != INDEX_MAGIC or record_size != record_struct.size:
+            self.opened_file.close()
+            raise ValueError(f"{path} is not an aacini digest index")
+        if version != INDEX_VERSION or len(header) < header_struct.size:
+            self.opened_file.close()
+            raise ValueError(f"{path} is a version {version} digest index")
+        self.record_count, self.last_file_id, self.unsized_count = \
+            header_struct.unpack(header)[3:]
+
+        # An empty file can not be mapped
+        if self.record_count > 0:
+            self.mapped_file = mmap.mmap(self.opened_file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.record_count
+
+    def __contains__(self, digest) -> bool:
+        return self.lookup(digest) != []
+
+    def close(self):
+        if self.mapped_file is not None:
+            self.mapped_file.close()
+        self.opened_file.close()
+
+    def record_key(self, position: int) -> bytes:
+        offset = header_struct.size + position*record_struct.size
+        return self.mapped_file[offset:offset + key_size]
+
+    def records(self):
+        """
+        Iterates the records of the index in order as tuples (as digest,
+        size, file ID).
+        """
+
+        for position in range(self.record_count):
+            offset = header_struct.size + position*record_struct.size
+            yield record_struct.unpack_from(self.mapped_file, offset)
+
+    def lookup(self, digest, size: int = None) -> list:
+        """
+        Finds the files recorded with a digest (and a size).
+
+        Args:
+            digest (str or bytes): sha256 digest as hex or bytes.
+            size (int): size in bytes, None for any size.
+
+        Returns:
+            List of the file IDs, empty if the digest was never seen.
+        """
+
+        if isinstance(digest, str):
+            digest = bytes.fromhex(digest)
+        key = digest if size is None else digest + size.to_bytes(8, "big")
+
+        # Binary search of the first record whose key is not lower
+        low, high = 0, self.record_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.record_key(middle)[:len(key)] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        file_ids = []
+        for position in range(low, self.record_count):
+            if self.record_key(position)[:len(key)] != key:
+                break
+            offset = header_struct.size + position*record_struct.size
+            file_ids.append(record_struct.unpack_from(self.mapped_file, offset)[2])
+
+        return file_ids
+
+    def seen(self, digest, size: int) -> bool:
+        """
+        Tells if a file with this digest and size was verified.
+        """
+
+        return self.lookup(digest, size) != []
+
+def read_new_records(database: str, after_file_id: int, 
+    last_file_id: int):
+    """
+    This function reads the digest, size and file ID of the records of
+    file_information added after a file ID, sorted by digest and size.
+    Records without digest or size in bytes are not indexed.
+
+    Args:
+        database (str): name of the database to connect to.
+        after_file_id (int): last file ID already indexed.
+        last_file_id (int): last file ID to index, records added while
+            the index is written are left for the next update.
+
+    Returns:
+        Generator of tuples (as digest, size, file ID).
+    """
+
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    try:
+        # Hex digests in lower case sort like their bytes
+        cursor.execute("""SELECT lower(first_hash), size_bytes, file_id
+            FROM file_information
+            WHERE file_id > :after_file_id
+                AND file_id <= :last_file_id
+                AND length(first_hash) = 64
+                AND size_bytes IS NOT NULL
+            ORDER BY lower(first_hash), size_bytes, file_id""",
+            {"after_file_id": after_file_id,
+            "last_file_id": last_file_id})
+
+        while True:
+            records = cursor.fetchmany(fetch_size)
+            if records == []:
+                break
+            for first_hash, size_bytes, file_id in records:
+                yield bytes.fromhex(first_hash), size_bytes, file_id
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+def get_last_file_id(database: str) -> int:
+    """
+    This function gets the last file ID given by the file_information
+    table, including the IDs of records deleted or archived since.
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        Last file ID, 0 if no record was ever added.
+    """
+
+    last_file_id = 0
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""SELECT COALESCE(MAX(file_id), 0) FROM (
+                SELECT seq AS file_id FROM sqlite_sequence
+                WHERE name = "file_information"
+                UNION ALL
+                SELECT MAX(file_id) FROM file_information)""")
+        last_file_id = cursor.fetchone()[0]
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return last_file_id
+
+def count_unsized_records(database: str, last_file_id: int) -> int:
+    """
+    This function counts the records of file_information up to a file
+    ID that are left out of the index because their size in bytes is
+    not known (e.g. records of previous versions not seen since). Their
+    size is filled when the file is seen again, without a new file ID.
+
+    Args:
+        database (str): name of the database to connect to.
+        last_file_id (int): last file ID counted.
+
+    Returns:
+        Number of records without size in bytes.
+    """
+
+    unsized_count = 0
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""SELECT COUNT(*) FROM file_information
+            WHERE size_bytes IS NULL
+                AND file_id <= :last_file_id
+                AND length(first_hash) = 64""",
+            {"last_file_id": last_file_id})
+        unsized_count = cursor.fetchone()[0]
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return unsized_count
+
+def write_index(index_path: str, records, last_file_id: int,
+    unsized_count: int = 0) -> int:
+    """
+    This function writes sorted records into an index file. The file is
+    written next to the index and then replaces it, so readers never
+    see a partial index.
+
+    Args:
+        index_path (str): path of the index file.
+        records (iterable): sorted tuples (as digest, size, file ID).
+        last_file_id (int): last file ID of the database indexed.
+        unsized_count (int): number of records up to the last file ID
+            left out because their size was not known.
+
+    Returns:
+        Number of records written.
+    """
+
+    temporary_path = f"{index_path}.{os.getpid()}.tmp"
+    record_count = 0
+
+    try:
+        with open(temporary_path, "wb") as index_file:
+            # The header is written again once the records are counted
+            index_file.write(header_struct.pack(INDEX_MAGIC, INDEX_VERSION,
+                record_struct.size, 0, last_file_id, unsized_count))
+            for record in records:
+                index_file.write(record_struct.pack(*record))
+                record_count += 1
+
+            index_file.seek(0)
+            index_file.write(header_struct.pack(INDEX_MAGIC, INDEX_VERSION,
+                record_struct.size, record_count, last_file_id, unsized_count))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+        os.replace(temporary_path, index_path)
+
+    # Do not leave the partial index behind
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    return record_count
+
+def export_index(database: str, index_path: str, full: bool = False) -> tuple:
+    """
+    This function builds or updates the digest index of a database.
+    An existing index is updated incrementally: only the records added
+    to file_information since the index was written are read, sorted,
+    and merged with the records of the index. Records deleted from the
+    database (e.g. archived tickets) stay in the index until it is
+    rebuilt with full. The index is rebuilt if the database gave fewer
+    file IDs than the index has seen (e.g. a database restored from a
+    backup or an index of another database), or if records left out
+    because their size was not known got their size since.
+
+    Args:
+        database (str): name of the database to connect to.
+        index_path (str): path of the index file.
+        full (bool): rebuild the index from all the records.
+
+    Returns:
+        Tuple (as record count, new records) of the index written.
+    """
+
+    last_file_id = get_last_file_id(database)
+
+    index = None
+    if not full and os.path.isfile(index_path):
+        try:
+            index = DigestIndex(index_path)
+
+        # Print error if encountered, the index is rebuilt
+        except ValueError as error:
+            print("Failed to read index,", error)
+
+    if index is None:
+        record_count = write_index(
+            index_path= index_path,
+            records= read_new_records(database, 0, last_file_id),
+            last_file_id= last_file_id,
+            unsized_count= count_unsized_records(database, last_file_id))
+        return record_count, record_count
+
+    # The file IDs went back, the records of the index may not be those
+    # of the database
+    if index.last_file_id > last_file_id:
+        print(f"File IDs of {database} went back to {last_file_id}, "
+            f"rebuilding the index (last file ID {index.last_file_id})")
+        index.close()
+        return export_index(database, index_path, full=True)
+
+    # Records left out got their size without a new file ID (or were
+    # deleted), they are only found by reading all the records again
+    if count_unsized_records(database, index.last_file_id) < index.unsized_count:
+        print(f"Sizes of records of {database} were filled, "
+            f"rebuilding the index")
+        index.close()
+        return export_index(database, index_path, full=True)
+
+    with index:
+        # Nothing was added since the index was written
+        if index.last_file_id == last_file_id:
+            return index.record_count, 0
+
+        new_records = list(read_new_records(database, index.last_file_id,
+            last_file_id))
+        record_count = write_index(
+            index_path= index_path,
+            records= heapq.merge(index.records(), new_records),
+            last_file_id= last_file_id,
+            unsized_count= count_unsized_records(database, last_file_id))
+
+    return record_count, len(new_records)
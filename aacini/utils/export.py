@@ -0,0 +1,253 @@
+import os
+import sqlite3
+
+import pandas as pd
+
+from aacini.utils.functions import register_path_function
+from aacini.utils.catalog import connect_database
+
+######################################################################
+### Export functions
+######################################################################
+
+# Columns stored as dictionary-encoded categories per table
+categorical_columns = {
+    "file_information": ["ticket", "patient_id", "extension", "hts", "status",
+        "link_type"],
+    "missing_files": ["patient_id", "file_missing"],
+    "unmatching_hash": ["patient_id"]}
+
+# Columns stored as nullable integers per table
+integer_columns = {
+    "file_information": ["file_id", "size_bytes", "first_seen", "last_seen"],
+    "missing_files": ["first_missing_epoch", "last_missing_epoch",
+        "added_epoch"],
+    "unmatching_hash": ["first_epoch", "last_epoch"]}
+
+def import_pyarrow():
+    """
+    This function imports pyarrow, which is an optional dependency
+    only needed to export the catalog (pip install aacini[export]).
+
+    Returns:
+        Tuple (as pyarrow, pyarrow.parquet, pyarrow.feather) modules.
+    """
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.feather
+    except ImportError:
+        raise ImportError("Exporting requires pyarrow, install it with "
+            "'pip install pyarrow'.")
+
+    return pyarrow, pyarrow.parquet, pyarrow.feather
+
+def build_export_queries(ticket: str = None, since: int = None,
+    until: int = None, table_columns: dict = None) -> dict:
+    """
+    This function builds the queries to read the catalog tables,
+    filtered by ticket and by date.
+
+    Args:
+        ticket (str): name of the package sent by the lab.
+        since (int): start of the date range in seconds since epoch.
+        until (int): end of the date range in seconds since epoch.
+        table_columns (dict): table names and their columns, paths 
+            stored as directory IDs are rebuilt with the SQL function 
+            file_path. All the columns are read as stored if None.
+
+    Returns:
+        Dictionary of table names and tuples (as query, parameters).
+    """
+
+    parameters = {"ticket": ticket, "since": since, "until": until}
+
+    # The date column used to filter each table
+    date_columns = {
+        "file_information": "first_seen",
+        "missing_files": "last_missing_epoch",
+        "unmatching_hash": "last_epoch"}
+
+    # Paths are rebuilt from the directory IDs, paths kept in full are
+    # exported as they are
+    location_columns = {
+        "file_location": "directory_id",
+        "first_location": "first_directory_id",
+        "last_location": "last_directory_id"}
+
+    # Tables without ticket column are filtered by the patients of
+    # the ticket
+    ticket_conditions = {
+        "file_information": "ticket = :ticket",
+        "missing_files": """patient_id IN (SELECT patient_id
+            FROM file_information WHERE ticket = :ticket)""",
+        "unmatching_hash": """patient_id IN (SELECT patient_id
+            FROM file_information WHERE ticket = :ticket)"""}
+
+    queries = {}
+    for table, date_column in date_columns.items():
+        conditions = []
+        if ticket is not None:
+            conditions.append(ticket_conditions[table])
+        if since is not None:
+            conditions.append(f"{date_column} >= :since")
+        if until is not None:
+            conditions.append(f"{date_column} <= :until")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # Select the columns of the table, rebuilding the paths
+        columns = []
+        for column in (table_columns or {}).get(table, ["*"]):
+            if column in location_columns:
+                column = (f"COALESCE({column}, file_path("
+                    f"{location_columns[column]}, file_name)) AS {column}")
+            columns.append(column)
+
+        # Export the record ID of files so they can be joined, 
+        # databases of previous versions do not have a file_id column
+        if table == "file_information" \
+                and "file_id" not in (table_columns or {}).get(table, []):
+            columns.insert(0, "rowid AS file_id")
+        queries[table] = (f"SELECT {', '.join(columns)} FROM {table} {where}",
+            parameters)
+
+    return queries
+
+def convert_chunk(table: str, chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function converts the columns of a chunk read from the
+    database to compact types: categories for repeated strings (written
+    as dictionary-encoded columns) and integers for sizes and dates.
+
+    Args:
+        table (str): name of the table the chunk was read from.
+        chunk (pd.DataFrame): records read from the table.
+
+    Returns:
+        Converted chunk.
+    """
+
+    for column in categorical_columns.get(table, []):
+        if column in chunk.columns:
+            chunk[column] = chunk[column].astype("category")
+
+    for column in integer_columns.get(table, []):
+        if column in chunk.columns:
+            chunk[column] = pd.to_numeric(chunk[column],
+                errors="coerce").astype("Int64")
+
+    return chunk
+
+def write_chunk(chunk: pd.DataFrame, directory: str, part: int,
+    output_format: str):
+    """
+    This function writes a chunk as a Parquet or Arrow IPC (Feather)
+    file in a directory.
+
+    Args:
+        chunk (pd.DataFrame): records to write.
+        directory (str): directory where the file is written.
+        part (int): number of the part, used in the file name.
+        output_format (str): "parquet" or "feather".
+
+    Returns:
+        Path of the written file.
+    """
+
+    pyarrow, parquet, feather = import_pyarrow()
+
+    os.makedirs(directory, exist_ok=True)
+    arrow_table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+
+    if output_format == "parquet":
+        file_path = os.path.join(directory, f"part-{part:05d}.parquet")
+        parquet.write_table(arrow_table, file_path, compression="zstd")
+    else:
+        file_path = os.path.join(directory, f"part-{part:05d}.arrow")
+        feather.write_feather(arrow_table, file_path, compression="zstd")
+
+    return file_path
+
+def export_catalog(database: str, output_dir: str, ticket: str = None,
+    since: int = None, until: int = None, output_format: str = "parquet",
+    chunk_size: int = 100000) -> dict:
+    """
+    This function exports the file_information, missing_files and
+    unmatching_hash tables to Parquet or Arrow IPC files, reading the
+    database in chunks of chunk_size records. The file_information
+    table is partitioned by ticket ("ticket=<name>" directories),
+    which analytics tools (pandas, pyarrow, DuckDB, Spark) read as a
+    partition column.
+
+    Args:
+        database (str): name of the database to connect to.
+        output_dir (str): directory where the tables are written.
+        ticket (str): export only the records of this ticket.
+        since (int): start of the date range in seconds since epoch.
+        until (int): end of the date range in seconds since epoch.
+        output_format (str): "parquet" or "feather".
+        chunk_size (int): number of records read and written per file.
+
+    Returns:
+        Dictionary of table names and number of records exported.
+    """
+
+    # Fail before reading the database if pyarrow is missing
+    import_pyarrow()
+
+    exported_records = {}
+
+    connection = connect_database(database)
+    register_path_function(connection)
+
+    try:
+        # List the columns of the tables, tables that do not exist in 
+        # the database have none
+        table_columns = {table: [record[1] for record in connection.execute(
+                f"PRAGMA table_info({table})")]
+            for table in categorical_columns}
+
+        for table, (query, parameters) in build_export_queries(
+                ticket=ticket, since=since, until=until, 
+                table_columns=table_columns).items():
+
+            exported_records[table] = 0
+
+            # Skip tables that do not exist in the database
+            if table_columns[table] == []:
+                continue
+
+            part = 0
+            for chunk in pd.read_sql_query(query, connection,
+                    params=parameters, chunksize=chunk_size):
+                chunk = convert_chunk(table, chunk)
+                exported_records[table] += len(chunk)
+
+                # Partition file_information by ticket
+                if table == "file_information":
+                    for ticket_name, ticket_chunk in chunk.groupby(
+                            "ticket", observed=True):
+                        write_chunk(
+                            chunk= ticket_chunk.drop(columns="ticket"),
+                            directory= os.path.join(output_dir, table,
+                                f"ticket={ticket_name}"),
+                            part= part,
+                            output_format= output_format)
+                else:
+                    write_chunk(
+                        chunk= chunk,
+                        directory= os.path.join(output_dir, table),
+                        part= part,
+                        output_format= output_format)
+                part += 1
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        connection.close()
+
+    return exported_records
@@ -0,0 +1,398 @@
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import zlib
+
+from aacini.utils.analyzers import Analyzer
+from aacini.utils.analyzers import analyze_files
+from aacini.utils.analyzers import register_analyzer
+from aacini.utils.catalog import connect_database
+
+######################################################################
+### FASTQ functions
+######################################################################
+
+# Size in bytes of the blocks of lines read at once (32 MB)
+block_size = 32*1024*1024
+
+# Mates of a paired-end sample, e.g. "S1_L001_R1_001.fastq.gz" and
+# "S1_L001_R2_001.fastq.gz" or "S1_1.fq" and "S1_2.fq"
+mate_pattern = re.compile(r"^(.*[._])(R?)([12])((?:_\d+)?\.f(?:ast)?q(?:\.gz)?)$")
+
+def open_fastq(file: str, threads: int = 2):
+    """
+    This function opens a FASTQ file for reading in binary mode. Gzip
+    compressed files are decompressed by pigz where it is installed,
+    which reads, decompresses and checks the file in separate threads,
+    and by the gzip module otherwise.
+
+    Args:
+        file (str): file name or absolute path.
+        threads (int): threads used by pigz.
+
+    Returns:
+        Tuple (as file object, process) where process is the pigz
+        process or None.
+    """
+
+    if not file.endswith(".gz"):
+        return open(file, "rb", buffering=1024*1024), None
+
+    pigz = shutil.which("pigz")
+    if pigz is None:
+        return gzip.open(file, "rb"), None
+
+    process = subprocess.Popen([pigz, "-dc", "-p", str(max(1, threads)), file],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=1024*1024)
+    return process.stdout, process
+
+def split_lines(data: bytes) -> list:
+    """
+    This function splits bytes into lines without their line ends.
+    """
+
+    lines = data.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    return lines
+
+def read_line_blocks(opened_file, size: int = block_size):
+    """
+    This function reads a file in blocks of complete lines. The file is
+    read with read1, which returns the data decompressed so far, so the
+    lines read before a decompression error (e.g. a truncated gzip
+    stream) are returned before the error is raised again.
+
+    Args:
+        opened_file (file object): file opened in binary mode.
+        size (int): size in bytes of the blocks.
+
+    Returns:
+        Generator of lists of lines without their line ends, the last
+        line is incomplete if the file does not end with a line end.
+    """
+
+    chunks = []
+    chunks_size = 0
+    rest = b""
+
+    try:
+        while True:
+            chunk = opened_file.read1(size)
+            if chunk == b"":
+                break
+            chunks.append(chunk)
+            chunks_size += len(chunk)
+
+            # Keep the incomplete last line for the next block
+            if chunks_size >= size:
+                data = rest + b"".join(chunks)
+                chunks, chunks_size = [], 0
+                end = data.rfind(b"\n") + 1
+                rest = data[end:]
+                if end > 0:
+                    yield split_lines(data[:end])
+
+    # Give the lines read before the error
+    except (EOFError, zlib.error, OSError):
+        lines = split_lines(rest + b"".join(chunks))
+        if lines:
+            yield lines
+        raise
+
+    lines = split_lines(rest + b"".join(chunks))
+    if lines:
+        yield lines
+
+def count_fastq(file: str, threads: int = 2) -> dict:
+    """
+    This function streams the records of a FASTQ file and counts its
+    reads and bases. The file is read in blocks of lines, so the memory
+    used does not depend on the size of the file, and the records read
+    before a decompression error are counted. A file is truncated
+    if the decompression stops before the end of the gzip stream or if
+    the last record does not have four lines or its quality line is
+    shorter than its sequence.
+
+    Args:
+        file (str): file name or absolute path.
+        threads (int): threads used to decompress the file.
+
+    Returns:
+        Dictionary with the number of "reads" and "bases" and the
+        "result" of the check ("ok", "truncated" or "malformed").
+    """
+
+    bases = 0
+    line_count = 0
+    last_record = []
+    result = "ok"
+
+    opened_file, process = open_fastq(file, threads=threads)
+
+    try:
+        with opened_file:
+            for lines in read_line_blocks(opened_file):
+                # Records start at a multiple of four lines in the file,
+                # a block may start inside a record
+                header_offset = -line_count % 4
+                sequence_offset = (1 - line_count) % 4
+                line_count += len(lines)
+
+                # Every first line of a record is its header
+                if not all(line.startswith(b"@") 
+                        for line in lines[header_offset::4]):
+                    result = "malformed"
+                    break
+
+                # Sequence lines, without their line ends
+                bases += sum(len(sequence.rstrip(b"\r")) 
+                    for sequence in lines[sequence_offset::4])
+
+                # Keep the lines of the last record
+                last_record = (last_record + lines[-4:])[-(line_count % 4 or 4):]
+
+    # Print error if encountered, the file is truncated
+    except (EOFError, zlib.error, OSError) as error:
+        print("Failed to read FASTQ file,", file, error)
+        result = "truncated"
+
+    # pigz exits with an error if the gzip stream is truncated
+    if process is not None and process.wait() != 0 and result == "ok":
+        result = "truncated"
+
+    # The last record is incomplete if it has less than four lines or
+    # its quality line is shorter than its sequence
+    reads = line_count // 4
+    incomplete = False
+    if line_count % 4 != 0:
+        incomplete = True
+    elif line_count > 0 and len(last_record[3].rstrip(b"\r")) \
+            < len(last_record[1].rstrip(b"\r")):
+        incomplete = True
+        reads -= 1
+
+    # Only complete records are counted
+    if incomplete and result != "malformed":
+        result = "truncated"
+        if len(last_record) >= 2:
+            bases -= len(last_record[1].rstrip(b"\r"))
+
+    return {"reads": reads, "bases": bases, "result": result}
+
+def is_fastq(entry) -> bool:
+    """
+    This function tells if a file is a FASTQ file (".fastq" or
+    ".fastq.gz").
+
+    Args:
+        entry (FileEntry): file to check.
+
+    Returns:
+        True if the file is a FASTQ file.
+    """
+
+    return entry.hts == "fastq"
+
+def find_mates(file_entries: list) -> dict:
+    """
+    This function pairs the R1 and R2 FASTQ files of the same sample
+    directory by their names.
+
+    Args:
+        file_entries (list): list of FileEntry records.
+
+    Returns:
+        Dictionary of absolute file paths and the absolute paths of
+        their mates.
+    """
+
+    pairs = {}
+    for entry in file_entries:
+        match = mate_pattern.match(entry.name)
+        if not is_fastq(entry) or match is None:
+            continue
+        prefix, read_prefix, mate, suffix = match.groups()
+        key = (os.path.dirname(entry.path), prefix, read_prefix, suffix)
+        pairs.setdefault(key, {})[mate] = entry.path
+
+    mates = {}
+    for pair in pairs.values():
+        if len(pair) == 2:
+            mates[pair["1"]] = pair["2"]
+            mates[pair["2"]] = pair["1"]
+
+    return mates
+
+def count_fastq_entry(entry, threads: int = 2) -> dict:
+    """
+    This function counts the reads and bases of a FASTQ file (see
+    count_fastq).
+
+    Args:
+        entry (FileEntry): file to read.
+        threads (int): threads used to decompress the file.
+
+    Returns:
+        Dictionary with the number of "reads" and "bases" and the
+        "result" of the check.
+    """
+
+    return count_fastq(entry.path, threads=threads)
+
+# Analyzer of the FASTQ files, cached by digest
+fastq_analyzer = register_analyzer(Analyzer(
+    name= "fastq_stats",
+    version= "2",
+    categories= ("fastq",),
+    function= count_fastq_entry))
+
+def analyze_fastq_files(file_entries: list, workers: int = 2,
+    threads: int = 2, database: str = None, digests: dict = None):
+    """
+    This function counts the reads and bases of the FASTQ files of a
+    list in a pool of processes, separate from the pools hashing the
+    files, so the parsing of the records is not limited by the GIL.
+    Files with a digest already counted take the counts from the cache.
+
+    Args:
+        file_entries (list): list of FileEntry records.
+        workers (int): number of processes reading files.
+        threads (int): threads used by each process to decompress.
+        database (str): name of the database with the analysis cache,
+            None to read every file.
+        digests (dict): absolute file paths and their digests.
+
+    Returns:
+        Generator of tuples (as FileEntry, statistics) where statistics
+        is the dictionary of count_fastq with the "mate_reads" of the
+        mate file (None if the file has no mate).
+    """
+
+    entries_to_read = [entry for entry in file_entries if is_fastq(entry)]
+    if entries_to_read == []:
+        return
+
+    results = {entry.path: statistics for entry, statistics in analyze_files(
+        database= database,
+        analyzer= fastq_analyzer,
+        file_entries= entries_to_read,
+        digests= digests,
+        workers= max(1, workers),
+        threads= threads)}
+
+    # Compare the reads of each file with those of its mate
+    mates = find_mates(entries_to_read)
+    for entry in entries_to_read:
+        statistics = dict(results[entry.path])
+        statistics["mate_reads"] = None
+        if entry.path in mates:
+            statistics["mate_reads"] = results[mates[entry.path]]["reads"]
+        yield entry, statistics
+
+def record_fastq_stats(database: str, patient_id: str, file_name: str,
+    statistics: dict):
+    """
+    Records the statistics of a FASTQ file in the file_content table,
+    one row per feature ("reads", "bases" and "mate_reads"), replacing
+    those of a previous run.
+
+    Args:
+        database (str): name of the database to connect to.
+        patient_id (str): unique string to identify the patient.
+        file_name (str): full file name.
+        statistics (dict): statistics from analyze_fastq_files.
+
+    Returns:
+        Information recorded into the "File content" table in the
+        database.
+    """
+
+    try:
+        # Connect to database and create a cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Replace the statistics of a previous run
+        cursor.execute("""DELETE FROM file_content
+                        WHERE patient_id = :patient_id
+                            AND file_name = :file_name
+                            AND file_type = "fastq" """,
+                            {"patient_id": patient_id,
+                            "file_name": file_name})
+
+        # Record information into database table
+        cursor.executemany("""INSERT INTO file_content VALUES(
+                        :patient_id,
+                        :file_name,
+                        "fastq",
+                        :feature_count,
+                        :feature_type)""",
+                            [{"patient_id": patient_id,
+                            "file_name": file_name,
+                            "feature_count": statistics[feature_type],
+                            "feature_type": feature_type}
+                            for feature_type in ["reads", "bases", "mate_reads"]
+                            if statistics[feature_type] is not None])
+
+        # Commit cursor to database
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+def list_fastq_mismatches(database: str) -> list:
+    """
+    This function lists the FASTQ files whose number of reads is not
+    the number of reads of their mate (R1 and R2).
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        List of tuples (as patient_id, file_name, reads, mate_reads).
+    """
+
+    mismatches = []
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""SELECT reads.patient_id, reads.file_name,
+                reads.feature_count, mates.feature_count
+            FROM file_content AS reads
+            JOIN file_content AS mates
+                ON mates.patient_id = reads.patient_id
+                AND mates.file_name = reads.file_name
+                AND mates.file_type = "fastq"
+                AND mates.feature_type = "mate_reads"
+            WHERE reads.file_type = "fastq"
+                AND reads.feature_type = "reads"
+                AND reads.feature_count != mates.feature_count
+            ORDER BY reads.patient_id, reads.file_name""")
+
+        mismatches = cursor.fetchall()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return mismatches
@@ -7,11 +7,21 @@ import os
 import sqlite3
 import datetime
 import sys
+import zlib
+import concurrent.futures
+import functools
+import contextlib
 
 # Extensions list and categories from constants.py
 from aacini.utils.constants import extensions_list
 from aacini.utils.constants import extensions_categories
 from aacini.utils.constants import essential_files_patterns
+from aacini.utils.constants import xattr_sha256
+from aacini.utils.constants import xattr_stamp
+from aacini.utils.constants import bgzf_eof
+from aacini.utils.constants import plain_gzip_check_size
+from aacini.utils.catalog import CatalogConnection
+from aacini.utils.catalog import connect_database
 
 ######################################################################
 ### File information extraction functions
@@ -20,6 +30,8 @@ from aacini.utils.constants import essential_files_patterns
 def list_file_path(directory_path: str) -> list:
     """
     This function lists the file paths of files in a given directory.
+    The directory is walked by scan_directory, so links to directories
+    are not followed and link loops can not hang the walk.
     
     Args:
         directory_path (str): path of the directory to list files from.
@@ -28,21 +40,11 @@ def list_file_path(directory_path: str) -> list:
         List of Possix file paths.
     """
     
-    # List paths of directories to process
-    # List files in the directory
-    file_path_list = []
-    
-    # Recursively iterate through the directory
-    for file_path in pathlib.Path(directory_path).rglob("*"):
-        
-        # Keep only files
-        if os.path.isfile(file_path) == True:
-            name = pathlib.Path(file_path).name
-            file_path = file_path
-            
-            # Avoid files that start with . (e.g. ".DS_Store")
-            if not name.startswith("."):
-                file_path_list.append(file_path)
+    # Keep the paths relative to the directory as given
+    root_path = os.path.abspath(directory_path)
+    file_path_list = [
+        pathlib.Path(directory_path, os.path.relpath(entry.path, root_path))
+        for entry in scan_directory(directory_path, patient_id="")]
     
     return file_path_list
 
@@ -57,21 +59,9 @@ def list_files(directory_path: str) -> list:
         List of file names.
     """
 
-    # List paths of directories to process
-    # List files in the directory
-    file_list = []
-        
-    # Recursively iterate through the directory
-    for file_path in pathlib.Path(directory_path).rglob("*"):
-            
-        # Keep only files
-        if os.path.isfile(file_path) == True:
-            name = pathlib.Path(file_path).name
-            file_path = file_path
-                
-            # Avoid files that start with . (e.g. ".DS_Store")
-            if not name.startswith("."):
-                file_list.append(name)
+    # Files that start with . (e.g. ".DS_Store") are skipped by the walk
+    file_list = [entry.name 
+        for entry in scan_directory(directory_path, patient_id="")]
     
     return file_list
 
@@ -173,20 +163,17 @@ def get_patient_id(directory: str) -> str:
     patient_ID = os.path.basename(directory)
     return patient_ID
 
-def get_file_size(file: str) -> str:
+def format_size(size: int) -> str:
     """
-    This function gets the size of the file.
+    This function converts a size in bytes to a human readable size.
 
     Args:
-        file (str): file name or absolute path.
+        size (int): size in bytes.
 
     Returns:
         File size.
     """
 
-    # Get size in bytes
-    size = os.path.getsize(file)
-    
     # Convert to human readable depending on the size
     if size < 1024:
         return f"{size} bytes"
@@ -200,36 +187,166 @@ def get_file_size(file: str) -> str:
     elif size < 1024*1024*1024*1024:
         return f"{round(size/(1024*1024*1024), 2)} GB"
 
-def create_sha256(file: str) -> str:
+    else:
+        return f"{round(size/(1024*1024*1024*1024), 2)} TB"
+
+def get_file_size(file: str) -> str:
+    """
+    This function gets the size of the file.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        File size.
+    """
+
+    # Get size in bytes and convert to human readable
+    return format_size(os.path.getsize(file))
+
+def read_cached_sha256(file: str, stat: os.stat_result) -> str:
+    """
+    This function reads the sha256 hash stored in the extended 
+    attributes of a file by a previous run (of any database). The hash 
+    is only returned if the size and modification time stored with it 
+    still match the file.
+
+    Args:
+        file (str): file name or absolute path.
+        stat (os.stat_result): current status of the file.
+
+    Returns:
+        Hexadecimal hash of the file or None if there is no valid 
+        cached hash.
+    """
+
+    # Extended attributes are not available on every platform
+    if not hasattr(os, "getxattr"):
+        return None
+
+    try:
+        cached_hash = os.getxattr(file, xattr_sha256).decode()
+        cached_stamp = os.getxattr(file, xattr_stamp).decode()
+    except OSError:
+        return None
+
+    # Compare the stamp of the cached hash with the file
+    if cached_stamp != f"{stat.st_size}:{stat.st_mtime_ns}":
+        return None
+
+    return cached_hash
+
+def write_cached_sha256(file: str, stat: os.stat_result, sha256: str):
+    """
+    This function stores the sha256 hash of a file in its extended 
+    attributes together with the size and modification time of the 
+    file when it was hashed. Files on filesystems without extended 
+    attributes or without write permission are skipped.
+
+    Args:
+        file (str): file name or absolute path.
+        stat (os.stat_result): status of the file when it was hashed.
+        sha256 (str): hexadecimal hash of the file.
+
+    Returns:
+        Hash stored in the extended attributes of the file.
+    """
+
+    # Extended attributes are not available on every platform
+    if not hasattr(os, "setxattr"):
+        return
+
+    try:
+        os.setxattr(file, xattr_sha256, sha256.encode())
+        os.setxattr(file, xattr_stamp, 
+            f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    except OSError:
+        pass
+
+def create_sha256(file: str, drop_cache: bool = True, 
+    xattr_cache: bool = False, trust_cache: bool = True,
+    throttle = None) -> str:
     """
     This function creates a 32-byte hash or message digest 
     using the sha256 algorithm.
 
+    Where available, the kernel is told that the file is read 
+    sequentially (larger readahead) and the pages already hashed are
+    dropped from the page cache, so hashing large files does not evict
+    the cache of other services running on the node.
+
     Args:
         file (str): file name or absolute path.
+        drop_cache (bool): drop the pages of the file from the page 
+            cache after hashing them.
+        xattr_cache (bool): reuse the hash stored in the extended 
+            attributes of the file and store the new hash there.
+        trust_cache (bool): if False, the file is always read and the
+            hash in the extended attributes is refreshed.
+        throttle (IOThrottle): limits of bandwidth and open files shared
+            with other workers, None to read without limits.
 
     Returns:
         Hexadecimal 32-byte hash of the file using the sha256 algorithm.
     """
 
+    # Reuse the hash from a previous run if the file did not change
+    if xattr_cache:
+        stat = os.stat(file)
+        if trust_cache:
+            cached_hash = read_cached_sha256(file, stat)
+            if cached_hash is not None:
+                return cached_hash
+
     # Instantiate sha256 algorithm
     sha256 = hashlib.sha256()
     
-    # Size in bytes to read in chunks of 128 MB
+    # Size in bytes to read in chunks of 128 MB, throttled reads are
+    # smaller to keep the rate smooth
     blocksize = 137217728
+    if throttle is not None:
+        blocksize = throttle.chunk_size
+
+    # posix_fadvise is not available on every platform (e.g. macOS)
+    fadvise = hasattr(os, "posix_fadvise")
+
+    # Wait for a free slot if the number of open files is limited
+    open_slot = contextlib.nullcontext()
+    if throttle is not None:
+        open_slot = throttle.open_slot()
 
     # Open file in read binary mode
-    with open(file,"rb") as opened_file:
+    with open_slot, open(file,"rb") as opened_file:
+
+        if fadvise:
+            os.posix_fadvise(opened_file.fileno(), 0, 0, 
+                os.POSIX_FADV_SEQUENTIAL)
+
+        offset = 0
 
         # Iterate read file in chunks defined by blocksize variable
         for byte_block in iter(lambda: opened_file.read(blocksize),b""):
             
             # Generate hash for chunk being read
             sha256.update(byte_block)
+
+            # Wait until the bandwidth allows the next chunk
+            if throttle is not None:
+                throttle.consume(len(byte_block))
+
+            # Drop the chunk already hashed from the page cache
+            if fadvise and drop_cache:
+                os.posix_fadvise(opened_file.fileno(), offset, 
+                    len(byte_block), os.POSIX_FADV_DONTNEED)
+            offset += len(byte_block)
         
         # Close file
         opened_file.close()
 
+    # Store the hash only if the file did not change while hashing
+    if xattr_cache and os.stat(file).st_mtime_ns == stat.st_mtime_ns:
+        write_cached_sha256(file, stat, sha256.hexdigest())
+
     # Return hash
     return sha256.hexdigest()
 
@@ -262,10 +379,653 @@ def get_hts(file: str) -> str:
     #     file_format = pysam.HTSFile(content).format
     #     return file_format
 
+######################################################################
+### File entry model
+######################################################################
+
+class FileEntry:
+    """
+    Compact record of a file found in a patient directory, created once
+    per file by scan_directory so the extraction and reporting steps do
+    not derive the name, extension, category and size again. The class
+    uses __slots__ (no per-instance dictionary) and the patient ID, 
+    extension and category strings are interned, so a ticket with 
+    hundreds of thousands of files shares a single copy of each.
+
+    Attributes:
+        path (str): absolute path of the file.
+        name (str): file name.
+        patient_id (str): unique string to identify the patient.
+        extension (str): file extension (see get_extension).
+        hts (str): file category (see get_hts).
+        size (int): file size in bytes.
+        device (int): device where the file is stored.
+        inode (int): inode number of the file.
+        link_type (str): "regular", "symlink" (the path is a symbolic
+            link to the file) or "hardlink" (the file has several
+            names), None if unknown.
+    """
+
+    __slots__ = ("path", "name", "patient_id", "extension", "hts", 
+        "size", "device", "inode", "link_type")
+
+    def __init__(self, path: str, name: str, patient_id: str, 
+        extension: str, hts: str, size: int, device: int, inode: int,
+        link_type: str = None):
+        self.path = path
+        self.name = name
+        self.patient_id = patient_id
+        self.extension = extension
+        self.hts = hts
+        self.size = size
+        self.device = device
+        self.inode = inode
+        self.link_type = link_type
+
+    def __repr__(self):
+        return f"FileEntry({self.patient_id!r}, {self.path!r}, {self.size})"
+
+@functools.lru_cache(maxsize=4096)
+def classify_suffix(suffix: str) -> tuple:
+    """
+    This function gets the extension and category of a file name 
+    suffix with get_extension and get_hts, caching the result.
+
+    Args:
+        suffix (str): last three "."-separated parts of a file name.
+
+    Returns:
+        Tuple (as extension, hts) of interned strings or None.
+    """
+
+    extension = get_extension(suffix)
+    hts = get_hts(suffix)
+    return (sys.intern(extension) if extension else None, 
+        sys.intern(hts) if hts else None)
+
+def get_link_type(file: str, stat: os.stat_result, 
+    is_symlink: bool = None) -> str:
+    """
+    This function tells how a path points to its file.
+
+    Args:
+        file (str): file name or absolute path.
+        stat (os.stat_result): status of the file (following links).
+        is_symlink (bool): whether the path is a symbolic link if 
+            already known.
+
+    Returns:
+        "symlink" if the path is a symbolic link, "hardlink" if the file
+        has several names, "regular" otherwise.
+    """
+
+    if is_symlink is None:
+        is_symlink = os.path.islink(file)
+
+    if is_symlink:
+        return "symlink"
+    elif stat.st_nlink > 1:
+        return "hardlink"
+    return "regular"
+
+def make_file_entry(file: str, patient_id: str, 
+    stat: os.stat_result = None, link_type: str = None) -> FileEntry:
+    """
+    This function creates the FileEntry of a file.
+
+    Args:
+        file (str): file name or absolute path.
+        patient_id (str): unique string to identify the patient.
+        stat (os.stat_result): status of the file if already known.
+        link_type (str): link type of the path if already known (see
+            get_link_type).
+
+    Returns:
+        FileEntry of the file.
+    """
+
+    if stat is None:
+        stat = os.stat(file)
+    if link_type is None:
+        link_type = get_link_type(file, stat)
+
+    # The longest extensions have three parts (e.g. "vcf.gz.tbi"), so 
+    # the last three parts of the name classify the file
+    name = os.path.basename(file)
+    extension, hts = classify_suffix(".".join(name.split(".")[-3:]))
+
+    # Keep the path given when it is already absolute (e.g. the paths of
+    # scan_directory) instead of a copy
+    path = os.path.abspath(file)
+    if path == file:
+        path = file
+
+    return FileEntry(
+        path= path,
+        name= name,
+        patient_id= sys.intern(patient_id),
+        extension= extension,
+        hts= hts,
+        size= stat.st_size,
+        device= stat.st_dev,
+        inode= stat.st_ino,
+        link_type= sys.intern(link_type))
+
+def scan_directory(directory_path: str, patient_id: str = None,
+    follow_links: bool = False, one_file_system: bool = False) -> list:
+    """
+    This function lists the files of a patient directory as FileEntry
+    records in a single walk of the directory tree. Like list_file_path,
+    files that start with "." (e.g. ".DS_Store") are skipped. Symbolic
+    links to files are listed with the size and inode of their target;
+    symbolic links to directories are only walked with follow_links,
+    and a directory already walked (a link loop or two links to the
+    same directory) is not walked again.
+
+    Args:
+        directory_path (str): path of the directory to list files from.
+        patient_id (str): unique string to identify the patient, by 
+            default the name of the directory.
+        follow_links (bool): walk the directories symbolic links point to.
+        one_file_system (bool): skip the files and directories on
+            another device than the patient directory (e.g. links to
+            a network mount).
+
+    Returns:
+        List of FileEntry records.
+    """
+
+    if patient_id is None:
+        patient_id = get_patient_id(directory_path)
+
+    root_stat = os.stat(directory_path)
+    file_entries = []
+    directories = [os.path.abspath(directory_path)]
+    visited_directories = {(root_stat.st_dev, root_stat.st_ino)}
+
+    # Walk the tree with a stack of directories to scan
+    while directories:
+        with os.scandir(directories.pop()) as scanned_directory:
+            for entry in scanned_directory:
+                is_symlink = entry.is_symlink()
+
+                try:
+                    if entry.is_dir(follow_symlinks=follow_links):
+                        # Directories are only known by device and inode
+                        # when links are followed or devices compared
+                        if not (follow_links or one_file_system):
+                            directories.append(entry.path)
+                            continue
+
+                        stat = entry.stat()
+                        directory_key = (stat.st_dev, stat.st_ino)
+                        if one_file_system and stat.st_dev != root_stat.st_dev:
+                            continue
+                        if directory_key in visited_directories:
+                            print("Skipping directory already walked,", entry.path)
+                            continue
+                        visited_directories.add(directory_key)
+                        directories.append(entry.path)
+
+                    elif entry.is_file() and not entry.name.startswith("."):
+                        stat = entry.stat()
+                        if one_file_system and stat.st_dev != root_stat.st_dev:
+                            continue
+                        file_entries.append(make_file_entry(
+                            entry.path, patient_id, stat,
+                            get_link_type(entry.path, stat, is_symlink)))
+
+                # Print error if encountered (e.g. a link to itself)
+                except OSError as error:
+                    print("Failed to read directory entry,", entry.path, error)
+
+    return file_entries
+
+def find_linked_entries(file_entries: list) -> dict:
+    """
+    This function finds the files that are the same physical file
+    (same device and inode) as a file listed before them, e.g. hard
+    links between samples or symbolic links to a shared reference.
+
+    Args:
+        file_entries (list): list of FileEntry records.
+
+    Returns:
+        Dictionary of the absolute paths of the files linked to an
+        earlier file and the absolute path of that file.
+    """
+
+    first_paths = {}
+    linked_paths = {}
+    for entry in file_entries:
+        file_key = (entry.device, entry.inode)
+        if file_key in first_paths:
+            linked_paths[entry.path] = first_paths[file_key]
+        else:
+            first_paths[file_key] = entry.path
+
+    return linked_paths
+
+def share_linked_hashes(hashed_files, linked_entries: list, 
+    linked_paths: dict, shared_hashes: dict, xattr_cache: bool = False,
+    trust_cache: bool = True, throttle = None):
+    """
+    This function adds the files linked to another file to the files
+    being hashed, with the hash of that file, so each physical file is
+    read once. The hashes are kept in shared_hashes for the files
+    linked to them from the next patient directories.
+
+    Args:
+        hashed_files (iterable): tuples (as FileEntry, hash) of the
+            files hashed.
+        linked_entries (list): list of FileEntry records of the files
+            linked to another file (see find_linked_entries).
+        linked_paths (dict): absolute paths of the linked files and of
+            the files they are linked to.
+        shared_hashes (dict): absolute paths and hashes of the files
+            hashed in previous patient directories, updated.
+        xattr_cache (bool): reuse and store hashes in the extended 
+            attributes of the linked files hashed themselves.
+        trust_cache (bool): if False, hashes in the extended attributes
+            are refreshed instead of reused.
+        throttle (IOThrottle): limits of bandwidth and open files of the
+            run, None to read without limits.
+
+    Returns:
+        Generator of tuples (as FileEntry, hash). Linked files that can
+        not be read are reported and left out, like in hash_files.
+    """
+
+    linked_files = set(linked_paths.values())
+
+    # Files linked to a file already hashed take its hash at once
+    waiting_entries = {}
+    for entry in linked_entries:
+        first_path = linked_paths[entry.path]
+        if first_path in shared_hashes:
+            yield entry, shared_hashes[first_path]
+        else:
+            waiting_entries.setdefault(first_path, []).append(entry)
+
+    for entry, hash256 in hashed_files:
+        yield entry, hash256
+        if entry.path in linked_files:
+            shared_hashes[entry.path] = hash256
+            for linked_entry in waiting_entries.pop(entry.path, []):
+                yield linked_entry, hash256
+
+    # Files linked to a file that was not hashed are hashed themselves,
+    # with the options of the run
+    for entries in waiting_entries.values():
+        for entry in entries:
+            try:
+                file_hash = create_sha256(entry.path, xattr_cache=xattr_cache,
+                    trust_cache=trust_cache, throttle=throttle)
+            except OSError as error:
+                print("\nCould not read", entry.path + ",", error.strerror)
+                continue
+            yield entry, file_hash
+
+######################################################################
+### Integrity functions
+######################################################################
+
+def is_compressed_hts(entry: FileEntry) -> bool:
+    """
+    This function tells if a file is a gzip compressed file of the 
+    "vcf" or "fastq" categories (e.g. ".vcf.gz" or ".fastq.gz").
+
+    Args:
+        entry (FileEntry): file to check.
+
+    Returns:
+        True if the integrity of the file can be checked. Empty files
+        are reported as empty, not checked.
+    """
+
+    return (entry.hts in ("vcf", "fastq") and entry.size != 0
+        and entry.extension is not None and entry.extension.endswith("gz"))
+
+def is_bgzf_header(header: bytes) -> bool:
+    """
+    This function tells if the first 18 bytes of a gzip file are the
+    header of a BGZF block (the "BC" subfield in the gzip extra field).
+
+    Args:
+        header (bytes): first 18 bytes of the file.
+
+    Returns:
+        True if the file is a BGZF file.
+    """
+
+    return bool(header[3] & 4) and header[12:14] == b"BC"
+
+def check_gzip_members(opened_file) -> str:
+    """
+    This function decompresses a plain gzip file in chunks, member by
+    member, discarding the output. zlib checks the CRC32 and the size
+    in the trailer of each member against the decompressed data.
+
+    Args:
+        opened_file (file object): gzip file opened in read binary mode
+            at its start.
+
+    Returns:
+        "ok" if every member is complete and matches its trailer or
+        "truncated" otherwise.
+    """
+
+    decompressor = zlib.decompressobj(wbits=31)
+    member_open = False
+    try:
+        for chunk in iter(lambda: opened_file.read(1024*1024), b""):
+            while chunk:
+                decompressor.decompress(chunk, 16*1024*1024)
+                member_open = True
+                if decompressor.eof:
+                    # Start a new member with the remaining data,
+                    # ignoring zero padding after the last member
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=31)
+                    member_open = False
+                    if not chunk.strip(b"\0"):
+                        chunk = b""
+                else:
+                    chunk = decompressor.unconsumed_tail
+    except zlib.error:
+        return "truncated"
+
+    # The last member must be complete
+    if member_open:
+        return "truncated"
+
+    return "ok"
+
+def check_gzip_eof(file: str) -> str:
+    """
+    This function checks if a gzip file is truncated by reading only 
+    its first and last bytes. BGZF files (e.g. bgzipped ".vcf.gz") 
+    must end with the 28-byte BGZF EOF block. Plain gzip files up to
+    plain_gzip_check_size bytes are decompressed to check the CRC and
+    size in their trailer, larger ones are only validated by
+    scan_gzip_blocks.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        "ok" if the file ends with the BGZF EOF block or its trailer
+        matches, "truncated" if it is not a gzip file, the EOF block is
+        missing or the trailer does not match, "unverified" for large
+        plain gzip files.
+    """
+
+    with open(file, "rb") as opened_file:
+        header = opened_file.read(18)
+
+        # Files shorter than a gzip header or without the gzip magic 
+        # number can not be valid
+        if len(header) < 18 or header[:2] != b"\x1f\x8b":
+            return "truncated"
+
+        opened_file.seek(0, os.SEEK_END)
+        file_size = opened_file.tell()
+
+        # Plain gzip files have no EOF block, check their trailer
+        if not is_bgzf_header(header):
+            if file_size > plain_gzip_check_size:
+                return "unverified"
+            opened_file.seek(0)
+            return check_gzip_members(opened_file)
+
+        # Read the last 28 bytes of the file
+        if file_size < len(bgzf_eof):
+            return "truncated"
+        opened_file.seek(-len(bgzf_eof), os.SEEK_END)
+        if opened_file.read() != bgzf_eof:
+            return "truncated"
+
+    return "ok"
+
+def scan_gzip_blocks(file: str) -> str:
+    """
+    This function validates a gzip file with a streaming scan. For 
+    BGZF files it walks the block headers (reading 18 bytes per block)
+    and checks that the last block is the EOF block and ends at the end
+    of the file. Plain gzip files are decompressed in a stream and 
+    must end with a complete gzip member (see check_gzip_members).
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        "ok" if the file is complete or "truncated" otherwise.
+    """
+
+    # Cheap check first, it also detects non gzip files
+    result = check_gzip_eof(file)
+    if result == "truncated":
+        return result
+
+    file_size = os.path.getsize(file)
+
+    with open(file, "rb") as opened_file:
+
+        # Walk the BGZF blocks using the block size in each header
+        if is_bgzf_header(opened_file.read(18)):
+            offset = 0
+            block_size = 0
+            while offset < file_size:
+                opened_file.seek(offset)
+                header = opened_file.read(18)
+                if (len(header) < 18 or header[:2] != b"\x1f\x8b"
+                        or header[12:14] != b"BC"):
+                    return "truncated"
+                block_size = int.from_bytes(header[16:18], "little") + 1
+                offset += block_size
+
+            # Blocks must end exactly at the end of the file with the
+            # EOF block
+            if offset != file_size or block_size != len(bgzf_eof):
+                return "truncated"
+            return "ok"
+
+        # Small plain gzip files were already decompressed
+        if result == "ok":
+            return result
+
+        opened_file.seek(0)
+        return check_gzip_members(opened_file)
+
+def check_integrity(file: str, deep_scan: bool = False) -> str:
+    """
+    This function checks the integrity of a compressed file with
+    check_gzip_eof or scan_gzip_blocks.
+
+    Args:
+        file (str): file name or absolute path.
+        deep_scan (bool): validate the whole file with scan_gzip_blocks.
+
+    Returns:
+        Result of the check, or "unreadable" if the file can not be read
+        (e.g. it was removed or its permissions changed).
+    """
+
+    try:
+        if deep_scan:
+            return scan_gzip_blocks(file)
+        return check_gzip_eof(file)
+    except OSError:
+        return "unreadable"
+
+def check_files_integrity(file_entries: list, deep_scan: bool = False,
+    workers: int = 4):
+    """
+    This function checks the integrity of the compressed "vcf" and 
+    "fastq" files of a list in a pool of workers.
+
+    Args:
+        file_entries (list): list of FileEntry records.
+        deep_scan (bool): validate the whole file with scan_gzip_blocks
+            instead of only checking the EOF block.
+        workers (int): number of workers checking files.
+
+    Returns:
+        Generator of tuples (as FileEntry, result).
+    """
+
+    # Keep only files whose integrity can be checked
+    entries_to_check = [entry for entry in file_entries 
+        if is_compressed_hts(entry)]
+    check = functools.partial(check_integrity, deep_scan=deep_scan)
+
+    # A file that can not be read gets its own result instead of
+    # stopping the other checks
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, workers)) as pool:
+        for entry, result in zip(entries_to_check, 
+                pool.map(check, [entry.path for entry in entries_to_check])):
+            yield entry, result
+
 ######################################################################
 ### Database infrastructure functions
 ######################################################################
 
+def date_to_epoch(date: str) -> int:
+    """
+    This function converts a date recorded in the database as 
+    "%d/%m/%Y %H:%M:%S" text to seconds since the epoch, which can be
+    ordered and range-scanned with an index.
+
+    Args:
+        date (str): date in "%d/%m/%Y %H:%M:%S" format.
+
+    Returns:
+        Seconds since the epoch or None if the date is empty or can not
+        be parsed.
+    """
+
+    try:
+        return int(datetime.datetime.strptime(date, 
+            "%d/%m/%Y %H:%M:%S").timestamp())
+    except (TypeError, ValueError):
+        return None
+
+def epoch_to_iso(epoch: int) -> str:
+    """
+    This function converts seconds since the epoch to an ISO-8601 date
+    in local time.
+
+    Args:
+        epoch (int): seconds since the epoch.
+
+    Returns:
+        Date in ISO-8601 format or "" if epoch is None.
+    """
+
+    if epoch is None:
+        return ""
+    return datetime.datetime.fromtimestamp(epoch).isoformat()
+
+def add_missing_columns(cursor: sqlite3.Cursor, table: str, 
+    columns: dict) -> list:
+    """
+    This function adds columns to a table created by a previous 
+    version of aacini.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor of the database connection.
+        table (str): name of the table.
+        columns (dict): column names and their types.
+
+    Returns:
+        List of the names of the columns that were added.
+    """
+
+    # List the columns the table already has
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing_columns = [record[1] for record in cursor.fetchall()]
+
+    added_columns = []
+    for column, column_type in columns.items():
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            added_columns.append(column)
+
+    return added_columns
+
+def backfill_epoch(cursor: sqlite3.Cursor, table: str, 
+    columns: dict):
+    """
+    This function fills epoch columns added by add_missing_columns 
+    from the text dates already recorded in the table.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor of the database connection.
+        table (str): name of the table.
+        columns (dict): epoch column names and the text date column 
+            they are computed from.
+
+    Returns:
+        Epoch columns filled in the table.
+    """
+
+    for epoch_column, date_column in columns.items():
+        cursor.execute(f"""SELECT rowid,{date_column} 
+            FROM {table} 
+            WHERE {epoch_column} IS NULL""")
+        values = [(date_to_epoch(date), rowid) 
+            for rowid, date in cursor.fetchall()]
+        cursor.executemany(f"""UPDATE {table} 
+            SET {epoch_column} = ? WHERE rowid = ?""", values)
+
+def add_file_id(cursor: sqlite3.Cursor, create_statement: str) -> bool:
+    """
+    This function rebuilds the file_information table of previous 
+    versions of aacini, whose records were identified by their rowid, 
+    with a file_id column that is never reused (AUTOINCREMENT). The 
+    rowid of each record is kept as its file ID and the triggers on 
+    the table are created again.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor of the database connection.
+        create_statement (str): statement creating the table.
+
+    Returns:
+        True if the table was rebuilt.
+    """
+
+    # List the columns the table already has
+    cursor.execute("PRAGMA table_info(file_information)")
+    existing_columns = [record[1] for record in cursor.fetchall()]
+    if "file_id" in existing_columns:
+        return False
+
+    # Rebuild the table in one transaction
+    cursor.connection.commit()
+    cursor.execute("BEGIN IMMEDIATE")
+
+    # Triggers would follow the renamed table, keep them aside
+    cursor.execute("""SELECT name, sql FROM sqlite_master
+        WHERE type = "trigger" AND tbl_name = "file_information" """)
+    triggers = cursor.fetchall()
+    for name, _ in triggers:
+        cursor.execute(f"DROP TRIGGER {name}")
+
+    # Copy the records with their rowid as file ID, the indexes are 
+    # dropped with the previous table and created again by the caller
+    column_list = ", ".join(existing_columns)
+    cursor.execute("ALTER TABLE file_information RENAME TO file_information_previous")
+    cursor.execute(create_statement)
+    cursor.execute(f"""INSERT INTO file_information (file_id, {column_list})
+        SELECT rowid, {column_list} FROM file_information_previous""")
+    cursor.execute("DROP TABLE file_information_previous")
+
+    for _, sql in triggers:
+        cursor.execute(sql)
+
+    return True
+
 def create_file_information_table(database:str):
     """
     Creates table to store general file information of each file in 
@@ -278,12 +1038,19 @@ def create_file_information_table(database:str):
         Commited 'File information' table into the database.
     """ 
     
+    # Files reference their directory in the directories table
+    create_directory_table(database=database)
+
     # Connect to database and create a cursor
-    connection = sqlite3.connect(database)
+    connection = connect_database(database)
     cursor = connection.cursor()
 
-    # Create file_information table if it does not exists 
-    cursor.execute("""CREATE TABLE if not exists file_information (
+    # Create file_information table if it does not exists. The 
+    # file_location column is only filled for paths that can not be 
+    # rebuilt from directory_id and file_name. File IDs are never 
+    # reused, even once the last files are archived.
+    create_statement = """CREATE TABLE if not exists file_information (
+            file_id integer PRIMARY KEY AUTOINCREMENT,
             date text,
             ticket text,
             patient_id text,
@@ -294,13 +1061,63 @@ def create_file_information_table(database:str):
             file_location text,
             hts text,
             status text,
+            size_bytes integer,
+            first_seen integer,
+            last_seen integer,
+            directory_id integer,
+            link_type text,
             
             UNIQUE(patient_id, file_name, first_hash)
-            )""")
+            )"""
+    cursor.execute(create_statement)
+
+    # Add the columns of sortable timestamps to databases created 
+    # by previous versions and fill them from the text dates
+    added_columns = add_missing_columns(cursor, "file_information", {
+        "size_bytes": "integer",
+        "first_seen": "integer",
+        "last_seen": "integer"})
+    if "first_seen" in added_columns:
+        backfill_epoch(cursor, "file_information", {
+            "first_seen": "date", 
+            "last_seen": "date"})
+
+    # Move the absolute paths of previous versions to directory IDs
+    migrated_columns = add_missing_columns(cursor, "file_information", {
+        "directory_id": "integer"})
+    if migrated_columns:
+        migrate_locations(cursor, "file_information", {
+            "file_location": "directory_id"})
+
+    # Add the link type of the files to databases of previous versions
+    add_missing_columns(cursor, "file_information", {
+        "link_type": "text"})
+
+    # Give the records of previous versions a file ID that is not reused
+    rebuilt_table = add_file_id(cursor, create_statement)
+
+    # Create indexes for lookups per file and range queries per ticket
+    cursor.execute("""CREATE INDEX if not exists idx_file_information_patient
+        ON file_information (patient_id, file_name)""")
+    cursor.execute("""CREATE INDEX if not exists idx_file_information_ticket_seen
+        ON file_information (ticket, first_seen)""")
+    cursor.execute("""CREATE INDEX if not exists idx_file_information_status
+        ON file_information (status, hts)""")
+    cursor.execute("""CREATE INDEX if not exists idx_file_information_directory
+        ON file_information (directory_id)""")
+
+    # Records whose size in bytes is not known yet, left out of the
+    # digest index until it is filled
+    cursor.execute("""CREATE INDEX if not exists idx_file_information_unsized
+        ON file_information (file_id) WHERE size_bytes IS NULL""")
     
     # Commit cursor to database
     connection.commit()
 
+    # Reclaim the space of the migrated paths
+    if migrated_columns or rebuilt_table:
+        connection.execute("VACUUM")
+
     # Close cursor and connection
     cursor.close()
     connection.close()
@@ -318,7 +1135,7 @@ def create_file_content_table(database:str):
     """
     
     # Connect to database and create a cursor
-    connection = sqlite3.connect(database)
+    connection = connect_database(database)
     cursor = connection.cursor()
 
     # Create file_content table if it does not exist
@@ -350,7 +1167,7 @@ def create_essential_files_missing_table(database: str):
     """
     
     # Connect to database and create a cursor
-    connection = sqlite3.connect(database)
+    connection = connect_database(database)
     cursor = connection.cursor()
 
     # Create missing_files table if it does not exist
@@ -360,10 +1177,25 @@ def create_essential_files_missing_table(database: str):
             first_date_missing text,
             last_date_missing text,
             date_added text,
+            first_missing_epoch integer,
+            last_missing_epoch integer,
+            added_epoch integer,
 
             UNIQUE(patient_id, file_missing)
             )""")
 
+    # Add the columns of sortable timestamps to databases created 
+    # by previous versions and fill them from the text dates
+    added_columns = add_missing_columns(cursor, "missing_files", {
+        "first_missing_epoch": "integer",
+        "last_missing_epoch": "integer",
+        "added_epoch": "integer"})
+    if "first_missing_epoch" in added_columns:
+        backfill_epoch(cursor, "missing_files", {
+            "first_missing_epoch": "first_date_missing",
+            "last_missing_epoch": "last_date_missing",
+            "added_epoch": "date_added"})
+
     # Commit cursor to database
     connection.commit()
 
@@ -383,8 +1215,11 @@ def create_unmatching_hash_table(database: str):
         Commited 'Changed hash' table into the database.
     """
     
+    # Locations reference their directory in the directories table
+    create_directory_table(database=database)
+
     # Connect to database and create a cursor
-    connection = sqlite3.connect(database)
+    connection = connect_database(database)
     cursor = connection.cursor()
 
     # Create changed_hash table if it does not exist
@@ -399,9 +1234,31 @@ def create_unmatching_hash_table(database: str):
             last_size text,
             first_location text,
             last_location text,
+            first_epoch integer,
+            last_epoch integer,
+            first_directory_id integer,
+            last_directory_id integer,
 
             UNIQUE(patient_id, file_name)
             )""")
+
+    # Add the columns of sortable timestamps to databases created 
+    # by previous versions and fill them from the text dates
+    added_columns = add_missing_columns(cursor, "unmatching_hash", {
+        "first_epoch": "integer",
+        "last_epoch": "integer"})
+    if "first_epoch" in added_columns:
+        backfill_epoch(cursor, "unmatching_hash", {
+            "first_epoch": "first_date",
+            "last_epoch": "last_date"})
+
+    # Move the absolute paths of previous versions to directory IDs
+    if add_missing_columns(cursor, "unmatching_hash", {
+            "first_directory_id": "integer",
+            "last_directory_id": "integer"}):
+        migrate_locations(cursor, "unmatching_hash", {
+            "first_location": "first_directory_id",
+            "last_location": "last_directory_id"})
     
     # Commit cursor to database
     connection.commit()
@@ -410,41 +1267,550 @@ def create_unmatching_hash_table(database: str):
     cursor.close()
     connection.close()
 
-######################################################################
-### Database interaction functions
-######################################################################
-
-def record_file_info(database: str, ticket: str, patient_id: str, 
-    file_name: str, extension: str, file_size: str, first_hash: str, 
-    abs_path: str, file_type: str):
+def create_file_integrity_table(database: str):
     """
-    Extracts file information and records it in a table in the 
-    database.
+    Creates table to store the result of the integrity check of the
+    compressed files per patient if it does not exist already.
 
     Args:
         database (str): name of the database to connect to.
-        ticket (str): name of the package sent by the lab, corresponds
-            to the directory where the patient directory is stored.
-        patient_id (str): unique string to identify the patient.
-        file_name (str): full file name.
-        extension (str): literal file extension.
-        file_size (str): file size.
-        first_hash (str): file hash.
-        abs_path (str): absolute path of the file.
-        file_type (str): file type according to the extension. 
-            E.g.: If extension is "cram.crai" the file type is "cram".
-
+    
     Returns:
-        Information recorded into the "File Content" table in the 
-        database.
+        Commited 'File integrity' table into the database.
     """
-
+    
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Create file_integrity table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists file_integrity (
+            patient_id text,
+            file_name text,
+            file_location text,
+            check_type text,
+            result text,
+            date text,
+
+            UNIQUE(patient_id, file_name)
+            )""")
+    
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def create_observation_tables(database: str):
+    """
+    Creates the tables used to keep the history of every sighting of a 
+    file if they do not exist already:
+        - digests: one row per distinct sha256 hash, so observations 
+            store an integer instead of the 64 characters of the hash.
+        - observations: one row per file per run with its size and 
+            hash, referencing the file_information record (rowid).
+
+    Args:
+        database (str): name of the database to connect to.
+    
+    Returns:
+        Commited 'Observation' tables into the database.
+    """
+    
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Create digests table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists digests (
+            digest_id integer PRIMARY KEY,
+            sha256 text UNIQUE
+            )""")
+
+    # Create observations table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists observations (
+            run_id integer,
+            file_id integer,
+            size_bytes integer,
+            digest_id integer,
+            observed_at integer
+            )""")
+
+    # Create indexes for the history of a file and range queries
+    cursor.execute("""CREATE INDEX if not exists idx_observations_file
+        ON observations (file_id, observed_at)""")
+    cursor.execute("""CREATE INDEX if not exists idx_observations_time
+        ON observations (observed_at)""")
+    cursor.execute("""CREATE INDEX if not exists idx_observations_run
+        ON observations (run_id)""")
+    
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def create_aggregate_table(database: str):
+    """
+    Creates the table of aggregates per ticket, patient, category and 
+    status (file count, total bytes and last update) if it does not 
+    exist already, together with the triggers that keep it up to date 
+    on every insert, update and delete in the file_information table. 
+    Databases created by previous versions are filled once from the 
+    file_information table.
+
+    Args:
+        database (str): name of the database to connect to.
+    
+    Returns:
+        Commited 'Aggregates' table and triggers into the database.
+    """
+    
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Check if the table already exists
+    cursor.execute("""SELECT COUNT(name) FROM sqlite_master 
+        WHERE type = "table" AND name = "ticket_aggregates" """)
+    table_exists = cursor.fetchone()[0] == 1
+
+    # Create ticket_aggregates table if it does not exist. Missing 
+    # categories are stored as "" since NULL values never conflict.
+    cursor.execute("""CREATE TABLE if not exists ticket_aggregates (
+            ticket text,
+            patient_id text,
+            hts text,
+            status text,
+            file_count integer,
+            total_bytes integer,
+            last_update integer,
+
+            UNIQUE(ticket, patient_id, hts, status)
+            )""")
+
+    # Fill the table from the records already in the database
+    if not table_exists:
+        cursor.execute("""INSERT INTO ticket_aggregates
+            SELECT COALESCE(ticket, ""), COALESCE(patient_id, ""), 
+                COALESCE(hts, ""), COALESCE(status, ""), COUNT(*), 
+                COALESCE(SUM(size_bytes), 0), MAX(last_seen)
+            FROM file_information
+            GROUP BY 1, 2, 3, 4""")
+
+    # Statements adding or removing a record to the aggregates
+    add_record = """INSERT INTO ticket_aggregates VALUES(
+                COALESCE(NEW.ticket, ""), COALESCE(NEW.patient_id, ""), 
+                COALESCE(NEW.hts, ""), COALESCE(NEW.status, ""), 1, 
+                COALESCE(NEW.size_bytes, 0), CAST(strftime("%s", "now") AS integer))
+            ON CONFLICT(ticket, patient_id, hts, status) DO UPDATE SET
+                file_count = file_count + 1,
+                total_bytes = total_bytes + excluded.total_bytes,
+                last_update = excluded.last_update;"""
+    remove_record = """UPDATE ticket_aggregates SET
+                file_count = file_count - 1,
+                total_bytes = total_bytes - COALESCE(OLD.size_bytes, 0),
+                last_update = CAST(strftime("%s", "now") AS integer)
+            WHERE ticket = COALESCE(OLD.ticket, "") 
+                AND patient_id = COALESCE(OLD.patient_id, "")
+                AND hts = COALESCE(OLD.hts, "") 
+                AND status = COALESCE(OLD.status, "");
+            DELETE FROM ticket_aggregates WHERE file_count <= 0;"""
+
+    # Create the triggers on file_information
+    cursor.execute(f"""CREATE TRIGGER if not exists ticket_aggregates_insert
+        AFTER INSERT ON file_information
+        BEGIN
+            {add_record}
+        END""")
+    cursor.execute(f"""CREATE TRIGGER if not exists ticket_aggregates_delete
+        AFTER DELETE ON file_information
+        BEGIN
+            {remove_record}
+        END""")
+    cursor.execute(f"""CREATE TRIGGER if not exists ticket_aggregates_update
+        AFTER UPDATE OF ticket, patient_id, hts, status, size_bytes 
+            ON file_information
+        WHEN OLD.ticket IS NOT NEW.ticket 
+            OR OLD.patient_id IS NOT NEW.patient_id
+            OR OLD.hts IS NOT NEW.hts 
+            OR OLD.status IS NOT NEW.status
+            OR OLD.size_bytes IS NOT NEW.size_bytes
+        BEGIN
+            {remove_record}
+            {add_record}
+        END""")
+    
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def create_run_tables(database: str):
+    """
+    Creates the tables used to track extraction runs and their 
+    progress if they do not exist already:
+        - runs: one row per run of the "extract" command.
+        - run_patients: patient summaries per run, used to rebuild 
+            the report of a resumed run.
+        - run_checkpoints: one row per file completed in a run.
+
+    Args:
+        database (str): name of the database to connect to.
+    
+    Returns:
+        Commited 'Runs' tables into the database.
+    """
+    
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Create runs table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists runs (
+            run_id integer PRIMARY KEY AUTOINCREMENT,
+            ticket text,
+            input_path text,
+            start_date text,
+            start_string text,
+            end_date text,
+            status text
+            )""")
+
+    # Create run_patients table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists run_patients (
+            run_id integer,
+            patient_id text,
+            past_records integer,
+            summary text,
+            completed integer,
+
+            UNIQUE(run_id, patient_id)
+            )""")
+
+    # Create run_checkpoints table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists run_checkpoints (
+            run_id integer,
+            patient_id text,
+            file_location text,
+            hash text,
+            file_size text,
+            date text,
+
+            UNIQUE(run_id, file_location)
+            )""")
+    
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+######################################################################
+### Directory functions
+######################################################################
+
+def create_directory_table(database: str):
+    """
+    Creates the table of directories if it does not exist already. 
+    Paths are stored once per directory as its name and the ID of its
+    parent, so files only reference the ID of their directory instead
+    of repeating the ticket, patient and sample prefixes. The root 
+    directory has the parent 0 and an empty name.
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        Commited 'Directories' table into the database.
+    """
+
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Create directories table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists directories (
+            directory_id integer PRIMARY KEY,
+            parent_id integer,
+            name text,
+
+            UNIQUE(parent_id, name)
+            )""")
+
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def split_location(file_location: str) -> tuple:
+    """
+    This function splits an absolute file path into the path of its
+    directory and its name.
+
+    Args:
+        file_location (str): absolute path of the file.
+
+    Returns:
+        Tuple (as directory path, file name).
+    """
+
+    directory, _, file_name = file_location.rpartition("/")
+    return directory, file_name
+
+def get_directory_id(cursor: sqlite3.Cursor, directory_path: str,
+    create: bool = True) -> int:
+    """
+    This function gets the ID of a directory from its absolute path,
+    walking down from the root with the (parent_id, name) index. 
+    Missing directories are recorded if create is True. The IDs are
+    cached for the process, so the files of a directory only walk its
+    path once.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor of the database connection.
+        directory_path (str): absolute path of the directory.
+        create (bool): record the directories that are missing.
+
+    Returns:
+        ID of the directory or None if it is not recorded and create 
+        is False.
+    """
+
+    # Directories are never removed, a cached ID stays valid
+    connection = cursor.connection
+    cached = isinstance(connection, CatalogConnection)
+    if cached:
+        directory_id = connection.cached_value(("directory_id", directory_path))
+        if directory_id is not None:
+            return directory_id
+
+    directory_id = 0
+    for name in [""] + [name for name in directory_path.split("/") if name]:
+        cursor.execute("""SELECT directory_id FROM directories
+            WHERE parent_id = :parent_id AND name = :name""",
+            {"parent_id": directory_id, "name": name})
+        record = cursor.fetchone()
+
+        if record is not None:
+            directory_id = record[0]
+        elif create:
+            cursor.execute("""INSERT INTO directories (parent_id, name)
+                VALUES(:parent_id, :name)""",
+                {"parent_id": directory_id, "name": name})
+            directory_id = cursor.lastrowid
+        else:
+            return None
+
+    if cached:
+        connection.cache_value(("directory_id", directory_path), directory_id)
+
+    return directory_id
+
+def get_directory_path(cursor: sqlite3.Cursor, directory_id: int, 
+    cache: dict = None) -> str:
+    """
+    This function rebuilds the absolute path of a directory walking up
+    its parents.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor of the database connection.
+        directory_id (int): ID of the directory.
+        cache (dict): paths already rebuilt by directory ID, shared 
+            between calls.
+
+    Returns:
+        Absolute path of the directory ("" for the root).
+    """
+
+    if cache is None:
+        cache = {}
+
+    # Walk up until a directory with a known path (or the root)
+    names = []
+    current_id = directory_id
+    while current_id not in cache and current_id != 0:
+        cursor.execute("""SELECT parent_id,name FROM directories 
+            WHERE directory_id = ?""", (current_id,))
+        parent_id, name = cursor.fetchone()
+        names.append((current_id, name))
+        current_id = parent_id
+
+    # Walk down storing the path of every directory visited
+    path = cache.get(current_id, "")
+    for visited_id, name in reversed(names):
+        path = f"{path}/{name}" if name else path
+        cache[visited_id] = path
+
+    return cache.get(directory_id, path)
+
+def register_path_function(connection: sqlite3.Connection):
+    """
+    This function registers the SQL function file_path(directory_id,
+    file_name) in a connection, which rebuilds the absolute path of a
+    file. The paths of the directories are cached in the connection.
+
+    Args:
+        connection (sqlite3.Connection): connection to the database.
+    """
+
+    cache = {}
+    cursor = connection.cursor()
+
+    def file_path(directory_id, file_name):
+        if directory_id is None:
+            return None
+        return f"{get_directory_path(cursor, directory_id, cache)}/{file_name}"
+
+    connection.create_function("file_path", 2, file_path, deterministic=True)
+
+# Subquery of the IDs of a directory and all the directories below it
+subtree_query = """WITH RECURSIVE subtree(directory_id) AS (
+            SELECT :directory_id
+            UNION ALL
+            SELECT directories.directory_id FROM directories
+                JOIN subtree ON directories.parent_id = subtree.directory_id)
+        SELECT directory_id FROM subtree"""
+
+def list_files_under(database: str, directory_path: str) -> list:
+    """
+    This function lists the files recorded below a directory (e.g. a
+    ticket or sample directory), using the IDs of the directory and
+    its subdirectories instead of comparing path strings.
+
+    Args:
+        database (str): name of the database to connect to.
+        directory_path (str): absolute path of the directory.
+
+    Returns:
+        List of tuples (as file_id, patient_id, file_location, 
+        first_hash, size_bytes, last_seen).
+    """
+
+    files_list = []
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        register_path_function(connection)
+        cursor = connection.cursor()
+
+        directory_id = get_directory_id(cursor, 
+            os.path.abspath(directory_path), create=False)
+
+        if directory_id is not None:
+            cursor.execute(f"""SELECT rowid,patient_id,
+                    COALESCE(file_location, file_path(directory_id, file_name)),
+                    first_hash,size_bytes,last_seen
+                FROM file_information
+                WHERE directory_id IN ({subtree_query})
+                ORDER BY rowid""", {"directory_id": directory_id})
+            files_list = cursor.fetchall()
+
+    # Print error if encountered  
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return files_list
+
+def migrate_locations(cursor: sqlite3.Cursor, table: str, columns: dict):
+    """
+    This function moves the absolute paths recorded by previous 
+    versions of aacini to directory IDs. The path column is emptied 
+    when the path can be rebuilt from the directory ID and the file 
+    name.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor of the database connection.
+        table (str): name of the table.
+        columns (dict): path column names and the directory ID column
+            they are moved to.
+    """
+
+    for location_column, directory_column in columns.items():
+        cursor.execute(f"""SELECT rowid,{location_column},file_name 
+            FROM {table} WHERE {location_column} IS NOT NULL""")
+        updates = []
+        for rowid, file_location, file_name in cursor.fetchall():
+            directory, name = split_location(file_location)
+            updates.append({
+                "rowid": rowid,
+                "directory_id": get_directory_id(cursor, directory),
+                "file_location": None if name == file_name else file_location})
+
+        cursor.executemany(f"""UPDATE {table}
+            SET {directory_column} = :directory_id,
+                {location_column} = :file_location
+            WHERE rowid = :rowid""", updates)
+
+######################################################################
+### Database interaction functions
+######################################################################
+
+def record_file_info(database: str, ticket: str, patient_id: str, 
+    file_name: str, extension: str, file_size: str, first_hash: str, 
+    abs_path: str, file_type: str, size_bytes: int = None, 
+    run_id: int = None, link_type: str = None):
+    """
+    Extracts file information and records it in a table in the 
+    database. A file already recorded with the same hash keeps its 
+    first record, but its last_seen timestamp is updated and every
+    sighting is kept in the observations table.
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): name of the package sent by the lab, corresponds
+            to the directory where the patient directory is stored.
+        patient_id (str): unique string to identify the patient.
+        file_name (str): full file name.
+        extension (str): literal file extension.
+        file_size (str): file size.
+        first_hash (str): file hash.
+        abs_path (str): absolute path of the file.
+        file_type (str): file type according to the extension. 
+            E.g.: If extension is "cram.crai" the file type is "cram".
+        size_bytes (int): file size in bytes.
+        run_id (int): unique integer used to identify the run.
+        link_type (str): "regular", "symlink" or "hardlink" (see
+            get_link_type).
+
+    Returns:
+        Information recorded into the "File Content" table in the 
+        database.
+    """
+
+    # Establish the date of the record as text and seconds since epoch
+    today = datetime.datetime.today()
+    epoch = int(today.timestamp())
+
     # Connect to database and create a cursor
-    connection = sqlite3.connect(database)
+    connection = connect_database(database)
     cursor = connection.cursor()
 
+    # Reference the directory of the file instead of its full path. The
+    # path is kept only if it can not be rebuilt from the file name.
+    directory, name = split_location(abs_path)
+    directory_id = get_directory_id(cursor, directory)
+    file_location = None if name == file_name else abs_path
+
     # Record information into database table
-    cursor.execute("""INSERT OR IGNORE INTO file_information VALUES(
+    cursor.execute("""INSERT OR IGNORE INTO file_information (date, 
+                    ticket, patient_id, file_name, extension, file_size, 
+                    first_hash, file_location, hts, status, size_bytes, 
+                    first_seen, last_seen, directory_id, link_type) VALUES(
                     :date,
                     :ticket,
                     :patient_id,
@@ -454,17 +1820,70 @@ def record_file_info(database: str, ticket: str, patient_id: str,
                     :first_hash,
                     :file_location,
                     :hts,
-                    :status)""",
-                        {"date": datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S"),
+                    :status,
+                    :size_bytes,
+                    :first_seen,
+                    :last_seen,
+                    :directory_id,
+                    :link_type)""",
+                        {"date": today.strftime("%d/%m/%Y %H:%M:%S"),
                         "ticket": ticket,
                         "patient_id": patient_id,
                         "file_name": file_name,
                         "extension": extension,
                         "file_size": file_size,
                         "first_hash": first_hash,
-                        "file_location": abs_path,
+                        "file_location": file_location,
                         "hts": file_type,
-                        "status": ""})
+                        "status": "",
+                        "size_bytes": size_bytes,
+                        "first_seen": epoch,
+                        "last_seen": epoch,
+                        "directory_id": directory_id,
+                        "link_type": link_type})
+
+    # Update when the file was last seen, how it is linked now, and get
+    # its record ID. The size in bytes is filled for records migrated 
+    # from text sizes.
+    cursor.execute("""UPDATE file_information
+                    SET last_seen = :last_seen,
+                        size_bytes = COALESCE(size_bytes, :size_bytes),
+                        link_type = COALESCE(:link_type, link_type)
+                    WHERE patient_id = :patient_id
+                        AND file_name = :file_name
+                        AND first_hash = :first_hash""",
+                        {"last_seen": epoch,
+                        "size_bytes": size_bytes,
+                        "link_type": link_type,
+                        "patient_id": patient_id,
+                        "file_name": file_name,
+                        "first_hash": first_hash})
+    cursor.execute("""SELECT rowid FROM file_information
+                    WHERE patient_id = :patient_id
+                        AND file_name = :file_name
+                        AND first_hash = :first_hash""",
+                        {"patient_id": patient_id,
+                        "file_name": file_name,
+                        "first_hash": first_hash})
+    file_id = cursor.fetchone()[0]
+
+    # Record the sighting if the observation tables exist
+    cursor.execute("""SELECT COUNT(name) FROM sqlite_master 
+                    WHERE type = "table" AND name = "observations" """)
+    if cursor.fetchone()[0] == 1:
+        cursor.execute("""INSERT OR IGNORE INTO digests (sha256) 
+                        VALUES(:sha256)""", {"sha256": first_hash})
+        cursor.execute("""INSERT INTO observations VALUES(
+                        :run_id,
+                        :file_id,
+                        :size_bytes,
+                        (SELECT digest_id FROM digests WHERE sha256 = :sha256),
+                        :observed_at)""",
+                            {"run_id": run_id,
+                            "file_id": file_id,
+                            "size_bytes": size_bytes,
+                            "sha256": first_hash,
+                            "observed_at": epoch})
 
     # Commit cursor to database
     connection.commit()
@@ -473,39 +1892,142 @@ def record_file_info(database: str, ticket: str, patient_id: str,
     cursor.close()
     connection.close()
 
-def count_records(database: str, table: str, column: str, value: str):
+def process_entry(database: str, ticket: str, entry: FileEntry, 
+    current_date: str, hash256: str = None, run_id: int = None) -> tuple:
     """
-    Counts the amount of records per patient ID stored in a 
-    given database table.
+    This function compares the hash of a file with the one previously
+    recorded and records the file in the file_information table.
 
     Args:
         database (str): name of the database to connect to.
-        table (str): table name where to count the records.
-        column (str): column name where to count the records.
-        value (str): value to count in the records.
+        ticket (str): name of the package sent by the lab.
+        entry (FileEntry): file to process.
+        current_date (str): datetime of the file being processed.
+        hash256 (str): hash of the file if it was already created 
+            (e.g. by the I/O scheduler), otherwise it is created here.
+        run_id (int): unique integer used to identify the run.
 
     Returns:
-        Number of records in a database table per patient ID. 
+        Tuple (as abs_path, hash, size) of the processed file.
     """
 
-    # Connect to database and create a cursor
-    connection = sqlite3.connect(database)
-    cursor = connection.cursor()
-
-    # Select and count files per patient ID
-    cursor.execute(f"""SELECT COUNT({column}) 
-                    AS files_per_patient 
-                    FROM {table}
-                    WHERE {column} ='{value}'""")
-    
-    # Fetch the first value in the cursor
-    count = cursor.fetchone()[0]
-    
-    # Close cursor and connection
-    cursor.close()
-    connection.close()
+    size = format_size(entry.size)
+    if hash256 is None:
+        hash256 = create_sha256(entry.path)
+
+    # Compare hashes
+    compare_hash(
+        database= database,
+        patient_id= entry.patient_id,
+        file_name= entry.name,
+        current_date= current_date,
+        current_hash= hash256,
+        current_size= size,
+        current_location= entry.path)
+
+    # Record information into database
+    record_file_info(
+        database= database,
+        ticket= ticket,
+        patient_id= entry.patient_id,
+        file_name= entry.name,
+        extension= entry.extension,
+        file_size= size,
+        first_hash= hash256,
+        abs_path= entry.path,
+        file_type= entry.hts,
+        size_bytes= entry.size,
+        run_id= run_id,
+        link_type= entry.link_type)
+
+    return entry.path, hash256, size
+
+def record_integrity(database: str, patient_id: str, file_name: str,
+    file_location: str, check_type: str, result: str):
+    """
+    Records the result of the integrity check of a file, replacing the
+    result of a previous check of the same file.
 
-    return count
+    Args:
+        database (str): name of the database to connect to.
+        patient_id (str): unique string to identify the patient.
+        file_name (str): full file name.
+        file_location (str): absolute path of the file.
+        check_type (str): "eof" for the EOF block check or "scan" for
+            the streaming scan of the whole file.
+        result (str): "ok", "truncated", "unverified" or "unreadable".
+
+    Returns:
+        Information recorded into the "File integrity" table in the 
+        database.
+    """
+
+    try:
+        # Connect to database and create a cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Record information into database table
+        cursor.execute("""INSERT OR REPLACE INTO file_integrity VALUES(
+                        :patient_id,
+                        :file_name,
+                        :file_location,
+                        :check_type,
+                        :result,
+                        :date)""",
+                            {"patient_id": patient_id,
+                            "file_name": file_name,
+                            "file_location": file_location,
+                            "check_type": check_type,
+                            "result": result,
+                            "date": datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")})
+
+        # Commit cursor to database
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+def count_records(database: str, table: str, column: str, value: str):
+    """
+    Counts the amount of records per patient ID stored in a 
+    given database table.
+
+    Args:
+        database (str): name of the database to connect to.
+        table (str): table name where to count the records.
+        column (str): column name where to count the records.
+        value (str): value to count in the records.
+
+    Returns:
+        Number of records in a database table per patient ID. 
+    """
+
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Select and count files per patient ID
+    cursor.execute(f"""SELECT COUNT({column}) 
+                    AS files_per_patient 
+                    FROM {table}
+                    WHERE {column} ='{value}'""")
+    
+    # Fetch the first value in the cursor
+    count = cursor.fetchone()[0]
+    
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+    return count
 
 def check_essential_files(database: str, patient_id: str):
     """
@@ -531,116 +2053,528 @@ def check_essential_files(database: str, patient_id: str):
             [2]: 'SV.somatic', 
             [3]: 'SNV.somatic'.
     """
-    
+    
+    try:
+        # Connect to database and create a cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Instantiate empty counts list 
+        counts_list = []
+
+        # File patterns to search are in constants.py
+        for file_pattern in essential_files_patterns:
+            
+            # Select and count records starting with file_pattern
+            cursor.execute(f"""SELECT COUNT(patient_id)
+                AS essential_files
+                FROM file_information
+                WHERE file_name LIKE '{file_pattern}%' 
+                    AND patient_id = '{patient_id}'
+                """)
+            
+            # Fetch the first value in the cursor
+            essential_files_count = cursor.fetchone()[0]
+
+            # Append number to a list
+            counts_list.append(essential_files_count)
+
+            # Select and count records in missing_files that match the 
+            # file_pattern and patient_id.
+            cursor.execute(f"""SELECT COUNT(file_missing)
+                FROM missing_files
+                WHERE patient_id = "{patient_id}" 
+                    AND file_missing = "{file_pattern}"
+                """)
+            
+            # Fetch the first value in the cursor
+            files_registered_missing_count = cursor.fetchone()[0]
+
+            # If there are no essential files for the pattern (fetched count == 0), 
+            # then record the missing file into a table in the database
+            if essential_files_count == 0 and files_registered_missing_count == 0:
+                
+                # Insert or ignore the registry of the missing file
+                cursor.execute("""INSERT OR IGNORE INTO missing_files (
+                    patient_id, file_missing, first_date_missing, 
+                    last_date_missing, date_added, first_missing_epoch,
+                    last_missing_epoch, added_epoch) VALUES(
+                    :patient_id,
+                    :file_missing,
+                    :first_date_missing,
+                    :last_date_missing,
+                    :date_added,
+                    :first_missing_epoch,
+                    :last_missing_epoch,
+                    :added_epoch)""",
+                        {"patient_id": patient_id,
+                        "file_missing": file_pattern,
+                        "first_date_missing": datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S"),
+                        "last_date_missing": datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S"),
+                        "date_added": "",
+                        "first_missing_epoch": int(datetime.datetime.today().timestamp()),
+                        "last_missing_epoch": int(datetime.datetime.today().timestamp()),
+                        "added_epoch": None})
+                
+                # Commit cursor to database
+                connection.commit()
+
+            # If there are no essential files for the pattern (fetched count == 0)
+            # but it that has been previously registered (registered missing > 0), 
+            # then update the last_date_missing column to today
+            elif essential_files_count == 0 and files_registered_missing_count > 0:
+                
+                # Update last_date_missing if the file is still missing today
+                cursor.execute(f"""UPDATE missing_files 
+                    SET last_date_missing = "{datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")}",
+                        last_missing_epoch = {int(datetime.datetime.today().timestamp())}
+                    WHERE patient_id = "{patient_id}" AND file_missing = "{file_pattern}"
+                    """)
+                
+                # Commit cursor to database
+                connection.commit()
+
+            # If there are essential files for the pattern (fetched count > 0)
+            # but it was previously registered as missing (registered missing > 0), 
+            # then update the date_added column to today
+            elif essential_files_count > 0 and files_registered_missing_count > 0:
+                
+                # Select date_added from file_pattern and patient_id
+                cursor.execute(f"""SELECT date_added
+                    FROM missing_files
+                    WHERE patient_id = "{patient_id}" AND file_missing = "{file_pattern}"
+                    """)
+
+                # Fetch the first value in the cursor
+                file_added = cursor.fetchone()[0]    
+
+                # If the date_added info is missing, update it to today
+                if file_added == "":
+                    
+                    # Update date_added to today
+                    cursor.execute(f"""UPDATE missing_files 
+                        SET date_added = "{datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")}",
+                            added_epoch = {int(datetime.datetime.today().timestamp())}
+                        WHERE patient_id = "{patient_id}" AND file_missing = "{file_pattern}"
+                        """)
+
+                    # Commit cursor to database
+                    connection.commit()
+    
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+    
+    # Finalize function
+    finally:
+
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return counts_list
+
+######################################################################
+### Run tracking functions
+######################################################################
+
+def start_run(database: str, ticket: str, input_path: str,
+    start_date: str, start_string: str) -> int:
+    """
+    This function registers a new extraction run in the runs table.
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): name of the package sent by the lab.
+        input_path (str): path given to the "extract" command.
+        start_date (str): datetime of the run in human-readable format.
+        start_string (str): datetime of the run used in the report name.
+
+    Returns:
+        Unique integer used to identify the run.
+    """
+
+    run_id = None
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Register the run as running until finish_run is called
+        cursor.execute("""INSERT INTO runs (ticket, input_path, 
+                start_date, start_string, end_date, status) VALUES(
+                :ticket,
+                :input_path,
+                :start_date,
+                :start_string,
+                :end_date,
+                :status)""",
+                    {"ticket": ticket,
+                    "input_path": input_path,
+                    "start_date": start_date,
+                    "start_string": start_string,
+                    "end_date": "",
+                    "status": "running"})
+
+        # Retrieve the identifier given by the database
+        run_id = cursor.lastrowid
+
+        # Commit cursor to database
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return run_id
+
+def find_resumable_run(database: str, ticket: str) -> tuple:
+    """
+    This function finds the last run of a ticket that was interrupted
+    before it finished.
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): name of the package sent by the lab.
+
+    Returns:
+        Tuple (as run_id, start_date, start_string) of the interrupted 
+        run or None if there is no run to resume.
+    """
+
+    run = None
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Select the last run of the ticket that did not finish
+        cursor.execute("""SELECT run_id,start_date,start_string
+            FROM runs
+            WHERE ticket = :ticket
+                AND status = "running"
+            ORDER BY run_id DESC
+            LIMIT 1""", {"ticket": ticket})
+
+        # Fetch the first record in the cursor
+        run = cursor.fetchone()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return run
+
+def finish_run(database: str, run_id: int, end_date: str):
+    """
+    This function marks a run as completed so it is not resumed again.
+
+    Args:
+        database (str): name of the database to connect to.
+        run_id (int): unique integer used to identify the run.
+        end_date (str): datetime when the run finished.
+
+    Returns:
+        Updated run record in the runs table.
+    """
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""UPDATE runs
+            SET status = "completed", end_date = :end_date
+            WHERE run_id = :run_id""",
+                {"run_id": run_id, "end_date": end_date})
+
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to update data in table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+def record_checkpoint(database: str, run_id: int, patient_id: str,
+    file_location: str, file_hash: str, file_size: str):
+    """
+    This function records that a file was completely processed in 
+    a run. It must be called after the file information was recorded,
+    so a resumed run can safely skip the file.
+
+    Args:
+        database (str): name of the database to connect to.
+        run_id (int): unique integer used to identify the run.
+        patient_id (str): unique string to identify the patient.
+        file_location (str): absolute path of the file.
+        file_hash (str): hash of the file.
+        file_size (str): file size.
+
+    Returns:
+        Checkpoint recorded in the run_checkpoints table.
+    """
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""INSERT OR IGNORE INTO run_checkpoints VALUES(
+                :run_id,
+                :patient_id,
+                :file_location,
+                :hash,
+                :file_size,
+                :date)""",
+                    {"run_id": run_id,
+                    "patient_id": patient_id,
+                    "file_location": file_location,
+                    "hash": file_hash,
+                    "file_size": file_size,
+                    "date": datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")})
+
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+def list_checkpoints(database: str, run_id: int, patient_id: str) -> set:
+    """
+    This function lists the files of a patient that were already 
+    completed in a run.
+
+    Args:
+        database (str): name of the database to connect to.
+        run_id (int): unique integer used to identify the run.
+        patient_id (str): unique string to identify the patient.
+
+    Returns:
+        Set of absolute paths of the completed files.
+    """
+
+    completed_files = set()
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""SELECT file_location
+            FROM run_checkpoints
+            WHERE run_id = :run_id
+                AND patient_id = :patient_id""",
+                {"run_id": run_id, "patient_id": patient_id})
+
+        # Iterate the cursor instead of fetching all the records
+        for record in cursor:
+            completed_files.add(record[0])
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return completed_files
+
+def list_run_hashes(database: str, run_id: int) -> dict:
+    """
+    This function lists the hashes of the files completed in a run.
+
+    Args:
+        database (str): name of the database to connect to.
+        run_id (int): unique integer used to identify the run.
+
+    Returns:
+        Dictionary of absolute file paths and their hashes.
+    """
+
+    run_hashes = {}
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""SELECT file_location,hash
+            FROM run_checkpoints
+            WHERE run_id = :run_id""", {"run_id": run_id})
+
+        # Iterate the cursor instead of fetching all the records
+        for file_location, file_hash in cursor:
+            run_hashes[file_location] = file_hash
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return run_hashes
+
+def get_run_patient(database: str, run_id: int, patient_id: str) -> tuple:
+    """
+    This function retrieves the progress of a patient in a run.
+
+    Args:
+        database (str): name of the database to connect to.
+        run_id (int): unique integer used to identify the run.
+        patient_id (str): unique string to identify the patient.
+
+    Returns:
+        Tuple (as past_records, summary, completed) or None if the 
+        patient was not started in the run.
+    """
+
+    run_patient = None
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""SELECT past_records,summary,completed
+            FROM run_patients
+            WHERE run_id = :run_id
+                AND patient_id = :patient_id""",
+                {"run_id": run_id, "patient_id": patient_id})
+
+        run_patient = cursor.fetchone()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return run_patient
+
+def start_run_patient(database: str, run_id: int, patient_id: str,
+    past_records: int):
+    """
+    This function registers that a patient started being processed
+    in a run. The number of past records is only stored the first time,
+    so a resumed run reports the same counts as an uninterrupted one.
+
+    Args:
+        database (str): name of the database to connect to.
+        run_id (int): unique integer used to identify the run.
+        patient_id (str): unique string to identify the patient.
+        past_records (int): number of records of the patient in the 
+            database before the run.
+
+    Returns:
+        Patient recorded in the run_patients table.
+    """
+
     try:
-        # Connect to database and create a cursor
-        connection = sqlite3.connect(database)
+        # Connect to database and create cursor
+        connection = connect_database(database)
         cursor = connection.cursor()
 
-        # Instantiate empty counts list 
-        counts_list = []
+        cursor.execute("""INSERT OR IGNORE INTO run_patients VALUES(
+                :run_id,
+                :patient_id,
+                :past_records,
+                :summary,
+                :completed)""",
+                    {"run_id": run_id,
+                    "patient_id": patient_id,
+                    "past_records": past_records,
+                    "summary": "",
+                    "completed": 0})
 
-        # File patterns to search are in constants.py
-        for file_pattern in essential_files_patterns:
-            
-            # Select and count records starting with file_pattern
-            cursor.execute(f"""SELECT COUNT(patient_id)
-                AS essential_files
-                FROM file_information
-                WHERE file_name LIKE '{file_pattern}%' 
-                    AND patient_id = '{patient_id}'
-                """)
-            
-            # Fetch the first value in the cursor
-            essential_files_count = cursor.fetchone()[0]
+        connection.commit()
 
-            # Append number to a list
-            counts_list.append(essential_files_count)
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
 
-            # Select and count records in missing_files that match the 
-            # file_pattern and patient_id.
-            cursor.execute(f"""SELECT COUNT(file_missing)
-                FROM missing_files
-                WHERE patient_id = "{patient_id}" 
-                    AND file_missing = "{file_pattern}"
-                """)
-            
-            # Fetch the first value in the cursor
-            files_registered_missing_count = cursor.fetchone()[0]
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
 
-            # If there are no essential files for the pattern (fetched count == 0), 
-            # then record the missing file into a table in the database
-            if essential_files_count == 0 and files_registered_missing_count == 0:
-                
-                # Insert or ignore the registry of the missing file
-                cursor.execute("""INSERT OR IGNORE INTO missing_files VALUES(
-                    :patient_id,
-                    :file_missing,
-                    :first_date_missing,
-                    :last_date_missing,
-                    :date_added)""",
-                        {"patient_id": patient_id,
-                        "file_missing": file_pattern,
-                        "first_date_missing": datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S"),
-                        "last_date_missing": datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S"),
-                        "date_added": ""})
-                
-                # Commit cursor to database
-                connection.commit()
+def complete_run_patient(database: str, run_id: int, patient_id: str,
+    summary: str):
+    """
+    This function stores the summary of a patient and marks the 
+    patient as completed in a run.
 
-            # If there are no essential files for the pattern (fetched count == 0)
-            # but it that has been previously registered (registered missing > 0), 
-            # then update the last_date_missing column to today
-            elif essential_files_count == 0 and files_registered_missing_count > 0:
-                
-                # Update last_date_missing if the file is still missing today
-                cursor.execute(f"""UPDATE missing_files 
-                    SET last_date_missing = "{datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")}"
-                    WHERE patient_id = "{patient_id}" AND file_missing = "{file_pattern}"
-                    """)
-                
-                # Commit cursor to database
-                connection.commit()
+    Args:
+        database (str): name of the database to connect to.
+        run_id (int): unique integer used to identify the run.
+        patient_id (str): unique string to identify the patient.
+        summary (str): patient summary created by create_patient_summary.
 
-            # If there are essential files for the pattern (fetched count > 0)
-            # but it was previously registered as missing (registered missing > 0), 
-            # then update the date_added column to today
-            elif essential_files_count > 0 and files_registered_missing_count > 0:
-                
-                # Select date_added from file_pattern and patient_id
-                cursor.execute(f"""SELECT date_added
-                    FROM missing_files
-                    WHERE patient_id = "{patient_id}" AND file_missing = "{file_pattern}"
-                    """)
+    Returns:
+        Updated patient record in the run_patients table.
+    """
 
-                # Fetch the first value in the cursor
-                file_added = cursor.fetchone()[0]    
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
 
-                # If the date_added info is missing, update it to today
-                if file_added == "":
-                    
-                    # Update date_added to today
-                    cursor.execute(f"""UPDATE missing_files 
-                        SET date_added = "{datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")}"
-                        WHERE patient_id = "{patient_id}" AND file_missing = "{file_pattern}"
-                        """)
+        cursor.execute("""UPDATE run_patients
+            SET summary = :summary, completed = 1
+            WHERE run_id = :run_id
+                AND patient_id = :patient_id""",
+                {"run_id": run_id,
+                "patient_id": patient_id,
+                "summary": summary})
+
+        connection.commit()
 
-                    # Commit cursor to database
-                    connection.commit()
-    
     # Print error if encountered
     except sqlite3.Error as error:
-        print("Failed to read data from table,", error)
-    
+        print("Failed to update data in table,", error)
+
     # Finalize function
     finally:
-
         # Close cursor and connection
         cursor.close()
         connection.close()
 
-        return counts_list
-
 ######################################################################
 ### Quality control & Stats functions
 ######################################################################
@@ -665,7 +2599,7 @@ def list_patients_missing_files(database: str) -> list:
     
     try:
         # Connect to database and create cursor
-        connection = sqlite3.connect(database)
+        connection = connect_database(database)
         cursor = connection.cursor()
 
         # Select patient_ids and fetch all distinct records
@@ -690,7 +2624,7 @@ def list_patients_missing_files(database: str) -> list:
         connection.close()
 
         # Return list of patients missing files
-        return patients_missing_files_list
+    return patients_missing_files_list
 
 def compare_hash(database: str, patient_id: str, file_name: str,
     current_date: str, current_hash: str, current_size: str,
@@ -715,7 +2649,7 @@ def compare_hash(database: str, patient_id: str, file_name: str,
     
     try:
         # Connect to database and create cursor
-        connection = sqlite3.connect(database)
+        connection = connect_database(database)
         cursor = connection.cursor()
 
         # Select hash for a patient_id and file_name
@@ -745,7 +2679,8 @@ def compare_hash(database: str, patient_id: str, file_name: str,
         elif current_hash != recorded_hash:
 
             # Select first data recorded in database
-            cursor.execute(f"""SELECT date,first_hash,file_size,file_location
+            cursor.execute(f"""SELECT date,first_hash,file_size,file_location,
+                    first_seen,directory_id
                 FROM file_information
                 WHERE patient_id = "{patient_id}"
                     AND file_name = "{file_name}"
@@ -763,15 +2698,27 @@ def compare_hash(database: str, patient_id: str, file_name: str,
                     first_hash = my_tuple[1]
                     first_size = my_tuple[2]
                     first_location = my_tuple[3]
+                    first_epoch = my_tuple[4]
+                    first_directory_id = my_tuple[5]
             
                 # Define current data
                 last_date = current_date
                 last_hash = current_hash
                 last_size = current_size
-                last_location = current_location
+                last_epoch = date_to_epoch(current_date)
+
+                # Reference the directory of the current file, the path 
+                # is kept only if it can not be rebuilt from the file name
+                directory, name = split_location(current_location)
+                last_directory_id = get_directory_id(cursor, directory)
+                last_location = None if name == file_name else current_location
 
                 # Record file info into unmatching_hash table
-                cursor.execute("""INSERT OR IGNORE INTO unmatching_hash VALUES(
+                cursor.execute("""INSERT OR IGNORE INTO unmatching_hash (
+                    patient_id, file_name, first_hash, last_hash, 
+                    first_date, last_date, first_size, last_size, 
+                    first_location, last_location, first_epoch, 
+                    last_epoch, first_directory_id, last_directory_id) VALUES(
                     :patient_id,
                     :file_name,
                     :first_hash,
@@ -781,7 +2728,11 @@ def compare_hash(database: str, patient_id: str, file_name: str,
                     :first_size,
                     :last_size,
                     :first_location,
-                    :last_location)""",{
+                    :last_location,
+                    :first_epoch,
+                    :last_epoch,
+                    :first_directory_id,
+                    :last_directory_id)""",{
                         "patient_id": patient_id,
                         "file_name": file_name,
                         "first_hash": first_hash,
@@ -791,7 +2742,11 @@ def compare_hash(database: str, patient_id: str, file_name: str,
                         "first_size": first_size,
                         "last_size": last_size,
                         "first_location": first_location,
-                        "last_location": last_location})
+                        "last_location": last_location,
+                        "first_epoch": first_epoch,
+                        "last_epoch": last_epoch,
+                        "first_directory_id": first_directory_id,
+                        "last_directory_id": last_directory_id})
         
             # Commit cursor to database
             connection.commit()
@@ -821,7 +2776,7 @@ def list_unmatching_hashes(database: str) -> list:
 
     try:
         # Connect to database and create cursor
-        connection = sqlite3.connect(database)
+        connection = connect_database(database)
         cursor = connection.cursor()
 
         # Select hash for a patient_id and file_name
@@ -865,7 +2820,7 @@ def list_empty_files(database: str) -> list:
 
     try:
         # Connect to database and create cursor
-        connection = sqlite3.connect(database)
+        connection = connect_database(database)
         cursor = connection.cursor()
 
         # Select hash, size, patient_id and file_name
@@ -890,7 +2845,190 @@ def list_empty_files(database: str) -> list:
         connection.close()
 
         # Return empty files list
-        return empty_files_list
+    return empty_files_list
+
+def list_truncated_files(database: str) -> list:
+    """
+    This function lists the compressed files that failed the 
+    integrity check.
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        List of tuples (as patient_id, file_name) of files that 
+        are truncated.
+    """
+
+    truncated_files_list = []
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Select patient_id and file_name of truncated files
+        cursor.execute("""SELECT patient_id,file_name
+            FROM file_integrity
+            WHERE result = "truncated"
+            """)
+
+        # Fetch complete list of records in the cursor
+        truncated_files_list = cursor.fetchall()
+
+    # Print error if encountered  
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+    
+    # Finalize function
+    finally:
+
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+        # Return truncated files list
+    return truncated_files_list
+
+def list_changed_files(database: str, ticket: str, start_epoch: int,
+    end_epoch: int) -> list:
+    """
+    This function lists the files of a ticket that were first seen 
+    with a given content between two dates, using the index on 
+    (ticket, first_seen). A file is "changed" if the same patient and
+    file name was seen before with a different hash, otherwise "new".
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): name of the package sent by the lab.
+        start_epoch (int): start of the range in seconds since epoch.
+        end_epoch (int): end of the range in seconds since epoch.
+
+    Returns:
+        List of tuples (as patient_id, file_name, hash, first_seen, 
+        change) ordered by first_seen.
+    """
+
+    changed_files_list = []
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute("""SELECT patient_id, file_name, first_hash, first_seen,
+                CASE WHEN EXISTS (SELECT 1 FROM file_information AS previous
+                    WHERE previous.patient_id = current.patient_id
+                        AND previous.file_name = current.file_name
+                        AND previous.first_seen < current.first_seen)
+                THEN "changed" ELSE "new" END
+            FROM file_information AS current
+            WHERE ticket = :ticket
+                AND first_seen BETWEEN :start_epoch AND :end_epoch
+            ORDER BY first_seen""",
+                {"ticket": ticket,
+                "start_epoch": start_epoch,
+                "end_epoch": end_epoch})
+
+        changed_files_list = cursor.fetchall()
+
+    # Print error if encountered  
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+    
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return changed_files_list
+
+def format_changed_files(changed_files: list, output_format: str) -> str:
+    """
+    This function formats the files returned by list_changed_files.
+
+    Args:
+        changed_files (list): list of tuples (as patient_id, file_name,
+            hash, first_seen, change).
+        output_format (str): "table", "tsv" or "jsonl".
+
+    Returns:
+        Formatted string with one line per file.
+    """
+
+    columns = ["patient_id", "file_name", "hash", "first_seen", "change"]
+    records = [dict(zip(columns, changed_file)) for changed_file in changed_files]
+    for record in records:
+        record["first_seen"] = epoch_to_iso(record["first_seen"])
+
+    if output_format == "jsonl":
+        return "\n".join(json.dumps(record) for record in records)
+
+    rows = [columns] + [["" if record[column] is None else str(record[column])
+        for column in columns] for record in records]
+    if output_format == "tsv":
+        return "\n".join("\t".join(row) for row in rows)
+
+    # Align the table columns
+    widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+    return "\n".join("  ".join(value.ljust(width)
+        for value, width in zip(row, widths)).rstrip() for row in rows)
+
+def list_aggregates(database: str, ticket: str = None, 
+    group_by: list = None) -> list:
+    """
+    This function reads the file counts and total bytes from the 
+    aggregates table, without scanning the file_information table.
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): only aggregates of this ticket.
+        group_by (list): columns to group by, any of "ticket", 
+            "patient_id", "hts" and "status". By default all of them.
+
+    Returns:
+        List of tuples (as group_by columns..., file_count, total_bytes,
+        last_update).
+    """
+
+    if not group_by:
+        group_by = ["ticket", "patient_id", "hts", "status"]
+
+    # Only allow the columns of the aggregates table
+    for column in group_by:
+        if column not in ("ticket", "patient_id", "hts", "status"):
+            raise ValueError(f"Can not group by {column}")
+
+    aggregates_list = []
+    columns = ",".join(group_by)
+    where = "WHERE ticket = :ticket" if ticket is not None else ""
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        cursor.execute(f"""SELECT {columns}, SUM(file_count), 
+                SUM(total_bytes), MAX(last_update)
+            FROM ticket_aggregates
+            {where}
+            GROUP BY {columns}
+            ORDER BY {columns}""", {"ticket": ticket})
+
+        aggregates_list = cursor.fetchall()
+
+    # Print error if encountered  
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+    
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return aggregates_list
 
 def list_missing_files(database: str, directory: str,
     file_list: list) -> list:
@@ -900,6 +3038,9 @@ def list_missing_files(database: str, directory: str,
 
     Args:
         database (str): name of the database to connect to.
+        directory (str): name of the patient directory.
+        file_list (list): file names in the directory, a set is 
+            faster for directories with many files.
 
     Returns:
         List of tuples (as patient_id, file_name) of files that 
@@ -909,7 +3050,7 @@ def list_missing_files(database: str, directory: str,
 
     try:
         # Connect to database and create cursor
-        connection = sqlite3.connect(database)
+        connection = connect_database(database)
         cursor = connection.cursor()
 
         # Select file name
@@ -945,7 +3086,8 @@ def list_missing_files(database: str, directory: str,
         connection.close()  
     
 def define_status(database: str, unmatch_hash_list: list, 
-    empty_files_list: list, missing_files_list: list):
+    empty_files_list: list, missing_files_list: list,
+    truncated_files_list: list = None, sample_mismatch_list: list = None):
     """
     This function returns the status of the file to identify if there
     are issues to be fixed.
@@ -957,6 +3099,10 @@ def define_status(database: str, unmatch_hash_list: list,
             recorded hash. It could mean that the contents of the file 
             where changed since the file was recorded in the database, 
         - empty_file: the file is empty.
+        - truncated: the compressed file is incomplete (e.g. missing 
+            the BGZF EOF block).
+        - sample_mismatch: the sample names in the header of the file
+            do not match the patient directory.
         - missing_file: when a file once recorded in the database is no
             longer in the directory.
 
@@ -968,14 +3114,26 @@ def define_status(database: str, unmatch_hash_list: list,
             hash and file size.
         missing_files_list (list): list of files once recorded in the 
             database that are no longer in the directory. 
+        truncated_files_list (list): list of compressed files that 
+            failed the integrity check.
+        sample_mismatch_list (list): list of tuples (as patient_id, 
+            file_name, samples) of files whose sample names do not 
+            match the patient.
 
     Return:
         Record file status in the file_information table.
     """
+
+    if truncated_files_list is None:
+        truncated_files_list = []
+
+    # Files are compared by patient_id and file_name
+    sample_mismatches = {(my_tuple[0], my_tuple[1]) 
+        for my_tuple in sample_mismatch_list or []}
     
     try:
         # Connect to database and create cursor
-        connection = sqlite3.connect(database)
+        connection = connect_database(database)
         cursor = connection.cursor()
 
         # Select all patients and their files names
@@ -1008,6 +3166,26 @@ def define_status(database: str, unmatch_hash_list: list,
                         AND file_name = "{record[1]}" """)
                 connection.commit()
 
+            # Compare each record in records with the truncated 
+            # files list
+            elif record in truncated_files_list:
+                status = "truncated"
+                cursor.execute(f"""UPDATE file_information
+                    SET status = "{status}"
+                    WHERE patient_id = "{record[0]}"
+                        AND file_name = "{record[1]}" """)
+                connection.commit()
+
+            # Compare each record in records with the files whose
+            # samples do not match the patient
+            elif record in sample_mismatches:
+                status = "sample_mismatch"
+                cursor.execute(f"""UPDATE file_information
+                    SET status = "{status}"
+                    WHERE patient_id = "{record[0]}"
+                        AND file_name = "{record[1]}" """)
+                connection.commit()
+
             # Compare each record in records with the missing 
             # files list
             elif record in missing_files_list:
@@ -1037,6 +3215,209 @@ def define_status(database: str, unmatch_hash_list: list,
         cursor.close()
         connection.close()
 
+######################################################################
+### Query functions
+######################################################################
+
+# Columns returned by query_file_information
+query_columns = [
+    "file_id",
+    "ticket",
+    "patient_id",
+    "file_name",
+    "hts",
+    "status",
+    "size_bytes",
+    "first_hash",
+    "first_seen",
+    "last_seen",
+    "file_location"]
+
+def query_file_information(database: str, ticket: str = None, 
+    patient_id: str = None, status: str = None, hts: str = None,
+    min_size: int = None, max_size: int = None, since: int = None,
+    until: int = None, name_glob: str = None, under: str = None,
+    after_id: int = 0, limit: int = None, page_size: int = 1000,
+    archives: list = None):
+    """
+    This function streams the records of the file_information table
+    that match the filters given, in pages of page_size records. 
+    Pages are read with keyset pagination (file_id > last file_id 
+    read), so memory use does not depend on the number of records and
+    a query can be continued from any file_id with after_id.
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): name of the package sent by the lab.
+        patient_id (str): unique string to identify the patient.
+        status (str): status of the file.
+        hts (str): file category (e.g. "vcf" or "cram").
+        min_size (int): minimum file size in bytes.
+        max_size (int): maximum file size in bytes.
+        since (int): first seen on or after, in seconds since epoch.
+        until (int): first seen on or before, in seconds since epoch.
+        name_glob (str): glob pattern of the file name (e.g. "*.cram").
+        under (str): path of a directory, return only the files below
+            it (e.g. a ticket or sample directory).
+        after_id (int): return only records after this file_id.
+        limit (int): maximum number of records to return.
+        page_size (int): number of records read per query.
+        archives (list): paths of archive databases to read after the
+            database, attached to the same connection. Records then
+            have a "database" key and after_id only applies to the
+            database.
+
+    Returns:
+        Generator of lists of dictionaries, one list per page, with the
+        keys in query_columns.
+    """
+
+    # Build the conditions of the filters given
+    filters = {
+        "ticket = :ticket": ticket,
+        "patient_id = :patient_id": patient_id,
+        "status = :status": status,
+        "hts = :hts": hts,
+        "size_bytes >= :min_size": min_size,
+        "size_bytes <= :max_size": max_size,
+        "first_seen >= :since": since,
+        "first_seen <= :until": until,
+        "file_name GLOB :name_glob": name_glob,
+        f"directory_id IN ({subtree_query})": under}
+    conditions = [condition for condition, value in filters.items() 
+        if value is not None]
+    conditions.append("rowid > :after_id")
+
+    parameters = {
+        "ticket": ticket,
+        "patient_id": patient_id,
+        "status": status,
+        "hts": hts,
+        "min_size": min_size,
+        "max_size": max_size,
+        "since": since,
+        "until": until,
+        "name_glob": name_glob,
+        "directory_id": None,
+        "after_id": after_id}
+
+    statement = """SELECT rowid,ticket,patient_id,file_name,hts,status,
+            size_bytes,first_hash,first_seen,last_seen,
+            COALESCE(file_location, file_path(directory_id, file_name))
+        FROM {schema}.file_information
+        WHERE {conditions}
+        ORDER BY rowid
+        LIMIT :page_size"""
+
+    returned = 0
+
+    # Connect to database and create cursor
+    connection = connect_database(database)
+    register_path_function(connection)
+    cursor = connection.cursor()
+
+    try:
+        # Find the directory to list the files below
+        if under is not None:
+            parameters["directory_id"] = get_directory_id(cursor, 
+                os.path.abspath(under), create=False)
+            if parameters["directory_id"] is None:
+                return
+
+        # Attach the archives, directories are shared with the database
+        schemas = {"main": None}
+        for index, archive in enumerate(archives or []):
+            cursor.execute("ATTACH DATABASE ? AS ?", (archive, f"archive_{index}"))
+            schemas[f"archive_{index}"] = os.path.basename(archive)
+
+        for schema, database_name in schemas.items():
+            schema_statement = statement.format(schema=schema,
+                conditions=" AND ".join(conditions))
+            if schema != "main":
+                parameters["after_id"] = 0
+
+            while limit is None or returned < limit:
+                parameters["page_size"] = page_size if limit is None \
+                    else min(page_size, limit - returned)
+
+                # Iterate the cursor instead of fetching all the records
+                page = [dict(zip(query_columns, record)) 
+                    for record in cursor.execute(schema_statement, parameters)]
+                if page == []:
+                    break
+
+                # Continue after the last record of the page
+                parameters["after_id"] = page[-1]["file_id"]
+                returned += len(page)
+
+                # Tell which database the records were read from
+                if archives:
+                    for record in page:
+                        record["database"] = database_name or database
+
+                yield page
+
+    # Print error if encountered  
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+def format_query_page(page: list, output_format: str, 
+    header: bool = False) -> str:
+    """
+    This function formats a page of records returned by 
+    query_file_information.
+
+    Args:
+        page (list): list of dictionaries with the keys in query_columns.
+        output_format (str): "table", "tsv" or "jsonl".
+        header (bool): include the column names ("table" and "tsv").
+
+    Returns:
+        Formatted string with one line per record.
+    """
+
+    # Records read with the archives have a "database" column
+    columns = query_columns + [column for column in page[0] 
+        if column not in query_columns] if page else query_columns
+
+    # Convert timestamps to ISO-8601 dates
+    records = []
+    for record in page:
+        record = dict(record)
+        record["first_seen"] = epoch_to_iso(record["first_seen"])
+        record["last_seen"] = epoch_to_iso(record["last_seen"])
+        records.append(record)
+
+    if output_format == "jsonl":
+        return "\n".join(json.dumps(record) for record in records)
+
+    lines = []
+    if output_format == "tsv":
+        if header:
+            lines.append("\t".join(columns))
+        for record in records:
+            lines.append("\t".join("" if record[column] is None 
+                else str(record[column]) for column in columns))
+        return "\n".join(lines)
+
+    # Align the table columns to the widest value of the page
+    rows = [["" if record[column] is None else str(record[column]) 
+        for column in columns] for record in records]
+    if header:
+        rows.insert(0, columns)
+    widths = [max(len(row[index]) for row in rows) 
+        for index in range(len(columns))]
+    for row in rows:
+        lines.append("  ".join(value.ljust(width) 
+            for value, width in zip(row, widths)).rstrip())
+    return "\n".join(lines)
+
 ######################################################################
 ### Report creation functions
 ######################################################################
@@ -1089,7 +3470,9 @@ Essential files:
 def create_report_summary(ticket: str, today_readable: str, 
     patients_processed: int, essential_files_missing_list: list, 
     empty_files_list: list, unmatching_hash_list: list,
-    missing_files_list: list) -> str: 
+    missing_files_list: list, truncated_files_list: list = None,
+    throttle_summary: str = None, fastq_mismatch_list: list = None,
+    sample_mismatch_list: list = None) -> str: 
     """
     This function creates the summary of the report of directory
     being processed. 
@@ -1110,6 +3493,18 @@ def create_report_summary(ticket: str, today_readable: str,
         missing_files_list (list): list of tuples (as patient_id, 
             file_name) of files that were previously recorded in the 
             database but are now missing in the directory being processed.
+        truncated_files_list (list): list of tuples (as patient_id, 
+            file_name) of compressed files that failed the integrity check.
+        throttle_summary (str): lines describing the bandwidth and
+            priority limits of the run and their effect, None if the
+            run was not throttled.
+        fastq_mismatch_list (list): list of tuples (as patient_id, 
+            file_name, reads, mate_reads) of FASTQ files with a number 
+            of reads different from their mate, None if the reads were
+            not counted.
+        sample_mismatch_list (list): list of tuples (as patient_id, 
+            file_name, samples) of files whose sample names do not match
+            the patient, None if the samples were not checked.
     
     Returns:
         Formatted string with the summarized information per patient 
@@ -1144,6 +3539,16 @@ Patients missing essential files:"""
         for my_tuple in empty_files_list:
             empty_files += "\n" + f"   - {my_tuple[0]}: {my_tuple[1]}"
     
+    string_truncated = "\nTruncated compressed files:"
+
+    if not truncated_files_list:
+        truncated_files = "\n   - None"
+    # For each tuple in the list, print "patient_id: file_name"
+    else:
+        truncated_files = ""
+        for my_tuple in truncated_files_list:
+            truncated_files += "\n" + f"   - {my_tuple[0]}: {my_tuple[1]}"
+
     string_3 = "\nFiles with unmatching hashes:"
 
     if unmatching_hash_list == []:
@@ -1166,11 +3571,35 @@ Patients missing essential files:"""
     
     string_5 = "\n----------------------------------------------------------------------"
 
-    report_summary = "{} {}\n {} {}\n {} {}\n {} {}\n {}".format(
+    # Add the files whose samples do not match their patient
+    if sample_mismatch_list is not None:
+        sample_mismatches = "\n   - None"
+        if sample_mismatch_list != []:
+            sample_mismatches = "".join(
+                f"\n   - {my_tuple[0]}: {my_tuple[1]} (samples: {my_tuple[2]})"
+                for my_tuple in sample_mismatch_list)
+        string_5 = f"\n Files with samples not matching the patient:{sample_mismatches}" + string_5
+
+    # Add the FASTQ files whose mate has a different number of reads
+    if fastq_mismatch_list is not None:
+        fastq_mismatches = "\n   - None"
+        if fastq_mismatch_list != []:
+            fastq_mismatches = "".join(
+                f"\n   - {my_tuple[0]}: {my_tuple[1]} ({my_tuple[2]} reads, "
+                f"mate {my_tuple[3]} reads)" for my_tuple in fastq_mismatch_list)
+        string_5 = f"\n FASTQ files with a different number of reads than their mate:{fastq_mismatches}" + string_5
+
+    # Add the effect of the throttling options if the run was throttled
+    if throttle_summary:
+        string_5 = f"\n Throttling:\n{throttle_summary}" + string_5
+
+    report_summary = "{} {}\n {} {}\n {} {}\n {} {}\n {} {}\n {}".format(
         string_1,
         essential_files_missing,
         string_2, 
         empty_files,
+        string_truncated,
+        truncated_files,
         string_3,
         unmatching_hash,
         string_4,
@@ -1219,7 +3648,8 @@ def update_record_status(database, patient_id, file_name, status):
         patient_id (str): unique string to identify the patient.
         file_name (str): full file name.
         status (str): status of the file in relation to the study.
-            Options: "pass", "hash_unmatch", "empty_file", "missing_file".
+            Options: "pass", "hash_unmatch", "empty_file", "truncated", 
+            "sample_mismatch", "missing_file".
 
     Returns:
         Changed status in record given.
@@ -1227,7 +3657,7 @@ def update_record_status(database, patient_id, file_name, status):
 
     try:
         # Connect to database and create cursor
-        connection = sqlite3.connect(database)
+        connection = connect_database(database)
         cursor = connection.cursor()
 
         cursor.execute(f"""UPDATE file_information
@@ -0,0 +1,531 @@
+import bz2
+import datetime
+import gzip
+import json
+import lzma
+import os
+import re
+import sqlite3
+import struct
+
+from aacini.utils.analyzers import Analyzer
+from aacini.utils.analyzers import analyze_files
+from aacini.utils.analyzers import create_analysis_cache_table
+from aacini.utils.analyzers import register_analyzer
+from aacini.utils.catalog import connect_database
+
+######################################################################
+### Header metadata functions
+######################################################################
+
+# Reference builds by the length of chromosome 1
+chr1_lengths = {248956422: "GRCh38", 249250621: "GRCh37"}
+
+# Reference builds by the names found in headers
+build_patterns = [
+    ("GRCh38", re.compile(r"GRCh38|hg38|GCA_000001405\.15")),
+    ("GRCh37", re.compile(r"GRCh37|hg19|hs37d5|\bb37\b"))]
+
+# Length of chromosome 1 in VCF (##contig) and SAM (@SQ) headers
+chr1_pattern = re.compile(
+    r"(?:ID=|SN:)(?:chr)?1[,\t][^\n]*?(?:length=|LN:)(\d+)")
+
+# Sample names that do not identify a sample
+generic_sample_names = {"", "tumor", "normal", "tumour", "sample", "unknown",
+    "none"}
+
+def infer_reference_build(header: str) -> str:
+    """
+    This function infers the reference build of a VCF or SAM header from
+    the length of chromosome 1 or from the names of the reference.
+
+    Args:
+        header (str): header text.
+
+    Returns:
+        "GRCh38", "GRCh37" or None if it can not be inferred.
+    """
+
+    match = chr1_pattern.search(header)
+    if match is not None and int(match.group(1)) in chr1_lengths:
+        return chr1_lengths[int(match.group(1))]
+
+    for build, pattern in build_patterns:
+        if pattern.search(header):
+            return build
+
+    return None
+
+def read_vcf_header(file: str) -> dict:
+    """
+    This function reads the header of a VCF file (plain or compressed)
+    up to the "#CHROM" line, without reading the variants.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        Dictionary with the "samples" (columns after FORMAT) and the
+        "reference_build".
+    """
+
+    opener = gzip.open if file.endswith(".gz") else open
+    header_lines = []
+    samples = []
+
+    with opener(file, "rt", errors="replace") as opened_file:
+        for line in opened_file:
+            if line.startswith("#CHROM"):
+                samples = line.rstrip("\r\n").split("\t")[9:]
+                break
+            if not line.startswith("##"):
+                break
+            header_lines.append(line)
+
+    return {"samples": samples,
+        "reference_build": infer_reference_build("".join(header_lines))}
+
+def read_sam_header_samples(header: str) -> dict:
+    """
+    This function gets the sample names of the read groups (@RG SM
+    tags) and the reference build of a SAM header.
+
+    Args:
+        header (str): SAM header text.
+
+    Returns:
+        Dictionary with the "samples" and the "reference_build".
+    """
+
+    samples = []
+    for line in header.splitlines():
+        if line.startswith("@RG"):
+            for field in line.split("\t")[1:]:
+                if field.startswith("SM:") and field[3:] not in samples:
+                    samples.append(field[3:])
+
+    return {"samples": samples, "reference_build": infer_reference_build(header)}
+
+def read_bam_header(file: str) -> dict:
+    """
+    This function reads the SAM header of a BAM file, decompressing
+    only the first BGZF blocks.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        Dictionary with the "samples" and the "reference_build".
+    """
+
+    with gzip.open(file, "rb") as opened_file:
+        if opened_file.read(4) != b"BAM\x01":
+            raise ValueError("Not a BAM file")
+        text_length = struct.unpack("<i", opened_file.read(4))[0]
+        header = opened_file.read(text_length)
+
+    return read_sam_header_samples(header.decode(errors="replace").rstrip("\x00"))
+
+def read_itf8(opened_file) -> int:
+    """
+    This function reads an ITF-8 integer of a CRAM file (1 to 5 bytes,
+    the number of leading 1 bits of the first byte tells how many bytes
+    follow).
+
+    Args:
+        opened_file (file object): CRAM file opened in binary mode.
+
+    Returns:
+        Integer read.
+    """
+
+    first = opened_file.read(1)[0]
+    if first < 0x80:
+        return first
+    if first < 0xC0:
+        return ((first & 0x3F) << 8) | opened_file.read(1)[0]
+    if first < 0xE0:
+        following = opened_file.read(2)
+        return ((first & 0x1F) << 16) | (following[0] << 8) | following[1]
+    if first < 0xF0:
+        following = opened_file.read(3)
+        return (((first & 0x0F) << 24) | (following[0] << 16)
+            | (following[1] << 8) | following[2])
+    following = opened_file.read(4)
+    return (((first & 0x0F) << 28) | (following[0] << 20) | (following[1] << 12)
+        | (following[2] << 4) | (following[3] & 0x0F))
+
+def read_ltf8(opened_file) -> int:
+    """
+    This function reads an LTF-8 integer of a CRAM file (1 to 9 bytes).
+
+    Args:
+        opened_file (file object): CRAM file opened in binary mode.
+
+    Returns:
+        Integer read.
+    """
+
+    first = opened_file.read(1)[0]
+    following_count = 0
+    while following_count < 8 and first & (0x80 >> following_count):
+        following_count += 1
+
+    value = first & (0xFF >> (following_count + 1)) if following_count < 8 else 0
+    for byte in opened_file.read(following_count):
+        value = (value << 8) | byte
+
+    return value
+
+def read_cram_header(file: str) -> dict:
+    """
+    This function reads the SAM header of a CRAM file (versions 2 and
+    3) from the first block of the first container, without reading
+    the slices with the reads.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        Dictionary with the "samples" and the "reference_build".
+    """
+
+    with open(file, "rb") as opened_file:
+        file_definition = opened_file.read(26)
+        if file_definition[:4] != b"CRAM":
+            raise ValueError("Not a CRAM file")
+        major_version = file_definition[4]
+
+        # Container header: length, reference, start, span, records,
+        # record counter, bases, blocks, landmarks and CRC32 (version 3)
+        opened_file.read(4)
+        for _ in range(4):
+            read_itf8(opened_file)
+        read_ltf8(opened_file)
+        read_ltf8(opened_file)
+        read_itf8(opened_file)
+        for _ in range(read_itf8(opened_file)):
+            read_itf8(opened_file)
+        if major_version >= 3:
+            opened_file.read(4)
+
+        # Block: method, content type, content ID, sizes and data
+        method = opened_file.read(1)[0]
+        opened_file.read(1)
+        read_itf8(opened_file)
+        compressed_size = read_itf8(opened_file)
+        read_itf8(opened_file)
+        data = opened_file.read(compressed_size)
+
+    decompressors = {0: lambda data: data, 1: gzip.decompress,
+        2: bz2.decompress, 3: lzma.decompress}
+    if method not in decompressors:
+        raise ValueError("Unsupported CRAM header compression")
+    data = decompressors[method](data)
+
+    text_length = struct.unpack("<i", data[:4])[0]
+    header = data[4:4 + text_length].decode(errors="replace").rstrip("\x00")
+
+    return read_sam_header_samples(header)
+
+def read_multiqc_header(file: str) -> dict:
+    """
+    This function reads the sample names and the reference genome of a
+    MultiQC data file (multiqc_data.json). Other JSON files have no
+    sample metadata.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        Dictionary with the "samples" and the "reference_build", None if
+        the file is not a MultiQC data file.
+    """
+
+    with open(file) as opened_file:
+        data = json.load(opened_file)
+
+    if not isinstance(data, dict) or "report_general_stats_data" not in data:
+        return None
+
+    # General statistics are lists of dictionaries keyed by sample
+    samples = []
+    for section in data["report_general_stats_data"]:
+        for sample in section:
+            if sample not in samples:
+                samples.append(sample)
+
+    genome = " ".join(str(data.get(key, ""))
+        for key in ["config_genome", "config_title", "config_report_comment"])
+
+    return {"samples": samples, "reference_build": infer_reference_build(genome)}
+
+# Header readers per file extension (see get_extension)
+header_readers = {"vcf": read_vcf_header, "vcf.gz": read_vcf_header,
+    "bam": read_bam_header, "cram": read_cram_header,
+    "json": read_multiqc_header}
+
+def create_header_tables(database: str):
+    """
+    Creates table to store the result of comparing the samples of each
+    file with its patient if it does not exist already. The metadata of
+    the headers is cached by digest in the analysis_cache table, the
+    header_metadata table of previous versions is moved there.
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        Commited 'Sample checks' table into the database.
+    """
+
+    create_analysis_cache_table(database)
+
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Move the metadata read by previous versions to the analysis cache,
+    # as results of the first version of the header analyzer
+    cursor.execute("""SELECT COUNT(name) FROM sqlite_master
+        WHERE type = "table" AND name = "header_metadata" """)
+    if cursor.fetchone()[0] == 1:
+        cursor.execute("""INSERT OR IGNORE INTO analysis_cache
+            SELECT sha256, 'header_metadata', '1', result, length(result),
+                read_at, read_at, 0
+            FROM (SELECT sha256, read_at, CASE WHEN samples IS NULL THEN 'null'
+                    ELSE json_object('samples', json(samples),
+                        'reference_build', reference_build) END AS result
+                FROM header_metadata)""")
+        cursor.execute("DROP TABLE header_metadata")
+
+    # Create sample_checks table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists sample_checks (
+            patient_id text,
+            file_name text,
+            file_location text,
+            samples text,
+            reference_build text,
+            result text,
+            date text,
+
+            UNIQUE(patient_id, file_name)
+            )""")
+
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def read_entry_header(entry) -> dict:
+    """
+    This function reads the sample names and the reference build from
+    the header of a VCF, BAM, CRAM or MultiQC JSON file.
+
+    Args:
+        entry (FileEntry): file to read.
+
+    Returns:
+        Dictionary with the "samples" and the "reference_build", None if
+        the file has no sample metadata or can not be read.
+    """
+
+    if entry.extension not in header_readers or entry.size == 0:
+        return None
+
+    try:
+        return header_readers[entry.extension](entry.path)
+
+    # Print error if encountered
+    except (OSError, EOFError, ValueError, IndexError,
+            struct.error, lzma.LZMAError) as error:
+        print("Failed to read header,", entry.path, error)
+        return None
+
+# Analyzer of the headers, cached by digest
+header_analyzer = register_analyzer(Analyzer(
+    name= "header_metadata",
+    version= "1",
+    categories= ("vcf", "cram", "bam", "json"),
+    function= read_entry_header))
+
+def read_header_metadata(database: str, entry, sha256: str) -> dict:
+    """
+    This function reads the sample metadata of the header of a file
+    (see read_entry_header). The result is cached by the digest of the
+    file, so the same file is read once whatever its name or location.
+
+    Args:
+        database (str): name of the database to connect to.
+        entry (FileEntry): file to read.
+        sha256 (str): digest of the file.
+
+    Returns:
+        Dictionary with the "samples" and the "reference_build", None if
+        the file has no sample metadata or can not be read.
+    """
+
+    if entry.extension not in header_readers or entry.size == 0:
+        return None
+
+    for _, metadata in analyze_files(
+            database= database,
+            analyzer= header_analyzer,
+            file_entries= [entry],
+            digests= {entry.path: sha256}):
+        return metadata
+
+def list_expected_names(patient_id: str, patient_directory: str,
+    file_entries: list) -> set:
+    """
+    This function lists the names the samples of a patient may have:
+    the patient ID and the names of the directories below the patient
+    directory (e.g. sample directories as "2021-28499-03").
+
+    Args:
+        patient_id (str): unique string to identify the patient.
+        patient_directory (str): path of the patient directory.
+        file_entries (list): list of FileEntry records of the patient.
+
+    Returns:
+        Set of lowercase names.
+    """
+
+    expected_names = {patient_id.lower()}
+    root = os.path.abspath(patient_directory)
+    for entry in file_entries:
+        relative_path = os.path.relpath(os.path.dirname(entry.path), root)
+        if relative_path != ".":
+            expected_names.update(name.lower()
+                for name in relative_path.split(os.sep))
+
+    return expected_names
+
+def compare_samples(samples: list, expected_names: set) -> str:
+    """
+    This function compares the sample names of a file with the names
+    expected for its patient. A sample matches if its name is an
+    expected name, contains one or is contained in one. Names shorter
+    than 4 characters only match exactly, as parts of other names they
+    match too often. Generic names (e.g. "TUMOR") are not compared.
+
+    Args:
+        samples (list): sample names read from the header.
+        expected_names (set): names from list_expected_names.
+
+    Returns:
+        "match" if every sample matches, "mismatch" if a sample does not
+        match and "unknown" if the file has no specific sample names.
+    """
+
+    specific_samples = [sample.lower() for sample in samples
+        if sample.lower() not in generic_sample_names]
+    if specific_samples == []:
+        return "unknown"
+
+    for sample in specific_samples:
+        if not any(sample == name
+                or (len(name) >= 4 and name in sample)
+                or (len(sample) >= 4 and sample in name)
+                for name in expected_names):
+            return "mismatch"
+
+    return "match"
+
+def record_sample_check(database: str, patient_id: str, file_name: str,
+    file_location: str, metadata: dict, result: str):
+    """
+    Records the samples of a file and the result of their comparison
+    with the patient, replacing the result of a previous check of the
+    same file.
+
+    Args:
+        database (str): name of the database to connect to.
+        patient_id (str): unique string to identify the patient.
+        file_name (str): full file name.
+        file_location (str): absolute path of the file.
+        metadata (dict): samples and reference build of the file.
+        result (str): "match", "mismatch" or "unknown".
+
+    Returns:
+        Information recorded into the "Sample checks" table in the
+        database.
+    """
+
+    try:
+        # Connect to database and create a cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Record information into database table
+        cursor.execute("""INSERT OR REPLACE INTO sample_checks VALUES(
+                        :patient_id,
+                        :file_name,
+                        :file_location,
+                        :samples,
+                        :reference_build,
+                        :result,
+                        :date)""",
+                            {"patient_id": patient_id,
+                            "file_name": file_name,
+                            "file_location": file_location,
+                            "samples": ",".join(metadata["samples"]),
+                            "reference_build": metadata["reference_build"],
+                            "result": result,
+                            "date": datetime.datetime.today().strftime("%d/%m/%Y %H:%M:%S")})
+
+        # Commit cursor to database
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+def list_sample_mismatches(database: str) -> list:
+    """
+    This function lists the files whose sample names do not match their
+    patient.
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        List of tuples (as patient_id, file_name, samples).
+    """
+
+    sample_mismatch_list = []
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # The table does not exist if the samples were never checked
+        cursor.execute("""SELECT COUNT(name) FROM sqlite_master
+            WHERE type = "table" AND name = "sample_checks" """)
+        if cursor.fetchone()[0] == 1:
+            cursor.execute("""SELECT patient_id,file_name,samples
+                FROM sample_checks
+                WHERE result = "mismatch"
+                ORDER BY patient_id, file_name""")
+            sample_mismatch_list = cursor.fetchall()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return sample_mismatch_list
@@ -0,0 +1,431 @@
+import datetime
+import hashlib
+import os
+import sqlite3
+
+from aacini.utils.functions import create_sha256
+from aacini.utils.functions import scan_directory
+from aacini.utils.catalog import connect_database
+
+######################################################################
+### Merkle tree functions
+######################################################################
+
+def create_merkle_tables(database: str):
+    """
+    Creates the tables that store the Merkle tree of each ticket if
+    they do not exist already:
+        - merkle_leaves: one row per file with its hash, size and
+            modification time.
+        - merkle_nodes: one row per directory (ticket, patient and
+            sample directories) with the digest of its content and the
+            fingerprint of the size and modification time of its files.
+
+    Paths are relative to the ticket directory, the ticket node has the
+    path "".
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        Commited 'Merkle' tables into the database.
+    """
+
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Create merkle_leaves table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists merkle_leaves (
+            ticket text,
+            file_path text,
+            sha256 text,
+            size_bytes integer,
+            mtime_ns integer,
+
+            UNIQUE(ticket, file_path)
+            )""")
+
+    # Create merkle_nodes table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists merkle_nodes (
+            ticket text,
+            node_path text,
+            level text,
+            digest text,
+            fingerprint text,
+            file_count integer,
+            total_bytes integer,
+            updated integer,
+
+            UNIQUE(ticket, node_path)
+            )""")
+
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def parent_path(path: str) -> str:
+    """
+    This function gets the parent of a path relative to the ticket.
+
+    Args:
+        path (str): "/"-separated path relative to the ticket.
+
+    Returns:
+        Parent path, "" for the ticket.
+    """
+
+    return path.rsplit("/", 1)[0] if "/" in path else ""
+
+def node_level(node_path: str) -> str:
+    """
+    This function gets the level of a directory in the ticket.
+
+    Args:
+        node_path (str): "/"-separated path relative to the ticket.
+
+    Returns:
+        "ticket", "patient" or "directory".
+    """
+
+    if node_path == "":
+        return "ticket"
+    elif "/" not in node_path:
+        return "patient"
+    return "directory"
+
+def compute_nodes(leaves: dict) -> dict:
+    """
+    This function computes the nodes of a Merkle tree bottom-up from
+    its leaves. The digest of a directory is the sha256 of the sorted
+    names and digests of its files and subdirectories, so it changes
+    if any file below it changes. The fingerprint is computed the same
+    way from sizes and modification times, so it can be compared
+    without reading the files.
+
+    Args:
+        leaves (dict): relative file paths and tuples (as sha256,
+            size_bytes, mtime_ns). The hash may be None, then only the
+            fingerprints are computed.
+
+    Returns:
+        Dictionary of relative directory paths and tuples (as digest,
+        fingerprint, file_count, total_bytes).
+    """
+
+    # Lines describing the children of each directory
+    digest_lines = {"": []}
+    fingerprint_lines = {"": []}
+    counts = {"": [0, 0]}
+
+    for file_path, (sha256, size, mtime_ns) in leaves.items():
+        directory = parent_path(file_path)
+        name = file_path.rsplit("/", 1)[-1]
+
+        # Register the directory and its ancestors
+        ancestor = directory
+        while ancestor not in digest_lines:
+            digest_lines[ancestor] = []
+            fingerprint_lines[ancestor] = []
+            counts[ancestor] = [0, 0]
+            ancestor = parent_path(ancestor)
+
+        digest_lines[directory].append(f"F\0{name}\0{sha256}\n")
+        fingerprint_lines[directory].append(f"F\0{name}\0{size}\0{mtime_ns}\n")
+
+    # Add the file counts and bytes to every ancestor
+    for file_path, (_, size, _) in leaves.items():
+        ancestor = parent_path(file_path)
+        while True:
+            counts[ancestor][0] += 1
+            counts[ancestor][1] += size
+            if ancestor == "":
+                break
+            ancestor = parent_path(ancestor)
+
+    # Compute the deepest directories first
+    nodes = {}
+    for directory in sorted(digest_lines, key=lambda path:
+            (-path.count("/") if path else 1, path)):
+        digest = hashlib.sha256("".join(
+            sorted(digest_lines[directory])).encode()).hexdigest()
+        fingerprint = hashlib.sha256("".join(
+            sorted(fingerprint_lines[directory])).encode()).hexdigest()
+        nodes[directory] = (digest, fingerprint, *counts[directory])
+
+        # Add the directory as a child of its parent
+        if directory != "":
+            name = directory.rsplit("/", 1)[-1]
+            digest_lines[parent_path(directory)].append(
+                f"D\0{name}\0{digest}\n")
+            fingerprint_lines[parent_path(directory)].append(
+                f"D\0{name}\0{fingerprint}\n")
+
+    return nodes
+
+def stat_ticket(input_path: str) -> dict:
+    """
+    This function lists the files of the patient directories of a
+    ticket with their size and modification time, without reading
+    them.
+
+    Args:
+        input_path (str): path of the ticket directory.
+
+    Returns:
+        Dictionary of relative file paths and tuples (as None,
+        size_bytes, mtime_ns).
+    """
+
+    ticket_path = os.path.abspath(input_path)
+    leaves = {}
+
+    for directory in sorted(os.listdir(ticket_path)):
+        directory_path = os.path.join(ticket_path, directory)
+        if not os.path.isdir(directory_path):
+            continue
+        for entry in scan_directory(directory_path, patient_id=directory):
+            relative_path = os.path.relpath(entry.path,
+                ticket_path).replace(os.sep, "/")
+            leaves[relative_path] = (None, entry.size,
+                os.stat(entry.path).st_mtime_ns)
+
+    return leaves
+
+def store_merkle_tree(database: str, ticket: str, leaves: dict):
+    """
+    This function replaces the Merkle tree stored for a ticket.
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): name of the package sent by the lab.
+        leaves (dict): relative file paths and tuples (as sha256,
+            size_bytes, mtime_ns).
+
+    Returns:
+        Merkle tree recorded in the merkle_leaves and merkle_nodes
+        tables.
+    """
+
+    nodes = compute_nodes(leaves)
+    updated = int(datetime.datetime.today().timestamp())
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Replace the tree of the ticket in a single transaction
+        cursor.execute("DELETE FROM merkle_leaves WHERE ticket = ?", (ticket,))
+        cursor.execute("DELETE FROM merkle_nodes WHERE ticket = ?", (ticket,))
+
+        cursor.executemany("""INSERT INTO merkle_leaves VALUES(?, ?, ?, ?, ?)""",
+            [(ticket, file_path, sha256, size, mtime_ns)
+                for file_path, (sha256, size, mtime_ns) in leaves.items()])
+        cursor.executemany("""INSERT INTO merkle_nodes
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?)""",
+            [(ticket, node_path, node_level(node_path), digest, fingerprint,
+                file_count, total_bytes, updated)
+                for node_path, (digest, fingerprint, file_count, total_bytes)
+                in nodes.items()])
+
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+def build_merkle_tree(database: str, ticket: str, input_path: str,
+    hashes: dict):
+    """
+    This function builds and stores the Merkle tree of a ticket from
+    the hashes created by a run.
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): name of the package sent by the lab.
+        input_path (str): path of the ticket directory.
+        hashes (dict): absolute file paths and their hashes.
+
+    Returns:
+        Root digest of the ticket.
+    """
+
+    ticket_path = os.path.abspath(input_path)
+    leaves = {}
+
+    # Take the hash of each file from the run, files not hashed by the
+    # run (e.g. created after it listed the directory) are hashed now
+    for relative_path, (_, size, mtime_ns) in stat_ticket(input_path).items():
+        file_path = os.path.join(ticket_path, *relative_path.split("/"))
+        sha256 = hashes.get(file_path)
+        if sha256 is None:
+            sha256 = create_sha256(file_path)
+        leaves[relative_path] = (sha256, size, mtime_ns)
+
+    store_merkle_tree(database, ticket, leaves)
+    return compute_nodes(leaves)[""][0]
+
+def load_merkle_tree(database: str, ticket: str) -> tuple:
+    """
+    This function loads the Merkle tree stored for a ticket.
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): name of the package sent by the lab.
+
+    Returns:
+        Tuple (as leaves, nodes) of dictionaries like those of
+        compute_nodes. Both are empty if no tree is stored.
+    """
+
+    leaves = {}
+    nodes = {}
+
+    try:
+        # Connect to database and create cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        for file_path, sha256, size, mtime_ns in cursor.execute(
+                """SELECT file_path,sha256,size_bytes,mtime_ns
+                FROM merkle_leaves WHERE ticket = ?""", (ticket,)):
+            leaves[file_path] = (sha256, size, mtime_ns)
+
+        for node_path, digest, fingerprint, file_count, total_bytes in \
+                cursor.execute("""SELECT node_path,digest,fingerprint,
+                    file_count,total_bytes
+                FROM merkle_nodes WHERE ticket = ?""", (ticket,)):
+            nodes[node_path] = (digest, fingerprint, file_count, total_bytes)
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
+
+    return leaves, nodes
+
+def verify_merkle_tree(database: str, ticket: str, input_path: str,
+    full: bool = False, update: bool = False) -> dict:
+    """
+    This function verifies a ticket against its stored Merkle tree.
+    The roots are compared first and only the directories whose
+    fingerprint (or digest with full=True) differs are descended into.
+    Within those directories, only files whose size or modification
+    time changed are hashed again.
+
+    Args:
+        database (str): name of the database to connect to.
+        ticket (str): name of the package sent by the lab.
+        input_path (str): path of the ticket directory.
+        full (bool): hash every file and compare digests instead of
+            trusting sizes and modification times.
+        update (bool): store the verified tree as the new tree.
+
+    Returns:
+        Dictionary with the lists of "changed" (different content),
+        "touched" (same content, different size or modification time),
+        "missing" and "extra" relative file paths, the "visited"
+        directories, the "root" digest and "intact" (bool).
+    """
+
+    ticket_path = os.path.abspath(input_path)
+    stored_leaves, stored_nodes = load_merkle_tree(database, ticket)
+    current_leaves = stat_ticket(input_path)
+
+    def file_hash(relative_path):
+        return create_sha256(os.path.join(ticket_path,
+            *relative_path.split("/")))
+
+    # Hash every file to compare digests in full mode
+    if full:
+        current_leaves = {relative_path: (file_hash(relative_path), size,
+            mtime_ns) for relative_path, (_, size, mtime_ns)
+            in current_leaves.items()}
+    current_nodes = compute_nodes(current_leaves)
+    key = 0 if full else 1
+
+    result = {"changed": [], "touched": [], "missing": [], "extra": [],
+        "visited": [], "root": None, "intact": False}
+
+    # Group the files by directory for the descent
+    def files_by_directory(leaves):
+        directories = {}
+        for relative_path in leaves:
+            directories.setdefault(parent_path(relative_path),
+                []).append(relative_path)
+        return directories
+
+    stored_files = files_by_directory(stored_leaves)
+    current_files = files_by_directory(current_leaves)
+
+    # Descend from the root only into directories that differ
+    pending = [""]
+    while pending:
+        directory = pending.pop()
+        stored_node = stored_nodes.get(directory)
+        current_node = current_nodes.get(directory)
+        if (stored_node is not None and current_node is not None
+                and stored_node[key] == current_node[key]):
+            continue
+        result["visited"].append(directory)
+
+        # Compare the files directly in the directory
+        stored_names = set(stored_files.get(directory, []))
+        current_names = set(current_files.get(directory, []))
+        result["missing"] += sorted(stored_names - current_names)
+        result["extra"] += sorted(current_names - stored_names)
+        for relative_path in sorted(stored_names & current_names):
+            stored_hash, stored_size, stored_mtime = stored_leaves[relative_path]
+            current_hash, current_size, current_mtime = current_leaves[relative_path]
+            if not full and (stored_size, stored_mtime) == (current_size, current_mtime):
+                continue
+            if current_hash is None:
+                current_hash = file_hash(relative_path)
+                current_leaves[relative_path] = (current_hash, current_size,
+                    current_mtime)
+            if current_hash != stored_hash:
+                result["changed"].append(relative_path)
+            elif (stored_size, stored_mtime) != (current_size, current_mtime):
+                result["touched"].append(relative_path)
+
+        # Queue the subdirectories of either tree
+        for node_path in set(stored_nodes) | set(current_nodes):
+            if node_path != "" and parent_path(node_path) == directory:
+                pending.append(node_path)
+
+    result["intact"] = not (result["changed"] or result["missing"]
+        or result["extra"]) and bool(stored_nodes)
+
+    # Files not hashed again keep the stored hash, new files are only
+    # hashed to update the tree
+    for relative_path, (sha256, size, mtime_ns) in current_leaves.items():
+        if sha256 is None and relative_path in stored_leaves:
+            current_leaves[relative_path] = (stored_leaves[relative_path][0],
+                size, mtime_ns)
+        elif sha256 is None and update:
+            current_leaves[relative_path] = (file_hash(relative_path),
+                size, mtime_ns)
+
+    if all(leaf[0] is not None for leaf in current_leaves.values()):
+        result["root"] = compute_nodes(current_leaves)[""][0]
+
+        # Store the verified tree
+        if update:
+            store_merkle_tree(database, ticket, current_leaves)
+
+    return result
@@ -0,0 +1,435 @@
+import datetime
+import sqlite3
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import pandas as pd
+
+from aacini.utils.analyzers import Analyzer
+from aacini.utils.analyzers import analyze_files
+from aacini.utils.analyzers import register_analyzer
+from aacini.utils.catalog import connect_database
+
+######################################################################
+### Copy number and gene metrics functions
+######################################################################
+
+# log2 ratios from which a segment is a gain or a loss (CNVkit
+# "call" thresholds)
+gain_threshold = 0.2
+loss_threshold = -0.25
+
+# Mean coverage under which a gene has a low coverage
+low_coverage = 20
+
+# Rows or elements read per chunk
+chunk_size = 100000
+
+def create_copy_number_table(database: str):
+    """
+    Creates table to store the summary of the copy number segments of
+    the CNVkit (.cns) and vcf2cytosure (.cgh) files per patient if it
+    does not exist already. Records are keyed (and indexed) by patient
+    and file name.
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        Commited 'Copy number summary' table into the database.
+    """
+
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Create copy_number_summary table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists copy_number_summary (
+            patient_id text,
+            file_name text,
+            file_type text,
+            file_location text,
+            status text,
+            probe_count integer,
+            segment_count integer,
+            altered_segments integer,
+            gain_length integer,
+            loss_length integer,
+            altered_length integer,
+            total_length integer,
+            mean_abs_log2 real,
+            parsed_at integer,
+
+            UNIQUE(patient_id, file_name)
+            )""")
+
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def create_gene_metrics_table(database: str):
+    """
+    Creates table to store the summary of the gene coverage of the
+    .gene_metrics files per patient if it does not exist already.
+    Records are keyed (and indexed) by patient and file name.
+
+    Args:
+        database (str): name of the database to connect to.
+
+    Returns:
+        Commited 'Gene metrics summary' table into the database.
+    """
+
+    # Connect to database and create a cursor
+    connection = connect_database(database)
+    cursor = connection.cursor()
+
+    # Create gene_metrics_summary table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists gene_metrics_summary (
+            patient_id text,
+            file_name text,
+            file_location text,
+            status text,
+            gene_count integer,
+            coverage_column text,
+            coverage_mean real,
+            coverage_median real,
+            coverage_min real,
+            low_coverage_genes integer,
+            parsed_at integer,
+
+            UNIQUE(patient_id, file_name)
+            )""")
+
+    # Commit cursor to database
+    connection.commit()
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def summarize_segments(chunks) -> dict:
+    """
+    This function summarizes copy number segments read in chunks, each
+    chunk with the "start", "end" and "log2" columns as NumPy arrays
+    so the whole chunk is computed at once.
+
+    Args:
+        chunks (iterable): DataFrames of segments.
+
+    Returns:
+        Dictionary with the number of segments, the number of altered
+        segments, the length of gains, losses, altered and all the
+        segments, and the mean absolute log2 ratio weighted by length.
+    """
+
+    summary = {"segment_count": 0, "altered_segments": 0, "gain_length": 0,
+        "loss_length": 0, "altered_length": 0, "total_length": 0,
+        "mean_abs_log2": None}
+    weighted_log2 = 0.0
+
+    for chunk in chunks:
+        start = pd.to_numeric(chunk["start"], errors="coerce").to_numpy(dtype=float)
+        end = pd.to_numeric(chunk["end"], errors="coerce").to_numpy(dtype=float)
+        log2 = pd.to_numeric(chunk["log2"], errors="coerce").to_numpy(dtype=float)
+
+        # Skip rows without coordinates or ratio
+        valid = ~(np.isnan(start) | np.isnan(end) | np.isnan(log2))
+        length = (end - start)[valid]
+        log2 = log2[valid]
+        gains = log2 >= gain_threshold
+        losses = log2 <= loss_threshold
+
+        summary["segment_count"] += int(valid.sum())
+        summary["altered_segments"] += int((gains | losses).sum())
+        summary["gain_length"] += int(length[gains].sum())
+        summary["loss_length"] += int(length[losses].sum())
+        summary["total_length"] += int(length.sum())
+        weighted_log2 += float((np.abs(log2)*length).sum())
+
+    summary["altered_length"] = summary["gain_length"] + summary["loss_length"]
+    if summary["total_length"] > 0:
+        summary["mean_abs_log2"] = round(weighted_log2/summary["total_length"], 4)
+
+    return summary
+
+def read_cns(file: str) -> dict:
+    """
+    This function reads the segments of a CNVkit .cns file (tab
+    separated, with "chromosome", "start", "end" and "log2" columns) in
+    chunks and summarizes them.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        Dictionary of summary features (see summarize_segments) and the
+        number of probes of the segments.
+    """
+
+    probe_count = 0
+
+    def read_chunks():
+        nonlocal probe_count
+        for chunk in pd.read_csv(file, sep="\t", chunksize=chunk_size,
+                usecols=lambda column: column in
+                    ("chromosome", "start", "end", "log2", "probes")):
+            if "probes" in chunk:
+                probe_count += int(pd.to_numeric(chunk["probes"],
+                    errors="coerce").fillna(0).sum())
+            yield chunk
+
+    summary = summarize_segments(read_chunks())
+    summary["probe_count"] = probe_count
+
+    return summary
+
+def read_cgh(file: str) -> dict:
+    """
+    This function reads a vcf2cytosure .cgh file (XML) as a stream of
+    elements, counts its probes and summarizes its segments (segment
+    elements with "start", "stop" and "average" attributes) in chunks.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        Dictionary of summary features (see summarize_segments) and the
+        number of probes.
+    """
+
+    probe_count = 0
+
+    def read_chunks():
+        nonlocal probe_count
+        segments = {"start": [], "end": [], "log2": []}
+        for _, element in ElementTree.iterparse(file, events=("end",)):
+            if element.tag == "probe":
+                probe_count += 1
+            elif element.tag == "segment":
+                segments["start"].append(element.get("start"))
+                segments["end"].append(element.get("stop"))
+                segments["log2"].append(element.get("average"))
+                if len(segments["start"]) == chunk_size:
+                    yield pd.DataFrame(segments)
+                    segments = {"start": [], "end": [], "log2": []}
+
+            # Free the elements already read
+            element.clear()
+
+        yield pd.DataFrame(segments)
+
+    summary = summarize_segments(read_chunks())
+    summary["probe_count"] = probe_count
+
+    return summary
+
+def find_coverage_column(columns: list) -> str:
+    """
+    This function finds the column with the mean coverage of the genes
+    in the header of a .gene_metrics file.
+
+    Args:
+        columns (list): names of the columns.
+
+    Returns:
+        Name of the coverage column or None.
+    """
+
+    for keywords in [("mean", "cov"), ("mean",), ("cov",), ("depth",)]:
+        for column in columns:
+            if all(keyword in column.lower() for keyword in keywords):
+                return column
+
+    return None
+
+def read_gene_metrics(file: str) -> dict:
+    """
+    This function reads a .gene_metrics file (tab separated, one row
+    per gene) in chunks and summarizes the coverage of its genes.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        Dictionary with the number of genes, the coverage column and
+        the mean, median and minimum coverage, and the number of genes
+        with a mean coverage under low_coverage.
+    """
+
+    summary = {"gene_count": 0, "coverage_column": None, "coverage_mean": None,
+        "coverage_median": None, "coverage_min": None, "low_coverage_genes": None}
+    coverages = []
+
+    for chunk in pd.read_csv(file, sep="\t", chunksize=chunk_size):
+        summary["gene_count"] += len(chunk)
+        if summary["coverage_column"] is None:
+            summary["coverage_column"] = find_coverage_column(list(chunk.columns))
+            if summary["coverage_column"] is None:
+                raise KeyError("No coverage column")
+        coverages.append(pd.to_numeric(chunk[summary["coverage_column"]],
+            errors="coerce").dropna().to_numpy(dtype=float))
+
+    coverage = np.concatenate(coverages) if coverages else np.array([])
+    if coverage.size > 0:
+        summary["coverage_mean"] = round(float(coverage.mean()), 2)
+        summary["coverage_median"] = round(float(np.median(coverage)), 2)
+        summary["coverage_min"] = round(float(coverage.min()), 2)
+        summary["low_coverage_genes"] = int((coverage < low_coverage).sum())
+
+    return summary
+
+# Readers per file category (see get_hts)
+output_readers = {"cns": read_cns, "cgh": read_cgh,
+    "gene_metrics": read_gene_metrics}
+
+def parse_output_file(entry) -> dict:
+    """
+    This function reads a .cns, .cgh or .gene_metrics file and
+    summarizes it. Empty files and files that can not be parsed (e.g.
+    without the expected columns) get a status instead of features.
+
+    Args:
+        entry (FileEntry): file to read.
+
+    Returns:
+        Dictionary of summary features with the "status" of the file
+        ("parsed", "empty" or "unparsed").
+    """
+
+    if entry.size == 0:
+        return {"status": "empty"}
+
+    try:
+        summary = output_readers[entry.hts](entry.path)
+        summary["status"] = "parsed"
+
+    # The file is not in the expected format
+    except (pd.errors.ParserError, pd.errors.EmptyDataError,
+            ElementTree.ParseError, KeyError, ValueError, UnicodeDecodeError):
+        summary = {"status": "unparsed"}
+
+    return summary
+
+# Analyzer of the output files, cached by digest
+output_analyzer = register_analyzer(Analyzer(
+    name= "output_summary",
+    version= "1",
+    categories= tuple(output_readers),
+    function= parse_output_file))
+
+def parse_output_files(file_entries: list, database: str = None,
+    digests: dict = None):
+    """
+    This function summarizes the .cns, .cgh and .gene_metrics files of
+    a list. Files with a digest already summarized take the summary
+    from the cache.
+
+    Args:
+        file_entries (list): list of FileEntry records.
+        database (str): name of the database with the analysis cache,
+            None to read every file.
+        digests (dict): absolute file paths and their digests.
+
+    Returns:
+        Generator of tuples (as FileEntry, summary).
+    """
+
+    yield from analyze_files(
+        database= database,
+        analyzer= output_analyzer,
+        file_entries= [entry for entry in file_entries
+            if entry.hts in output_readers],
+        digests= digests)
+
+def record_output_summaries(database: str, patient_id: str,
+    summaries: list):
+    """
+    Records the summaries of the .cns, .cgh and .gene_metrics files of a
+    patient in bulk, replacing those of a previous run.
+
+    Args:
+        database (str): name of the database to connect to.
+        patient_id (str): unique string to identify the patient.
+        summaries (list): list of tuples (as FileEntry, summary) from
+            parse_output_files.
+
+    Returns:
+        Information recorded into the "Copy number summary" and "Gene
+        metrics summary" tables in the database.
+    """
+
+    parsed_at = int(datetime.datetime.today().timestamp())
+    copy_number_columns = ["probe_count", "segment_count", "altered_segments",
+        "gain_length", "loss_length", "altered_length", "total_length",
+        "mean_abs_log2"]
+    gene_metrics_columns = ["gene_count", "coverage_column", "coverage_mean",
+        "coverage_median", "coverage_min", "low_coverage_genes"]
+
+    copy_number_records = []
+    gene_metrics_records = []
+    for entry, summary in summaries:
+        record = {"patient_id": patient_id,
+            "file_name": entry.name,
+            "file_location": entry.path,
+            "status": summary["status"],
+            "parsed_at": parsed_at}
+        if entry.hts == "gene_metrics":
+            record.update({column: summary.get(column)
+                for column in gene_metrics_columns})
+            gene_metrics_records.append(record)
+        else:
+            record["file_type"] = entry.hts
+            record.update({column: summary.get(column)
+                for column in copy_number_columns})
+            copy_number_records.append(record)
+
+    try:
+        # Connect to database and create a cursor
+        connection = connect_database(database)
+        cursor = connection.cursor()
+
+        # Record information into database tables
+        cursor.executemany("""INSERT OR REPLACE INTO copy_number_summary VALUES(
+                        :patient_id,
+                        :file_name,
+                        :file_type,
+                        :file_location,
+                        :status,
+                        :probe_count,
+                        :segment_count,
+                        :altered_segments,
+                        :gain_length,
+                        :loss_length,
+                        :altered_length,
+                        :total_length,
+                        :mean_abs_log2,
+                        :parsed_at)""", copy_number_records)
+        cursor.executemany("""INSERT OR REPLACE INTO gene_metrics_summary VALUES(
+                        :patient_id,
+                        :file_name,
+                        :file_location,
+                        :status,
+                        :gene_count,
+                        :coverage_column,
+                        :coverage_mean,
+                        :coverage_median,
+                        :coverage_min,
+                        :low_coverage_genes,
+                        :parsed_at)""", gene_metrics_records)
+
+        # Commit cursor to database
+        connection.commit()
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
+
+    # Finalize function
+    finally:
+        # Close cursor and connection
+        cursor.close()
+        connection.close()
@@ -0,0 +1,158 @@
+import concurrent.futures
+import os
+
+from aacini.utils.functions import create_sha256
+from aacini.utils.functions import list_files_under
+from aacini.utils.functions import scan_directory
+
+######################################################################
+### Copy verification functions
+######################################################################
+
+def list_relative_files(root: str) -> dict:
+    """
+    This function lists the files below a root directory by their path
+    relative to it. Like scan_directory, files that start with "." are
+    skipped.
+
+    Args:
+        root (str): path of the directory to list files from.
+
+    Returns:
+        Dictionary of "/"-separated relative paths and FileEntry records.
+    """
+
+    root_path = os.path.abspath(root)
+
+    return {os.path.relpath(entry.path, root_path).replace(os.sep, "/"): entry
+        for entry in scan_directory(root_path, patient_id="")}
+
+def load_recorded_hashes(database: str, root: str) -> dict:
+    """
+    This function loads the hashes recorded by extract for the files
+    below a directory. If a file was recorded with several hashes, the
+    one seen last is kept.
+
+    Args:
+        database (str): name of the database to connect to.
+        root (str): path of the directory whose files are loaded.
+
+    Returns:
+        Dictionary of absolute file paths and tuples (as hash, size_bytes,
+        last_seen).
+    """
+
+    recorded_hashes = {}
+
+    # Later sightings replace earlier ones
+    for _, _, file_location, file_hash, size_bytes, last_seen in sorted(
+            list_files_under(database, root), key=lambda record: record[5] or 0):
+        recorded_hashes[file_location] = (file_hash, size_bytes, last_seen)
+
+    return recorded_hashes
+
+def is_recorded_hash_current(entry, recorded: tuple) -> bool:
+    """
+    This function checks if a recorded hash can be reused for a file:
+    the recorded size must be the current size and the file must not
+    have been modified or replaced after it was last seen. The change
+    time is compared too, copies that keep the modification time (e.g.
+    "cp -p" or "rsync -a") can not set it back.
+
+    Args:
+        entry (FileEntry): current record of the file.
+        recorded (tuple): tuple (as hash, size_bytes, last_seen).
+
+    Returns:
+        True if the recorded hash describes the current file.
+    """
+
+    file_hash, size_bytes, last_seen = recorded
+    if file_hash is None or size_bytes != entry.size or last_seen is None:
+        return False
+
+    try:
+        stat = os.stat(entry.path)
+    except FileNotFoundError:
+        return False
+
+    return max(stat.st_mtime, stat.st_ctime) < last_seen
+
+def verify_copy(source: str, mirror: str, database: str = None,
+    source_workers: int = 2, mirror_workers: int = 2) -> dict:
+    """
+    This function verifies that a mirror directory is an identical copy
+    of a source directory. Both trees are walked in parallel and files
+    are matched by their relative path. Sizes are compared first and
+    only files of the same size are hashed, each side in its own pool
+    so both storages are read at the same time. Hashes recorded by
+    extract are reused for the source files that did not change since.
+
+    Args:
+        source (str): path of the source directory.
+        mirror (str): path of the copy.
+        database (str): name of the database with the recorded hashes,
+            None to hash every source file.
+        source_workers (int): number of workers hashing source files.
+        mirror_workers (int): number of workers hashing mirror files.
+
+    Returns:
+        Dictionary with the lists of "missing" (only in the source),
+        "extra" (only in the mirror) relative paths, "different" tuples
+        (as relative path, reason) and the number of "identical" files
+        and "reused" source hashes.
+    """
+
+    # Walk both trees at the same time
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as walker:
+        source_future = walker.submit(list_relative_files, source)
+        mirror_future = walker.submit(list_relative_files, mirror)
+        source_files = source_future.result()
+        mirror_files = mirror_future.result()
+
+    recorded_hashes = {}
+    if database is not None:
+        recorded_hashes = load_recorded_hashes(database, source)
+
+    result = {
+        "missing": sorted(set(source_files) - set(mirror_files)),
+        "extra": sorted(set(mirror_files) - set(source_files)),
+        "different": [],
+        "identical": 0,
+        "reused": 0}
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, source_workers)) as source_pool, \
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, mirror_workers)) as mirror_pool:
+
+        # Compare sizes first and hash only the files of equal size
+        pending = []
+        for relative_path in sorted(set(source_files) & set(mirror_files)):
+            source_entry = source_files[relative_path]
+            mirror_entry = mirror_files[relative_path]
+            if source_entry.size != mirror_entry.size:
+                result["different"].append((relative_path, "size"))
+                continue
+
+            recorded = recorded_hashes.get(source_entry.path)
+            if recorded is not None and is_recorded_hash_current(
+                    source_entry, recorded):
+                source_hash = concurrent.futures.Future()
+                source_hash.set_result(recorded[0])
+                result["reused"] += 1
+            else:
+                source_hash = source_pool.submit(create_sha256,
+                    source_entry.path)
+            mirror_hash = mirror_pool.submit(create_sha256, mirror_entry.path)
+            pending.append((relative_path, source_hash, mirror_hash))
+
+        for relative_path, source_hash, mirror_hash in pending:
+            if source_hash.result() != mirror_hash.result():
+                result["different"].append((relative_path, "digest"))
+            else:
+                result["identical"] += 1
+
+    result["different"].sort()
+
+    return result
@@ -0,0 +1,166 @@
+import json
+import os
+import time
+
+######################################################################
+### Progress functions
+######################################################################
+
+def format_eta(seconds: float) -> str:
+    """
+    This function formats a number of seconds as hours, minutes and
+    seconds.
+
+    Args:
+        seconds (float): remaining time in seconds, None if unknown.
+
+    Returns:
+        Time as "HH:MM:SS" or "--:--:--" if unknown.
+    """
+
+    if seconds is None:
+        return "--:--:--"
+
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class Throughput:
+    """
+    Bytes done out of a total, with the throughput measured since the
+    start to estimate the remaining time. Bytes already done before
+    the start (e.g. files completed before a run was interrupted) count
+    as done but not in the throughput.
+    """
+
+    def __init__(self, total_bytes: int, done_bytes: int = 0):
+        self.total_bytes = total_bytes
+        self.done_bytes = done_bytes
+        self.measured_bytes = 0
+        self.started = time.monotonic()
+
+    def advance(self, size: int):
+        self.done_bytes += size
+        self.measured_bytes += size
+
+    def rate(self) -> float:
+        """
+        Returns the throughput in bytes per second.
+        """
+
+        elapsed = time.monotonic() - self.started
+        if elapsed <= 0 or self.measured_bytes == 0:
+            return None
+        return self.measured_bytes/elapsed
+
+    def eta(self) -> float:
+        """
+        Returns the estimated seconds until all the bytes are done.
+        """
+
+        rate = self.rate()
+        if rate is None:
+            return None
+        return max(self.total_bytes - self.done_bytes, 0)/rate
+
+    def fraction(self) -> float:
+        if self.total_bytes == 0:
+            return 1.0
+        return self.done_bytes/self.total_bytes
+
+class ProgressEvents:
+    """
+    Writes progress events as JSON lines on a file descriptor or in a
+    file, one line per event, so schedulers and dashboards can follow
+    a run.
+    """
+
+    def __init__(self, fd: int = None, path: str = None):
+        self.stream = None
+        if fd is not None:
+            self.stream = os.fdopen(fd, "w", buffering=1, closefd=False)
+        elif path is not None:
+            self.stream = open(path, "a", buffering=1)
+
+    def emit(self, event: str, **fields):
+        """
+        Writes an event with its epoch time and fields.
+        """
+
+        if self.stream is None:
+            return
+        record = {"event": event, "time": round(time.time(), 3)}
+        record.update(fields)
+        self.stream.write(json.dumps(record) + "\n")
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+class ProgressTracker:
+    """
+    Byte-weighted progress of a ticket and of the patient being
+    processed, shown next to the progress bar and written as events.
+    """
+
+    def __init__(self, ticket: str, total_bytes: int, total_files: int,
+        done_bytes: int = 0, events: ProgressEvents = None, run_id: int = None):
+        self.ticket = ticket
+        self.ticket_progress = Throughput(total_bytes, done_bytes)
+        self.patient_progress = None
+        self.patient_id = None
+        self.events = events or ProgressEvents()
+        self.events.emit("run_start", ticket=ticket, run_id=run_id,
+            total_bytes=total_bytes, total_files=total_files,
+            done_bytes=done_bytes)
+
+    def start_patient(self, patient_id: str, total_bytes: int,
+        total_files: int, done_bytes: int = 0):
+        self.patient_id = patient_id
+        self.patient_progress = Throughput(total_bytes, done_bytes)
+        self.events.emit("patient_start", ticket=self.ticket,
+            patient_id=patient_id, total_bytes=total_bytes,
+            total_files=total_files, done_bytes=done_bytes)
+
+    def file_done(self, file_location: str, size: int):
+        self.ticket_progress.advance(size)
+        self.patient_progress.advance(size)
+        self.events.emit("file_done", ticket=self.ticket,
+            patient_id=self.patient_id, file_location=file_location,
+            size_bytes=size, **self.snapshot())
+
+    def finish_patient(self):
+        self.events.emit("patient_done", ticket=self.ticket,
+            patient_id=self.patient_id, **self.snapshot())
+
+    def finish(self, report: str = None):
+        self.events.emit("run_done", ticket=self.ticket, report=report,
+            done_bytes=self.ticket_progress.done_bytes,
+            total_bytes=self.ticket_progress.total_bytes)
+        self.events.close()
+
+    def snapshot(self) -> dict:
+        """
+        Returns the bytes done, throughput and remaining time of the
+        patient and of the ticket.
+        """
+
+        rate = self.ticket_progress.rate()
+        patient_eta = self.patient_progress.eta()
+        ticket_eta = self.ticket_progress.eta()
+        return {
+            "patient_done_bytes": self.patient_progress.done_bytes,
+            "patient_total_bytes": self.patient_progress.total_bytes,
+            "patient_eta": None if patient_eta is None else round(patient_eta, 1),
+            "done_bytes": self.ticket_progress.done_bytes,
+            "total_bytes": self.ticket_progress.total_bytes,
+            "bytes_per_second": None if rate is None else round(rate),
+            "eta": None if ticket_eta is None else round(ticket_eta, 1)}
+
+    def describe(self, _=None) -> str:
+        """
+        Returns the progress of the ticket to show next to the progress
+        bar of the patient.
+        """
+
+        return (f"ticket {self.ticket_progress.fraction():.0%} "
+            f"ETA {format_eta(self.ticket_progress.eta())}")
@@ -0,0 +1,136 @@
+import array
+import concurrent.futures
+import fcntl
+import struct
+
+from aacini.utils.functions import create_sha256
+
+######################################################################
+### I/O scheduling functions
+######################################################################
+
+# ioctl request to read the extent map of a file (see linux/fiemap.h)
+FS_IOC_FIEMAP = 0xC020660B
+
+# struct fiemap header: start, length, flags, mapped_extents,
+# extent_count, reserved
+FIEMAP_HEADER = struct.Struct("=QQLLLL")
+
+# struct fiemap_extent: logical, physical, length, reserved64[2],
+# flags, reserved32[3]
+FIEMAP_EXTENT = struct.Struct("=QQQQQLLLL")
+
+def get_physical_offset(file: str) -> int:
+    """
+    This function gets the physical offset on disk of the first extent
+    of a file using the FIEMAP ioctl. It is only available on Linux
+    and on filesystems that support it.
+
+    Args:
+        file (str): file name or absolute path.
+
+    Returns:
+        Physical offset in bytes of the first extent of the file or
+        None if it can not be read.
+    """
+
+    # Request a single extent starting at the beginning of the file
+    request = array.array("B", FIEMAP_HEADER.pack(0, 2**64 - 1, 0, 0, 1, 0)
+        + bytes(FIEMAP_EXTENT.size))
+
+    try:
+        with open(file, "rb") as opened_file:
+            fcntl.ioctl(opened_file.fileno(), FS_IOC_FIEMAP, request, True)
+    except OSError:
+        return None
+
+    # Return None if the file has no extents (e.g. empty files)
+    mapped_extents = FIEMAP_HEADER.unpack_from(request, 0)[3]
+    if mapped_extents == 0:
+        return None
+
+    return FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)[1]
+
+def order_files(file_entries: list, use_fiemap: bool = False) -> list:
+    """
+    This function orders files by their physical layout so they are
+    read with as little seeking as possible: by device first and then
+    by physical offset (with FIEMAP) or inode number, which follows
+    the allocation order on most filesystems.
+
+    Args:
+        file_entries (list): list of FileEntry records.
+        use_fiemap (bool): order by physical offset where available.
+
+    Returns:
+        List of FileEntry records in reading order.
+    """
+
+    keys = []
+    for index, entry in enumerate(file_entries):
+        position = None
+        if use_fiemap:
+            position = get_physical_offset(entry.path)
+        if position is None:
+            position = entry.inode
+        keys.append((entry.device, position, index))
+
+    keys.sort()
+    return [file_entries[index] for _, _, index in keys]
+
+def hash_files(file_entries: list, small_workers: int = 4,
+    large_workers: int = 1, large_file_size: int = 64*1024*1024,
+    use_fiemap: bool = False, xattr_cache: bool = False, 
+    trust_cache: bool = True, throttle = None):
+    """
+    This function hashes files in two lanes: small files (e.g. .tbi
+    and .crai indexes) in a pool of several workers and large files
+    (e.g. .cram and .vcf.gz) in a separate pool, by default with a
+    single worker so they are streamed one after the other in physical
+    order without interleaving.
+
+    Args:
+        file_entries (list): list of FileEntry records.
+        small_workers (int): number of workers hashing small files.
+        large_workers (int): number of workers hashing large files.
+        large_file_size (int): size in bytes from which a file is
+            hashed in the large files lane.
+        use_fiemap (bool): order by physical offset where available.
+        xattr_cache (bool): reuse and store hashes in the extended 
+            attributes of the files.
+        trust_cache (bool): if False, hashes in the extended attributes
+            are refreshed instead of reused.
+        throttle (IOThrottle): limits of bandwidth and open files shared
+            by both lanes, None to read without limits.
+
+    Returns:
+        Generator of tuples (as FileEntry, hash) in completion order.
+        Files that can not be read (e.g. removed since they were listed
+        or not readable) are reported and left out.
+    """
+
+    ordered_entries = order_files(file_entries, use_fiemap=use_fiemap)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, small_workers)) as small_lane, \
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, large_workers)) as large_lane:
+
+        # Submit each file to its lane in physical order
+        futures = {}
+        for entry in ordered_entries:
+            lane = large_lane if entry.size >= large_file_size else small_lane
+            future = lane.submit(create_sha256, entry.path, 
+                xattr_cache=xattr_cache, trust_cache=trust_cache,
+                throttle=throttle)
+            futures[future] = entry
+
+        # A file that can not be read does not stop the other files
+        for future in concurrent.futures.as_completed(futures):
+            entry = futures[future]
+            try:
+                file_hash = future.result()
+            except OSError as error:
+                print("\nCould not read", entry.path + ",", error.strerror)
+                continue
+            yield entry, file_hash
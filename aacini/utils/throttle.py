@@ -0,0 +1,172 @@
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import platform
+import sys
+import threading
+import time
+
+from aacini.utils.functions import format_size
+
+######################################################################
+### Throttling functions
+######################################################################
+
+# ioprio_set system call numbers (see "man 2 ioprio_set")
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "i686": 289, "aarch64": 30,
+    "armv7l": 314, "ppc64le": 273}
+
+# ioprio_set arguments (see linux/ioprio.h)
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASSES = {"best-effort": 2, "idle": 3}
+
+class IOThrottle:
+    """
+    Limits shared by all the workers hashing files: a token bucket
+    for the bandwidth in bytes per second and a maximum number of files
+    open at the same time. Workers reserve the bytes they read, so the
+    total rate stays under the limit whatever the number of workers.
+    The time spent waiting is recorded to report the effect of the
+    limits.
+    """
+
+    # Size in bytes of the reads of a throttled worker (8 MB), small
+    # enough to keep the rate smooth
+    chunk_size = 8*1024*1024
+
+    def __init__(self, rate: float = None, max_open_files: int = None):
+        self.rate = rate
+        self.max_open_files = max_open_files
+        self.lock = threading.Lock()
+
+        # The bucket holds up to one second of bandwidth and starts with
+        # a single chunk, so the first second is not a burst
+        self.tokens = min(rate or 0, self.chunk_size)
+        self.updated = time.monotonic()
+        self.open_slots = None
+        if max_open_files:
+            self.open_slots = threading.BoundedSemaphore(max_open_files)
+
+        self.started = time.monotonic()
+        self.bytes_read = 0
+        self.rate_wait = 0.0
+        self.open_wait = 0.0
+
+    def consume(self, size: int):
+        """
+        Takes size bytes from the bucket, sleeping until the bandwidth
+        allows them to be read.
+        """
+
+        with self.lock:
+            self.bytes_read += size
+            if not self.rate:
+                return
+
+            # Refill the bucket up to one second of bandwidth
+            now = time.monotonic()
+            self.tokens = min(self.rate,
+                self.tokens + (now - self.updated)*self.rate)
+            self.updated = now
+
+            # Reserve the bytes, a negative bucket delays the next workers
+            self.tokens -= size
+            wait = -self.tokens/self.rate if self.tokens < 0 else 0.0
+            self.rate_wait += wait
+
+        if wait > 0:
+            time.sleep(wait)
+
+    @contextlib.contextmanager
+    def open_slot(self):
+        """
+        Waits for a free slot to open a file and releases it when the
+        file is closed.
+        """
+
+        if self.open_slots is None:
+            yield
+            return
+
+        waiting_since = time.monotonic()
+        self.open_slots.acquire()
+        with self.lock:
+            self.open_wait += time.monotonic() - waiting_since
+        try:
+            yield
+        finally:
+            self.open_slots.release()
+
+    def summary(self) -> str:
+        """
+        Returns the limits and their effect as lines of the report.
+        """
+
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        lines = []
+        if self.rate:
+            lines.append(f"   - Bandwidth limit: {format_size(int(self.rate))}/s")
+        lines.append(f"   - Read: {format_size(self.bytes_read)} in "
+            f"{elapsed:.1f} s ({format_size(int(self.bytes_read/elapsed))}/s)")
+        if self.rate:
+            lines.append(f"   - Waited for bandwidth: {self.rate_wait:.1f} s")
+        if self.max_open_files:
+            lines.append(f"   - Open files limit: {self.max_open_files}, "
+                f"waited {self.open_wait:.1f} s")
+        return "\n".join(lines)
+
+def set_io_priority(io_class: str) -> bool:
+    """
+    This function sets the I/O scheduling class of the calling process
+    with the ioprio_set system call, like "ionice -c". Threads started
+    afterwards inherit it. It is only available on Linux.
+
+    Args:
+        io_class (str): "best-effort" (lowest level) or "idle".
+
+    Returns:
+        True if the class was set.
+    """
+
+    syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if not sys.platform.startswith("linux") or syscall is None:
+        return False
+
+    # The best-effort class is set with its lowest priority level (7)
+    level = 7 if io_class == "best-effort" else 0
+    ioprio = (IOPRIO_CLASSES[io_class] << IOPRIO_CLASS_SHIFT) | level
+
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    return libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, ioprio) == 0
+
+def lower_priority(nice: int = 0, io_class: str = None) -> list:
+    """
+    This function lowers the CPU priority (nice value) and the I/O
+    priority of the process. It is called before the workers are
+    started so they inherit the priorities.
+
+    Args:
+        nice (int): increment of the nice value (0 to 19).
+        io_class (str): "best-effort", "idle" or None to keep it.
+
+    Returns:
+        List of strings describing the priorities applied.
+    """
+
+    applied = []
+
+    if nice:
+        try:
+            applied.append(f"nice {os.nice(nice)}")
+        except (AttributeError, OSError) as error:
+            print("Failed to set the nice value,", error)
+
+    if io_class is not None:
+        if set_io_priority(io_class):
+            applied.append(f"I/O class {io_class}")
+        else:
+            print("Failed to set the I/O class, not supported on this system.")
+
+    return applied
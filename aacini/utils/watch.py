@@ -0,0 +1,244 @@
+import ctypes
+import ctypes.util
+import os
+import pathlib
+import select
+import struct
+import sys
+import time
+
+######################################################################
+### Watcher functions
+######################################################################
+
+# inotify event flags (see "man 7 inotify")
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+# Events that mean a file was written or appeared in a directory
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# Size of the fixed part of an inotify event (wd, mask, cookie, len)
+EVENT_HEADER = struct.Struct("iIII")
+
+def list_visible_files(directory_path: str) -> list:
+    """
+    This function lists the paths of the files in a directory,
+    skipping files that start with "." (e.g. ".DS_Store" or the
+    temporary files written by rsync).
+
+    Args:
+        directory_path (str): path of the directory to list files from.
+
+    Returns:
+        List of file paths as strings.
+    """
+
+    file_path_list = []
+
+    # Recursively iterate through the directory
+    for file_path in pathlib.Path(directory_path).rglob("*"):
+        if file_path.is_file() and not file_path.name.startswith("."):
+            file_path_list.append(str(file_path))
+
+    return file_path_list
+
+class PollingWatcher:
+    """
+    Watcher that finds changed files by scanning the directory tree
+    at a fixed interval. Used where inotify is not available.
+    """
+
+    def __init__(self, directory_path: str, interval: float = 5.0):
+        self.directory_path = directory_path
+        self.interval = interval
+        self.last_scan = time.monotonic()
+
+    def wait(self, timeout: float) -> set:
+        """
+        Waits up to timeout seconds and returns the files found in
+        the directory if a scan was due. The debouncing of unchanged 
+        files is done by StabilityTracker.
+        """
+
+        time.sleep(max(0.0, min(timeout, 
+            self.last_scan + self.interval - time.monotonic())))
+        if time.monotonic() - self.last_scan < self.interval:
+            return set()
+
+        self.last_scan = time.monotonic()
+        return set(list_visible_files(self.directory_path))
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """
+    Watcher that receives the changed files from the Linux kernel
+    through inotify, adding a watch for every new subdirectory.
+    """
+
+    def __init__(self, directory_path: str):
+        self.directory_path = directory_path
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.add_tree(directory_path)
+
+    def add_tree(self, directory_path: str) -> set:
+        """
+        Adds a watch to a directory and its subdirectories and returns
+        the files already in them, since they could have been written
+        before the watch existed.
+        """
+
+        found_files = set()
+        for root, directories, files in os.walk(directory_path):
+            wd = self.libc.inotify_add_watch(self.fd,
+                os.fsencode(root), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = root
+            for name in files:
+                if not name.startswith("."):
+                    found_files.add(os.path.join(root, name))
+        return found_files
+
+    def wait(self, timeout: float) -> set:
+        """
+        Waits up to timeout seconds for events and returns the paths
+        of the files that changed.
+        """
+
+        changed_files = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed_files
+
+        # Read all the events queued in the file descriptor
+        try:
+            buffer = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed_files
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            # Events were lost, rescan the whole tree
+            if mask & IN_Q_OVERFLOW:
+                changed_files |= self.add_tree(self.directory_path)
+                continue
+
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+
+            # Watch new subdirectories (e.g. sample directories)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed_files |= self.add_tree(path)
+            elif not os.path.basename(path).startswith("."):
+                changed_files.add(path)
+
+        return changed_files
+
+    def close(self):
+        os.close(self.fd)
+
+def create_watcher(directory_path: str, polling: bool = False,
+    interval: float = 5.0):
+    """
+    This function creates an inotify watcher on Linux and falls back
+    to a polling watcher on other platforms or if inotify fails (e.g.
+    on some network filesystems or when the watch limit is reached).
+
+    Args:
+        directory_path (str): path of the directory to watch.
+        polling (bool): force the polling watcher.
+        interval (float): seconds between scans of the polling watcher.
+
+    Returns:
+        Tuple (as watcher, files) of the watcher and the files found
+        when the watch started.
+    """
+
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher(directory_path)
+            return watcher, set(list_visible_files(directory_path))
+        except (OSError, AttributeError) as error:
+            print("Inotify not available, using polling,", error)
+
+    watcher = PollingWatcher(directory_path, interval=interval)
+    return watcher, set(list_visible_files(directory_path))
+
+class StabilityTracker:
+    """
+    Debounces files until they are stable: a file is only handed out
+    once its size and modification time did not change for "settle"
+    seconds, and again only if it changes after being handed out.
+    """
+
+    def __init__(self, settle: float):
+        self.settle = settle
+        self.pending = {}
+        self.done = {}
+
+    def touch(self, paths: set):
+        """
+        Registers files that were reported by a watcher.
+        """
+
+        now = time.monotonic()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.pending.pop(path, None)
+                continue
+            stamp = (stat.st_size, stat.st_mtime_ns)
+
+            # Ignore files already processed with the same stamp
+            if self.done.get(path) == stamp:
+                continue
+            if path not in self.pending or self.pending[path][0] != stamp:
+                self.pending[path] = (stamp, now)
+
+    def pop_stable(self) -> list:
+        """
+        Returns the pending files that were stable for "settle"
+        seconds and marks them as processed.
+        """
+
+        now = time.monotonic()
+        stable_files = []
+        for path, (stamp, since) in list(self.pending.items()):
+            if now - since < self.settle:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+
+            # The file changed since it was last seen, wait again
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != stamp:
+                self.pending[path] = (current, now)
+                continue
+
+            del self.pending[path]
+            self.done[path] = stamp
+            stable_files.append(path)
+
+        return sorted(stable_files)
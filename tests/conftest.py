@@ -0,0 +1,48 @@
+import os
+import shutil
+
+import pytest
+from click.testing import CliRunner
+
+from aacini.commands.base import cli
+
+test_files = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "test_files")
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Empty working directory of the commands, the database is created
+    there.
+    """
+
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def make_ticket(workdir):
+    """
+    Copies the test files into a ticket directory of the working
+    directory.
+    """
+
+    def make(ticket: str) -> str:
+        ticket_path = os.path.join(workdir, ticket)
+        shutil.copytree(test_files, ticket_path)
+        return ticket_path
+
+    return make
+
+@pytest.fixture
+def run_command(workdir):
+    """
+    Runs a command of the aacini CLI and checks that it succeeded.
+    """
+
+    def run(*args) -> str:
+        result = CliRunner().invoke(cli, [str(arg) for arg in args],
+            catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    return run
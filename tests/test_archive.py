@@ -0,0 +1,86 @@
+import glob
+import os
+import sqlite3
+
+from aacini.utils.functions import create_aggregate_table
+from aacini.utils.functions import create_file_information_table
+
+def count(database: str, statement: str):
+    connection = sqlite3.connect(database)
+    try:
+        return connection.execute(statement).fetchone()
+    finally:
+        connection.close()
+
+def test_archive_twice_into_same_period(make_ticket, run_command, workdir):
+    # First delivery
+    make_ticket("TA")
+    run_command("extract", "-i", "TA")
+    run_command("archive", "--before", "2100-01-01")
+
+    # Second delivery of the same files and one changed file
+    ticket_path = make_ticket("TB")
+    with open(os.path.join(ticket_path, "X0054321", "test.doc"), "a") as changed_file:
+        changed_file.write("changed\n")
+    run_command("extract", "-i", "TB")
+    assert count("aacini.db", "SELECT COUNT(*) FROM file_information") == (77,)
+    run_command("archive", "--before", "2100-01-01")
+
+    archives = glob.glob(str(workdir / "aacini_*.db"))
+    assert len(archives) == 1
+    archive_path = archives[0]
+
+    # Nothing is left in the hot database and nothing was lost
+    assert count("aacini.db", "SELECT COUNT(*) FROM file_information") == (0,)
+    assert count("aacini.db", "SELECT COUNT(*) FROM observations") == (0,)
+    assert count(archive_path, "SELECT COUNT(*) FROM file_information") == (78,)
+    assert count(archive_path, """SELECT COUNT(*) FROM file_information
+        WHERE ticket = 'TB'""") == (1,)
+    assert count(archive_path, "SELECT COUNT(*) FROM observations") == (154,)
+    assert count(archive_path, "SELECT COUNT(*) FROM runs") == (2,)
+
+    # Every observation references a file of the archive
+    assert count(archive_path, """SELECT COUNT(*) FROM observations
+        WHERE file_id NOT IN (SELECT file_id FROM file_information)""") == (0,)
+    assert count(archive_path, "SELECT SUM(file_count) FROM ticket_aggregates") \
+        == (78,)
+    assert count("aacini.db", "SELECT COUNT(*) FROM ticket_archive") == (2,)
+
+def test_file_ids_of_previous_versions(workdir):
+    database = str(workdir / "previous.db")
+
+    # Table of previous versions, identified by rowid
+    connection = sqlite3.connect(database)
+    connection.execute("""CREATE TABLE file_information (
+        date text, ticket text, patient_id text, file_name text,
+        extension text, file_size real, first_hash text,
+        file_location text, hts text, status text, size_bytes integer,
+        last_seen integer,
+        UNIQUE(patient_id, file_name, first_hash))""")
+    connection.executemany("""INSERT INTO file_information
+        (rowid, ticket, patient_id, file_name, first_hash)
+        VALUES(?, 'T1', 'P1', ?, ?)""",
+        [(5, "a.vcf", "aa"), (9, "b.vcf", "bb")])
+    connection.commit()
+    connection.close()
+    create_aggregate_table(database)
+
+    create_file_information_table(database)
+
+    connection = sqlite3.connect(database)
+    try:
+        assert connection.execute("""SELECT file_id, file_name
+            FROM file_information ORDER BY file_id""").fetchall() \
+            == [(5, "a.vcf"), (9, "b.vcf")]
+
+        # The triggers are kept and file IDs are not reused
+        connection.execute("DELETE FROM file_information WHERE file_id = 9")
+        connection.execute("""INSERT INTO file_information
+            (ticket, patient_id, file_name) VALUES('T2', 'P1', 'c.vcf')""")
+        assert connection.execute("""SELECT MAX(file_id)
+            FROM file_information""").fetchone() == (10,)
+        assert connection.execute("""SELECT ticket, file_count
+            FROM ticket_aggregates ORDER BY ticket""").fetchall() \
+            == [("T1", 1), ("T2", 1)]
+    finally:
+        connection.close()
@@ -0,0 +1,52 @@
+import hashlib
+import os
+import tarfile
+import zipfile
+
+from aacini.utils.functions import list_files_under
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as opened_file:
+        return hashlib.sha256(opened_file.read()).hexdigest()
+
+def write_delivery(delivery_path, label: bytes) -> list:
+    # Files of the delivery, also in a subdirectory
+    members = {"SNV.somatic.vcf": b"##fileformat=VCFv4.2\n" * 1000 + label,
+        "reads/S1_R1.fastq": b"@read\nACGT\n+\nIIII\n" * 5000 + label,
+        "notes.txt": label}
+    (delivery_path / "reads").mkdir(parents=True)
+    for name, data in members.items():
+        (delivery_path / name).write_bytes(data)
+    return list(members)
+
+def test_member_hashes_match_unpacked_files(make_ticket, run_command, workdir):
+    ticket_path = make_ticket("TA")
+    patient_path = os.path.abspath(os.path.join(ticket_path, "X0054321"))
+
+    # Members with the same name and content are the same file, the
+    # bundles hold different versions
+    tar_path = workdir / "tar_delivery"
+    members = write_delivery(tar_path, b"tar")
+    with tarfile.open(os.path.join(patient_path, "delivery.tar.gz"), "w:gz") as tar:
+        for name in members:
+            tar.add(tar_path / name, arcname=name)
+    zip_path = workdir / "zip_delivery"
+    write_delivery(zip_path, b"zip")
+    with zipfile.ZipFile(os.path.join(patient_path, "delivery.zip"), "w",
+            compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for name in members:
+            zip_file.write(zip_path / name, arcname=name)
+
+    run_command("extract", "-i", "TA", "--bundles")
+
+    # Each member is recorded with the hash of the unpacked file, and the
+    # bundles with their own hash
+    recorded_hashes = {file_location: first_hash for _, _, file_location, first_hash,
+        _, _ in list_files_under("aacini.db", patient_path)}
+    for bundle_name, unpacked_path in [("delivery.tar.gz", tar_path),
+            ("delivery.zip", zip_path)]:
+        bundle_path = os.path.join(patient_path, bundle_name)
+        assert recorded_hashes[bundle_path] == file_digest(bundle_path)
+        for name in members:
+            assert recorded_hashes[f"{bundle_path}!/{name}"] \
+                == file_digest(unpacked_path / name)
@@ -0,0 +1,235 @@
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from conftest import test_files
+
+from aacini.commands import base
+from aacini.utils import catalog
+from aacini.utils.catalog import DatabaseBusyError
+from aacini.utils.catalog import lock_ticket
+from aacini.utils.catalog import unlock_ticket
+from aacini.utils.functions import create_run_tables
+from aacini.utils.functions import list_run_hashes
+from aacini.utils.functions import record_checkpoint
+
+# Writer processes, threads per process and checkpoints per thread
+WRITER_PROCESSES = 8
+WRITER_THREADS = 4
+WRITES = 25
+READER_PROCESSES = 3
+
+# Tickets extracted at the same time and files whose status is updated
+# meanwhile
+TICKETS = ["TB", "TC", "TD"]
+UPDATED_FILES = ["tumor.merged.cns", "multiqc_report.html", "tumor.merged-scatter.pdf"]
+
+repository = os.path.dirname(test_files)
+
+# The processes are forked, the catalog relies on flock and Linux
+context = multiprocessing.get_context("fork")
+
+def write_checkpoints(database: str, process: int):
+    def write(thread: int):
+        for write_number in range(WRITES):
+            record_checkpoint(
+                database= database,
+                run_id= 1,
+                patient_id= f"P{process}",
+                file_location= f"/ticket/P{process}/{thread}/{write_number}",
+                file_hash= "0"*64,
+                file_size= write_number)
+
+    threads = [threading.Thread(target=write, args=(thread,))
+        for thread in range(WRITER_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def hold_write_lock(database: str, seconds: float, locked):
+    # Another program holding a long write transaction
+    connection = sqlite3.connect(database, timeout=60, isolation_level=None)
+    connection.execute("BEGIN IMMEDIATE")
+    locked.set()
+    time.sleep(seconds)
+    connection.execute("COMMIT")
+    connection.close()
+
+def read_checkpoints(database: str, counts):
+    # Readers must always see a committed state, which only grows
+    previous_count = 0
+    for _ in range(50):
+        count = len(list_run_hashes(database=database, run_id=1))
+        if count < previous_count:
+            counts.put(-1)
+            return
+        previous_count = count
+    counts.put(previous_count)
+
+def test_concurrent_writers_and_readers(tmp_path):
+    database = str(tmp_path / "catalog.db")
+    create_run_tables(database=database)
+
+    locked = context.Event()
+    holder = context.Process(target=hold_write_lock, args=(database, 3.0, locked))
+    holder.start()
+    assert locked.wait(10)
+
+    counts = context.Queue()
+    processes = [context.Process(target=write_checkpoints, args=(database, process))
+        for process in range(WRITER_PROCESSES)]
+    processes += [context.Process(target=read_checkpoints, args=(database, counts))
+        for _ in range(READER_PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in [holder] + processes:
+        process.join(120)
+        assert process.exitcode == 0
+
+    reader_counts = [counts.get(timeout=10) for _ in range(READER_PROCESSES)]
+    assert all(count >= 0 for count in reader_counts)
+
+    # Every write was recorded exactly once
+    connection = sqlite3.connect(database)
+    try:
+        assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+        assert connection.execute("""SELECT COUNT(*), COUNT(DISTINCT file_location)
+            FROM run_checkpoints""").fetchone() \
+            == (WRITER_PROCESSES*WRITER_THREADS*WRITES,)*2
+    finally:
+        connection.close()
+
+def hold_ticket_lock(database: str, locked, release):
+    lock_file, _ = lock_ticket(database=database, ticket="T1")
+    locked.set()
+    release.wait(30)
+    unlock_ticket(lock_file)
+
+def test_ticket_lock(tmp_path):
+    database = str(tmp_path / "catalog.db")
+
+    locked, release = context.Event(), context.Event()
+    holder = context.Process(target=hold_ticket_lock, args=(database, locked, release))
+    holder.start()
+    assert locked.wait(10)
+
+    # The ticket is locked by the other process, other tickets are not
+    lock_file, owner = lock_ticket(database=database, ticket="T1")
+    assert lock_file is None
+    assert owner.endswith(f":{holder.pid}")
+    other_lock, _ = lock_ticket(database=database, ticket="T2")
+    assert other_lock is not None
+    unlock_ticket(other_lock)
+
+    # The lock is free once released
+    release.set()
+    holder.join(30)
+    lock_file, owner = lock_ticket(database=database, ticket="T1", wait=5)
+    assert lock_file is not None and owner is None
+    unlock_ticket(lock_file)
+
+def test_locked_database_raises_after_retries(tmp_path, monkeypatch):
+    database = str(tmp_path / "catalog.db")
+    create_run_tables(database=database)
+
+    locked = context.Event()
+    holder = context.Process(target=hold_write_lock, args=(database, 5.0, locked))
+    holder.start()
+    assert locked.wait(10)
+
+    # The write is not printed and skipped once the retries ran out
+    monkeypatch.setattr(catalog, "BUSY_TIMEOUT", 0.1)
+    monkeypatch.setattr(catalog, "MAX_RETRIES", 2)
+    monkeypatch.setattr(catalog, "INITIAL_BACKOFF", 0.01)
+    try:
+        with pytest.raises(DatabaseBusyError, match="after 3 tries"):
+            record_checkpoint(
+                database= database,
+                run_id= 1,
+                patient_id= "P1",
+                file_location= "/ticket/P1/file",
+                file_hash= "0"*64,
+                file_size= 1)
+    finally:
+        holder.join(30)
+
+def start_command(*args) -> subprocess.Popen:
+    environment = dict(os.environ, PYTHONPATH=repository)
+    return subprocess.Popen([sys.executable, "-m", "aacini.commands.base", *args],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        env=environment)
+
+def start_status_updates() -> list:
+    return [start_command("update_status", "-pid", patient_id, "-fn", file_name,
+            "-st", "other")
+        for file_name in UPDATED_FILES for patient_id in os.listdir(test_files)]
+
+def wait_commands(commands: list):
+    for command in commands:
+        output = command.communicate(timeout=300)[0]
+        assert command.returncode == 0, output
+        assert "Failed to" not in output, output
+
+def test_concurrent_extracts_and_status_updates(make_ticket, run_command):
+    # Copies of the same files are recorded once, the patients of the
+    # other tickets get their own IDs
+    make_ticket("TA")
+    for ticket in TICKETS:
+        ticket_path = make_ticket(ticket)
+        for patient_id in os.listdir(ticket_path):
+            os.rename(os.path.join(ticket_path, patient_id),
+                os.path.join(ticket_path, f"{patient_id}{ticket}"))
+    run_command("extract", "-i", "TA")
+
+    # Tickets are extracted while the statuses of the first one change
+    commands = [start_command("extract", "-i", ticket) for ticket in TICKETS]
+    commands += start_status_updates()
+    wait_commands(commands)
+
+    # The statuses are set again by each extract, check the updates once
+    # they only compete with another writer
+    locked = context.Event()
+    holder = context.Process(target=hold_write_lock, args=("aacini.db", 2.0, locked))
+    holder.start()
+    assert locked.wait(10)
+    wait_commands(start_status_updates())
+    holder.join(30)
+
+    # No file and no status update was lost
+    connection = sqlite3.connect("aacini.db")
+    try:
+        assert dict(connection.execute("""SELECT ticket, COUNT(*)
+            FROM file_information GROUP BY ticket""").fetchall()) \
+            == {ticket: 77 for ticket in ["TA"] + TICKETS}
+        statuses = connection.execute(f"""SELECT DISTINCT status
+            FROM file_information WHERE ticket = 'TA'
+                AND file_name IN ({", ".join("?"*len(UPDATED_FILES))})""",
+            UPDATED_FILES).fetchall()
+        assert statuses == [("other",)]
+    finally:
+        connection.close()
+
+def test_ticket_lock_released_on_error(make_ticket, workdir, monkeypatch):
+    make_ticket("TA")
+
+    def fail(database: str):
+        raise RuntimeError("extract failed")
+
+    # The commands stop with an error once the ticket is locked
+    monkeypatch.setattr(base, "create_run_tables", fail)
+    monkeypatch.setattr(base, "create_file_information_table", fail)
+    for args in [["extract", "-i", "TA"], ["watch", "-i", "TA", "--idle_exit", "1"]]:
+        result = CliRunner().invoke(base.cli, args)
+        assert isinstance(result.exception, RuntimeError)
+
+        lock_file, owner = lock_ticket(database="aacini.db", ticket="TA")
+        assert lock_file is not None and owner is None
+        unlock_ticket(lock_file)
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+
+from aacini.utils.digest_index import DigestIndex
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as opened_file:
+        return hashlib.sha256(opened_file.read()).hexdigest()
+
+def test_index_updated_after_archive(make_ticket, run_command):
+    make_ticket("TA")
+    output = run_command("extract", "-i", "TA", "--index", "aacini.idx")
+    assert "Digest index: 77 records (77 new)" in output
+    run_command("archive", "--before", "2100-01-01")
+
+    # A file of the new ticket was not delivered before
+    ticket_path = make_ticket("TB")
+    changed_path = os.path.join(ticket_path, "X0054321", "test.doc")
+    with open(changed_path, "a") as changed_file:
+        changed_file.write("changed\n")
+    output = run_command("extract", "-i", "TB", "--index", "aacini.idx")
+    assert "Digest index: 154 records (77 new)" in output
+
+    with DigestIndex("aacini.idx") as index:
+        assert index.seen(file_digest(changed_path), os.path.getsize(changed_path))
+
+def test_index_rebuilt_when_file_ids_go_back(make_ticket, run_command):
+    make_ticket("TA")
+    run_command("extract", "-i", "TA", "--index", "aacini.idx")
+
+    # A new database with fewer files than the index has seen
+    os.remove("aacini.db")
+    ticket_path = make_ticket("TB")
+    shutil.rmtree(os.path.join(ticket_path, "X0010101"))
+    run_command("extract", "-i", "TB")
+    output = run_command("export-index", "-o", "aacini.idx")
+    assert "rebuilding the index" in output
+
+    # Same records as an index written from scratch
+    run_command("export-index", "-o", "full.idx")
+    with DigestIndex("aacini.idx") as index, DigestIndex("full.idx") as full_index:
+        assert index.last_file_id == full_index.last_file_id
+        assert list(index.records()) == list(full_index.records())
+
+def test_index_rebuilt_when_sizes_are_filled(make_ticket, run_command):
+    make_ticket("TA")
+    run_command("extract", "-i", "TA")
+
+    # Records migrated from text sizes are left out until seen again
+    connection = sqlite3.connect("aacini.db")
+    connection.execute("""UPDATE file_information SET size_bytes = NULL
+        WHERE patient_id = 'X0054321'""")
+    connection.commit()
+    unsized_count = connection.execute("""SELECT COUNT(*) FROM file_information
+        WHERE size_bytes IS NULL""").fetchone()[0]
+    connection.close()
+    output = run_command("export-index", "-o", "aacini.idx")
+    assert f"Digest index: {77 - unsized_count} records" in output
+    with DigestIndex("aacini.idx") as index:
+        assert index.unsized_count == unsized_count
+
+    # The sizes are filled keeping the file IDs
+    output = run_command("extract", "-i", "TA", "--index", "aacini.idx")
+    assert "rebuilding the index" in output
+    assert "Digest index: 77 records (77 new)" in output
+
+    run_command("export-index", "-o", "full.idx", "--full")
+    with DigestIndex("aacini.idx") as index, DigestIndex("full.idx") as full_index:
+        assert index.unsized_count == 0
+        assert list(index.records()) == list(full_index.records())
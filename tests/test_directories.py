@@ -0,0 +1,48 @@
+from aacini.utils.catalog import connect_database
+from aacini.utils.functions import create_file_information_table
+from aacini.utils.functions import get_directory_id
+from aacini.utils.functions import list_files_under
+from aacini.utils.functions import record_file_info
+
+def count_directories(database: str) -> int:
+    connection = connect_database(database)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM directories").fetchone()[0]
+    finally:
+        connection.close()
+
+def test_directory_ids_cached(tmp_path):
+    database = str(tmp_path / "catalog.db")
+    create_file_information_table(database=database)
+
+    # The directories recorded by a transaction rolled back are not cached
+    connection = connect_database(database)
+    cursor = connection.cursor()
+    get_directory_id(cursor, "/ticket/P1")
+    connection.rollback()
+    assert get_directory_id(cursor, "/ticket/P1", create=False) is None
+    directory_id = get_directory_id(cursor, "/ticket/P1")
+    connection.commit()
+    connection.close()
+
+    # Other connections of the process read the cached ID
+    connection = connect_database(database)
+    cursor = connection.cursor()
+    assert get_directory_id(cursor, "/ticket/P1") == directory_id
+    assert count_directories(database) == 3
+    connection.close()
+
+def test_files_under_keep_their_location(tmp_path):
+    database = str(tmp_path / "catalog.db")
+    create_file_information_table(database=database)
+
+    # Members of a bundle are recorded with their location in the bundle
+    for file_name, abs_path in [("SNV.vcf.gz", "/ticket/P1/SNV.vcf.gz"),
+            ("reads/S1_R1.fastq.gz", "/ticket/P1/run.tar!/reads/S1_R1.fastq.gz")]:
+        record_file_info(database=database, ticket="ticket", patient_id="P1",
+            file_name=file_name, extension="gz", file_size="1 B",
+            first_hash=file_name.ljust(64, "0"), abs_path=abs_path,
+            file_type="vcf", size_bytes=1)
+
+    assert [record[2] for record in list_files_under(database, "/ticket/P1")] \
+        == ["/ticket/P1/SNV.vcf.gz", "/ticket/P1/run.tar!/reads/S1_R1.fastq.gz"]
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+feather = pytest.importorskip("pyarrow.feather")
+
+def test_export_catalog(make_ticket, run_command):
+    make_ticket("TA")
+    run_command("extract", "-i", "TA")
+    ticket_path = make_ticket("TB")
+    changed_path = os.path.join(ticket_path, "X0054321", "test.doc")
+    with open(changed_path, "a") as changed_file:
+        changed_file.write("changed\n")
+    run_command("extract", "-i", "TB")
+
+    # Several parts per table, partitioned by ticket
+    output = run_command("export", "-o", "parquet_export", "--chunk_size", "50")
+    assert "file_information: 78 records" in output
+    assert sorted(os.listdir(os.path.join("parquet_export", "file_information"))) \
+        == ["ticket=TA", "ticket=TB"]
+
+    exported = pd.read_parquet(os.path.join("parquet_export", "file_information"))
+    connection = sqlite3.connect("aacini.db")
+    try:
+        recorded = connection.execute("""SELECT file_id, ticket, patient_id,
+                file_name, first_hash, size_bytes
+            FROM file_information ORDER BY file_id""").fetchall()
+    finally:
+        connection.close()
+    exported = exported.sort_values("file_id")
+    assert [(file_id, str(ticket), str(patient_id), file_name, first_hash, size_bytes)
+        for file_id, ticket, patient_id, file_name, first_hash, size_bytes
+        in exported[["file_id", "ticket", "patient_id", "file_name",
+            "first_hash", "size_bytes"]].itertuples(index=False)] == recorded
+
+    # Paths are rebuilt from the directory IDs
+    changed_record = exported[exported["ticket"] == "TB"].iloc[0]
+    assert changed_record["file_location"] == os.path.abspath(changed_path)
+
+    # Only the records of a ticket, as Arrow IPC files
+    output = run_command("export", "-o", "feather_export", "-t", "TB",
+        "--format", "feather")
+    assert "file_information: 1 records" in output
+    feather_path = os.path.join("feather_export", "file_information", "ticket=TB",
+        "part-00000.arrow")
+    assert feather.read_table(feather_path).column("file_name").to_pylist() \
+        == ["test.doc"]
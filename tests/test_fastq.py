@@ -0,0 +1,47 @@
+import gzip
+import io
+import random
+
+from aacini.utils.fastq import count_fastq
+from aacini.utils.fastq import read_line_blocks
+
+def fastq_records(read_count: int, read_length: int = 100) -> bytes:
+    generator = random.Random(1)
+    return b"".join(b"@read%d\n%s\n+\n%s\n" % (number,
+            bytes(generator.choice(b"ACGT") for _ in range(read_length)),
+            b"I"*read_length)
+        for number in range(read_count))
+
+def test_blocks_split_inside_records():
+    data = fastq_records(1000, read_length=37)
+
+    # Blocks end at any line, the lines are the same
+    for size in [1, 7, 64, 1000, 10**6]:
+        blocks = list(read_line_blocks(io.BytesIO(data), size=size))
+        assert [line for block in blocks for line in block] \
+            == data.split(b"\n")[:-1]
+
+def test_count_fastq(tmp_path):
+    fastq_path = str(tmp_path / "S1_R1.fastq.gz")
+    with gzip.open(fastq_path, "wb") as fastq_file:
+        fastq_file.write(fastq_records(20000))
+
+    assert count_fastq(fastq_path) == {"reads": 20000, "bases": 2000000,
+        "result": "ok"}
+
+def test_truncated_fastq_keeps_complete_records(tmp_path):
+    fastq_path = str(tmp_path / "S1_R1.fastq.gz")
+    with gzip.open(fastq_path, "wb") as fastq_file:
+        fastq_file.write(fastq_records(20000))
+    with open(fastq_path, "rb") as fastq_file:
+        compressed = fastq_file.read()
+
+    # Cut inside the first block of lines
+    truncated_path = str(tmp_path / "S2_R1.fastq.gz")
+    with open(truncated_path, "wb") as truncated_file:
+        truncated_file.write(compressed[:len(compressed) // 2])
+
+    counts = count_fastq(truncated_path)
+    assert counts["result"] == "truncated"
+    assert 0 < counts["reads"] < 20000
+    assert counts["bases"] == counts["reads"]*100
@@ -0,0 +1,48 @@
+import json
+import sqlite3
+
+from aacini.utils.analyzers import load_cached_results
+from aacini.utils.headers import compare_samples
+from aacini.utils.headers import create_header_tables
+from aacini.utils.headers import header_analyzer
+
+def test_header_metadata_moved_to_cache(tmp_path):
+    database = str(tmp_path / "previous.db")
+
+    # Cache of the headers of previous versions
+    connection = sqlite3.connect(database)
+    connection.execute("""CREATE TABLE header_metadata (
+        sha256 text PRIMARY KEY, header_type text, samples text,
+        reference_build text, read_at integer)""")
+    connection.executemany("INSERT INTO header_metadata VALUES(?, ?, ?, ?, ?)",
+        [("a"*64, "vcf", json.dumps(["X0010101", "normal"]), "GRCh38", 100),
+        ("b"*64, "bam", None, None, 200)])
+    connection.commit()
+    connection.close()
+
+    create_header_tables(database)
+
+    assert load_cached_results(database, header_analyzer, {"a"*64, "b"*64}) == {
+        "a"*64: {"samples": ["X0010101", "normal"], "reference_build": "GRCh38"},
+        "b"*64: None}
+    connection = sqlite3.connect(database)
+    try:
+        assert connection.execute("""SELECT COUNT(*) FROM sqlite_master
+            WHERE name = 'header_metadata'""").fetchone() == (0,)
+    finally:
+        connection.close()
+
+    # Nothing left to move the next time
+    create_header_tables(database)
+
+def test_compare_samples():
+    # Short names only match exactly
+    assert compare_samples(["P01"], {"p01"}) == "match"
+    assert compare_samples(["P01"], {"p012345"}) == "mismatch"
+    assert compare_samples(["XP01"], {"p01"}) == "mismatch"
+
+    # Longer names also match as part of the sample names
+    assert compare_samples(["X0010101_tumor"], {"x0010101"}) == "match"
+    assert compare_samples(["X0010101"], {"x0010101_ms"}) == "match"
+    assert compare_samples(["X0012345"], {"x0010101"}) == "mismatch"
+    assert compare_samples(["TUMOR", "normal"], {"x0010101"}) == "unknown"
@@ -0,0 +1,41 @@
+import gzip
+import os
+
+from aacini.utils.functions import check_files_integrity
+from aacini.utils.functions import check_gzip_eof
+from aacini.utils.functions import make_file_entry
+from aacini.utils.functions import scan_gzip_blocks
+
+def write_file(path, data: bytes) -> str:
+    with open(path, "wb") as written_file:
+        written_file.write(data)
+    return str(path)
+
+def test_plain_gzip_trailer(tmp_path):
+    data = gzip.compress(b"##fileformat=VCFv4.2\n" * 10000)
+    complete = write_file(tmp_path / "complete.vcf.gz", data)
+    truncated = write_file(tmp_path / "truncated.vcf.gz", data[:len(data)//2])
+
+    # The CRC of the trailer does not match the data
+    crc = bytes(byte ^ 0xff for byte in data[-8:-4])
+    wrong_crc = write_file(tmp_path / "wrong_crc.vcf.gz", data[:-8] + crc + data[-4:])
+
+    for check in [check_gzip_eof, scan_gzip_blocks]:
+        assert check(complete) == "ok"
+        assert check(truncated) == "truncated"
+        assert check(wrong_crc) == "truncated"
+
+def test_files_integrity(tmp_path):
+    patient_path = tmp_path / "P1"
+    patient_path.mkdir()
+    complete = write_file(patient_path / "SNV.vcf.gz", gzip.compress(b"#CHROM\n"))
+    empty = write_file(patient_path / "SV.vcf.gz", b"")
+    removed = write_file(patient_path / "CNV.vcf.gz", gzip.compress(b"#CHROM\n"))
+    file_entries = [make_file_entry(file, "P1") for file in [complete, empty, removed]]
+
+    # Empty files are not checked, removed files get their own result
+    os.remove(removed)
+    for deep_scan in [False, True]:
+        assert {entry.name: result for entry, result in check_files_integrity(
+                file_entries, deep_scan=deep_scan)} \
+            == {"SNV.vcf.gz": "ok", "CNV.vcf.gz": "unreadable"}
@@ -0,0 +1,71 @@
+import hashlib
+import os
+import sqlite3
+
+from aacini.utils import scheduler
+from aacini.utils.constants import xattr_sha256
+from aacini.utils.functions import find_linked_entries
+from aacini.utils.functions import make_file_entry
+from aacini.utils.functions import share_linked_hashes
+
+def test_linked_files_read_once(make_ticket, run_command, monkeypatch):
+    ticket_path = make_ticket("TA")
+    sample_path = os.path.join(ticket_path, "X0010101", "sample.vcf")
+    with open(sample_path, "w") as sample_file:
+        sample_file.write("##fileformat=VCFv4.2\n")
+    os.link(sample_path, os.path.join(ticket_path, "X0010101", "sample_copy.vcf"))
+    os.symlink("sample.vcf", os.path.join(ticket_path, "X0010101", "sample_link.vcf"))
+    os.link(sample_path, os.path.join(ticket_path, "X0012345", "shared.vcf"))
+
+    hashed_paths = []
+    create_sha256 = scheduler.create_sha256
+    def record_and_hash(file: str, **options) -> str:
+        hashed_paths.append(file)
+        return create_sha256(file, **options)
+    monkeypatch.setattr(scheduler, "create_sha256", record_and_hash)
+
+    run_command("extract", "-i", "TA")
+
+    # The four names of the file are recorded with the same hash, the
+    # file is read once
+    linked_names = {"sample.vcf", "sample_copy.vcf", "sample_link.vcf", "shared.vcf"}
+    assert len([path for path in hashed_paths
+        if os.path.basename(path) in linked_names]) == 1
+    connection = sqlite3.connect("aacini.db")
+    try:
+        records = connection.execute(f"""SELECT file_name, link_type, first_hash
+            FROM file_information WHERE file_name IN
+                ({", ".join("?"*len(linked_names))})""",
+            sorted(linked_names)).fetchall()
+    finally:
+        connection.close()
+    sample_hash = hashlib.sha256(b"##fileformat=VCFv4.2\n").hexdigest()
+    assert sorted(records) == [
+        ("sample.vcf", "hardlink", sample_hash),
+        ("sample_copy.vcf", "hardlink", sample_hash),
+        ("sample_link.vcf", "symlink", sample_hash),
+        ("shared.vcf", "hardlink", sample_hash)]
+
+def test_links_to_unhashed_files_use_run_options(tmp_path):
+    sample_path = str(tmp_path / "sample.vcf")
+    with open(sample_path, "w") as sample_file:
+        sample_file.write("##fileformat=VCFv4.2\n")
+    copy_path = str(tmp_path / "sample_copy.vcf")
+    os.link(sample_path, copy_path)
+    file_entries = [make_file_entry(file, "P1") for file in [sample_path, copy_path]]
+    linked_paths = find_linked_entries(file_entries)
+    assert linked_paths == {copy_path: sample_path}
+
+    # The file linked to was not hashed (e.g. it could not be read), the
+    # link is hashed with the options of the run
+    hashed_files = list(share_linked_hashes(
+        hashed_files= [],
+        linked_entries= file_entries[1:],
+        linked_paths= linked_paths,
+        shared_hashes= {},
+        xattr_cache= True))
+
+    sample_hash = hashlib.sha256(b"##fileformat=VCFv4.2\n").hexdigest()
+    assert [(entry.path, file_hash) for entry, file_hash in hashed_files] \
+        == [(copy_path, sample_hash)]
+    assert os.getxattr(copy_path, xattr_sha256).decode().startswith(sample_hash)
@@ -0,0 +1,44 @@
+import os
+
+def test_verify_finds_changed_files(make_ticket, run_command):
+    ticket_path = make_ticket("TA")
+    run_command("extract", "-i", "TA")
+    output = run_command("verify", "-i", "TA")
+    assert "Ticket TA intact" in output
+
+    with open(os.path.join(ticket_path, "X0054321", "test.doc"), "a") as changed_file:
+        changed_file.write("changed\n")
+    os.utime(os.path.join(ticket_path, "X0010101", "multiqc_report.html"), (0, 0))
+    os.remove(os.path.join(ticket_path, "X0012345", "anotherweirdfile.cram"))
+
+    # Only the directories of the changed files are inspected
+    output = run_command("verify", "-i", "TA")
+    assert "Ticket TA changed:" in output
+    assert "Changed:\n   - X0054321/test.doc\n" in output
+    assert "Missing:\n   - X0012345/anotherweirdfile.cram\n" in output
+    assert "Extra:\n   - None\n" in output
+    assert "Touched (same content):\n   - X0010101/multiqc_report.html\n" in output
+    assert "Directories inspected: 4" in output
+
+def test_full_verify_finds_content_changes(make_ticket, run_command):
+    ticket_path = make_ticket("TA")
+    changed_path = os.path.join(ticket_path, "X0054321", "Lymfoid_220301_AK.json")
+    with open(changed_path, "w") as changed_file:
+        changed_file.write('{"sample": "X0054321"}')
+    run_command("extract", "-i", "TA")
+
+    # Same size and modification time, another content
+    stat = os.stat(changed_path)
+    with open(changed_path, "w") as changed_file:
+        changed_file.write('{"sample": "X0012345"}')
+    os.utime(changed_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    output = run_command("verify", "-i", "TA")
+    assert "Ticket TA intact" in output
+    output = run_command("verify", "-i", "TA", "--full")
+    assert "Changed:\n   - X0054321/Lymfoid_220301_AK.json\n" in output
+
+    # The tree stored again matches the files
+    run_command("verify", "-i", "TA", "--full", "--update")
+    output = run_command("verify", "-i", "TA", "--full")
+    assert "Ticket TA intact" in output
@@ -0,0 +1,51 @@
+import os
+import sqlite3
+
+def test_output_summaries(make_ticket, run_command):
+    ticket_path = make_ticket("TA")
+    patient_path = os.path.join(ticket_path, "X0012345")
+
+    # A gain, a loss and a neutral segment
+    with open(os.path.join(patient_path, "tumor.merged.cns"), "w") as cns_file:
+        cns_file.write("chromosome\tstart\tend\tgene\tlog2\tprobes\n"
+            "chr1\t0\t1000\tA\t0.5\t10\n"
+            "chr1\t1000\t3000\tB\t-0.6\t20\n"
+            "chr2\t0\t1000\tC\t0.1\t5\n")
+    with open(os.path.join(patient_path, "X0012345.gene_metrics"), "w") as metrics_file:
+        metrics_file.write("gene\tmean_coverage\tpct_20x\n"
+            "A\t10\t0.4\nB\t30\t0.9\nC\t50\t1.0\nD\t100\t1.0\n")
+    with open(os.path.join(patient_path,
+            "CNV.somatic.X0012345.cnvkit.vcf2cytosure.cgh"), "w") as cgh_file:
+        cgh_file.write("<cgh><probes><probe/><probe/><probe/></probes>"
+            "<segmentation><segment start=\"0\" stop=\"500\" average=\"-0.5\"/>"
+            "<segment start=\"500\" stop=\"1500\" average=\"0.0\"/>"
+            "</segmentation></cgh>")
+
+    run_command("extract", "-i", "TA", "--parse_outputs")
+
+    connection = sqlite3.connect("aacini.db")
+    try:
+        copy_number = {(row[0], row[1]): row[2:] for row in connection.execute(
+            """SELECT patient_id, file_name, file_type, status, probe_count,
+                segment_count, altered_segments, gain_length, loss_length,
+                altered_length, total_length, mean_abs_log2
+            FROM copy_number_summary""")}
+        gene_metrics = {(row[0], row[1]): row[2:] for row in connection.execute(
+            """SELECT patient_id, file_name, status, gene_count, coverage_column,
+                coverage_mean, coverage_median, coverage_min, low_coverage_genes
+            FROM gene_metrics_summary""")}
+    finally:
+        connection.close()
+
+    assert copy_number[("X0012345", "tumor.merged.cns")] == (
+        "cns", "parsed", 35, 3, 2, 1000, 2000, 3000, 4000, 0.45)
+    assert copy_number[("X0012345", "CNV.somatic.X0012345.cnvkit.vcf2cytosure.cgh")] == (
+        "cgh", "parsed", 3, 2, 1, 0, 500, 500, 1500, 0.1667)
+    assert gene_metrics[("X0012345", "X0012345.gene_metrics")] == (
+        "parsed", 4, "mean_coverage", 47.5, 40.0, 10.0, 1)
+
+    # Empty files and files in another format get a status only
+    assert copy_number[("X0010101", "tumor.merged.cns")][1:3] == ("empty", None)
+    assert copy_number[("X0010101",
+        "CNV.somatic.X0010101.cnvkit.vcf2cytosure.cgh")][1:3] == ("unparsed", None)
+    assert gene_metrics[("X0010101", "X0010101.gene_metrics")][:2] == ("empty", None)
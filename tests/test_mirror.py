@@ -0,0 +1,35 @@
+import os
+import shutil
+import time
+
+from click.testing import CliRunner
+
+from aacini.commands.base import cli
+
+def test_recorded_hashes_reused(make_ticket, run_command):
+    ticket_path = make_ticket("TA")
+    report_path = os.path.join(ticket_path, "X0010101", "multiqc_report.html")
+    with open(report_path, "w") as report:
+        report.write("<html>first report</html>")
+
+    # Hashes are reused for files not changed since the second recorded
+    time.sleep(1.1)
+    run_command("extract", "-i", "TA")
+    shutil.copytree("TA", "copy", copy_function=shutil.copy2)
+
+    output = run_command("verify-copy", "-s", "TA", "-m", "copy")
+    assert "Identical files: 77 (source hashes reused: 77)" in output
+    assert "Copy copy is identical to TA." in output
+
+    # A source file replaced by a copy keeping the size and modification
+    # time of the recorded file is hashed again
+    stat = os.stat(report_path)
+    with open(report_path, "w") as report:
+        report.write("<html>other report</html>")
+    os.utime(report_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    result = CliRunner().invoke(cli, ["verify-copy", "-s", "TA", "-m", "copy"])
+    assert result.exit_code == 1
+    output = result.output
+    assert "Identical files: 76 (source hashes reused: 76)" in output
+    assert "X0010101/multiqc_report.html (digest)" in output
@@ -0,0 +1,44 @@
+import json
+import os
+import sqlite3
+
+from click.testing import CliRunner
+
+from aacini.commands.base import cli
+
+def test_changed_files_between_dates(make_ticket, run_command):
+    ticket_path = make_ticket("TA")
+    run_command("extract", "-i", "TA")
+
+    # Deliver a new content of a file later
+    with open(os.path.join(ticket_path, "X0054321", "test.doc"), "a") as changed_file:
+        changed_file.write("changed\n")
+    run_command("extract", "-i", "TA")
+    connection = sqlite3.connect("aacini.db")
+    connection.execute("""UPDATE file_information SET first_seen = first_seen + 86400
+        WHERE file_id = (SELECT MAX(file_id) FROM file_information
+            WHERE file_name = 'test.doc')""")
+    connection.commit()
+    connection.close()
+
+    output = run_command("query", "-t", "TA", "--changes", "--format", "jsonl")
+    changes = [json.loads(line) for line in output.splitlines()]
+    assert len(changes) == 78
+    assert [(change["file_name"], change["change"]) for change in changes
+        if change["change"] == "changed"] == [("test.doc", "changed")]
+
+    # Only the change is in the day after the first delivery
+    connection = sqlite3.connect("aacini.db")
+    first_seen = connection.execute("""SELECT date(MAX(first_seen), 'unixepoch',
+        'localtime') FROM file_information""").fetchone()[0]
+    connection.close()
+    output = run_command("query", "-t", "TA", "--changes", "--since", first_seen,
+        "--format", "tsv")
+    assert output.splitlines()[1:] and all(line.endswith("\tchanged")
+        for line in output.splitlines()[1:])
+
+def test_invalid_dates(workdir):
+    for command in ["query", "export"]:
+        result = CliRunner().invoke(cli, [command, "--since", "2022-13-01"])
+        assert result.exit_code == 2
+        assert "Invalid value for '--since'" in result.output
@@ -0,0 +1,26 @@
+import hashlib
+import os
+
+from aacini.utils.functions import make_file_entry
+from aacini.utils.scheduler import hash_files
+
+def test_unreadable_file_is_left_out(tmp_path, capsys):
+    files = []
+    for number in range(6):
+        file = str(tmp_path / f"file{number}.vcf.gz")
+        with open(file, "wb") as written_file:
+            written_file.write(b"%d" % number * (number*1000 + 1))
+        files.append(file)
+    file_entries = [make_file_entry(file, "P1") for file in files]
+
+    # A file removed after it was listed, in both lanes
+    os.remove(files[1])
+    os.remove(files[4])
+    hashes = {entry.path: file_hash for entry, file_hash in hash_files(
+        file_entries, large_file_size=3000)}
+
+    assert hashes == {file: hashlib.sha256(open(file, "rb").read()).hexdigest()
+        for file in files if os.path.exists(file)}
+    output = capsys.readouterr().out
+    assert f"Could not read {files[1]}, No such file or directory" in output
+    assert f"Could not read {files[4]}, No such file or directory" in output
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+
+from aacini.commands import base
+
+def test_file_removed_before_hashing(make_ticket, run_command, monkeypatch):
+    make_ticket("TA")
+
+    # The file is removed after it settled, before it is read
+    make_file_entry = base.make_file_entry
+    def remove_and_make_entry(file: str, patient_id: str):
+        if (patient_id, os.path.basename(file)) == ("X0054321", "test.doc"):
+            os.remove(file)
+        return make_file_entry(file, patient_id)
+    monkeypatch.setattr(base, "make_file_entry", remove_and_make_entry)
+
+    output = run_command("watch", "-i", "TA", "--poll", "--settle", "0",
+        "--interval", "0.2", "--idle_exit", "1")
+
+    # The watcher goes on with the other files
+    assert "X0054321: skipped test.doc (No such file or directory)" in output
+    connection = sqlite3.connect("aacini.db")
+    try:
+        file_names = connection.execute("""SELECT patient_id, file_name
+            FROM file_information""").fetchall()
+    finally:
+        connection.close()
+    assert len(file_names) == 76
+    assert ("X0054321", "test.doc") not in file_names
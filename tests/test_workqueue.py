@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+from aacini.utils.constants import xattr_sha256
+
+from conftest import test_files
+
+repository = os.path.dirname(test_files)
+
+def file_hashes(database: str) -> set:
+    connection = sqlite3.connect(database)
+    try:
+        return set(connection.execute("""SELECT patient_id, file_name,
+            first_hash, size_bytes FROM file_information""").fetchall())
+    finally:
+        connection.close()
+
+def start_worker(queue: str, *options) -> subprocess.Popen:
+    environment = dict(os.environ, PYTHONPATH=repository)
+    return subprocess.Popen([sys.executable, "-m", "aacini.commands.base",
+            "worker", "-q", queue, "--poll", "0.2", "--idle_exit", "5", *options],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        env=environment)
+
+def test_workers_hash_like_a_local_run(make_ticket, run_command, workdir):
+    make_ticket("TA")
+    run_command("extract", "-i", "TA", "-db", "local.db")
+
+    queue = str(workdir / "queue.db")
+    workers = [start_worker(queue) for _ in range(2)]
+    try:
+        output = run_command("extract", "-i", "TA", "-db", "queued.db",
+            "-q", queue, "--queue_poll", "0.2", "--queue_timeout", "120")
+    finally:
+        worker_outputs = [worker.communicate(timeout=60)[0] for worker in workers]
+
+    # Every file was hashed by the workers, none by the coordinator
+    assert "Files enqueued for the workers: 77" in output
+    assert "locally" not in output
+    hashed_files = [int(line.split(":")[1]) for worker_output in worker_outputs
+        for line in worker_output.splitlines() if line.startswith("Files hashed:")]
+    assert sum(hashed_files) == 77
+    assert file_hashes("queued.db") == file_hashes("local.db")
+
+def test_worker_options(make_ticket, run_command, workdir):
+    ticket_path = make_ticket("TA")
+
+    queue = str(workdir / "queue.db")
+    worker = start_worker(queue, "--xattr_cache", "--max_rate", "100",
+        "--max_open_files", "1")
+    try:
+        run_command("extract", "-i", "TA", "-q", queue, "--queue_poll", "0.2",
+            "--queue_timeout", "120")
+    finally:
+        worker_output = worker.communicate(timeout=60)[0]
+
+    # The worker read the files within its limits and cached the hashes
+    assert "Files hashed: 77" in worker_output
+    assert "Throttling:" in worker_output
+    sample_path = os.path.join(ticket_path, "X0054321", "test.doc")
+    assert os.getxattr(sample_path, xattr_sha256)
+
+def test_files_hashed_locally_without_workers(make_ticket, run_command):
+    ticket_path = make_ticket("TA")
+    run_command("extract", "-i", "TA", "-db", "local.db")
+
+    # The coordinator hashes the files with the options of its run
+    output = run_command("extract", "-i", "TA", "-db", "queued.db",
+        "-q", "queue.db", "--queue_poll", "0.1", "--queue_timeout", "0.5",
+        "--xattr_cache", "--max_open_files", "1")
+    assert "hashing" in output and "files locally" in output
+    assert file_hashes("queued.db") == file_hashes("local.db")
+    assert os.getxattr(os.path.join(ticket_path, "X0054321", "test.doc"),
+        xattr_sha256)
+
+    # Nothing is left in the queue
+    connection = sqlite3.connect("queue.db")
+    try:
+        assert connection.execute("SELECT COUNT(*) FROM work_items").fetchone() \
+            == (0,)
+    finally:
+        connection.close()